@@ -0,0 +1,175 @@
+# One-pass feature ablation: writes the .vector files of many feature-type
+# subsets (or all 128 of them) while reading and tokenizing the input files only
+# once. Requires numpy.
+#
+# 1. The vocabulary is built once with every feature type on, remembering which
+#    feature type added each id (id_types).
+# 2. Every token of the training and test file is vectorized once, and its ids
+#    are stored by feature type in a columnar store: a directory with one .npy
+#    array per column (labels, WORD.0, WORDCON.0, WORDCON.1, POS.0, ...).
+# 3. A subset is then a projection: the columns of its feature types, with every
+#    id renumbered to its rank among the ids of those types.
+#
+# The projection gives exactly the files a "ner.py <train> <test> <locs> <subset>"
+# run would write. Keys belong to a single feature type ("word-", "prev-word-",
+# "pos-", ...), so a key first seen at some token is first seen at the same token
+# whatever the other feature types are, and a subset's numbering is the full
+# numbering with the other types' ids left out. The same holds for the
+# indicators and pseudo features appended after the training file.
+#
+# Subset outputs are named after the input file and the subset, e.g.
+# test.txt.WORD+POS+CAP.vector. Only the vector output is written; the readable
+# files don't depend on the vocabulary numbering and are left to normal runs.
+
+import itertools
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import api
+import corpus
+import csr
+import extractors
+import fileio
+import numpy_engine
+
+FEATURE_TYPES = list(extractors.FEATURE_EXTRACTORS)
+
+# Returns every feature-type subset, each including WORD, in registry order
+def all_subsets():
+    optional_types = [name for name in FEATURE_TYPES if name != "WORD"]
+    subsets = []
+    for size in range(len(optional_types) + 1):
+        for combination in itertools.combinations(optional_types, size):
+            subsets.append(["WORD"] + list(combination))
+    return subsets
+
+# Returns the name of a subset used in output file names, e.g. "WORD+POS+CAP"
+def subset_name(feature_types):
+    return "+".join(name for name in FEATURE_TYPES if name in feature_types or name == "WORD")
+
+# Builds the vocabulary of every feature type, numbered exactly like
+# api.build_feature_ids with all of them on. Returns the feature_ids
+# dictionary, the CompiledFeatures, and id_types: for every id, the registry
+# index of the feature type that added it (id 0 is unused and gets -1)
+def build_vocabulary(training_file_str, locations):
+    features = extractors.compile_features(FEATURE_TYPES, locations)
+    type_index = {name: k for k, name in enumerate(FEATURE_TYPES)}
+    feature_ids = {}
+    current_id = [1] # initialize; array instead of int to get pass-by-reference
+    id_types = [-1]
+
+    training_file = fileio.open_input(training_file_str)
+    for sentence in api.read_sentences(training_file):
+        for i in range(len(sentence)):
+            for extractor in features.extractors:
+                extractor.add_token(sentence, i, feature_ids, current_id)
+                id_types.extend([type_index[extractor.name]] * (current_id[0] - len(id_types)))
+    training_file.close()
+
+    # Same order as CompiledFeatures.finish_vocabulary
+    for extractor in features.extractors:
+        extractor.add_indicators(feature_ids, current_id)
+        id_types.extend([type_index[extractor.name]] * (current_id[0] - len(id_types)))
+    for extractor in features.extractors:
+        extractor.add_pseudos(feature_ids, current_id)
+        id_types.extend([type_index[extractor.name]] * (current_id[0] - len(id_types)))
+    return feature_ids, features, np.array(id_types, np.int8)
+
+# The per-type columns of one input file, stored as .npy files in a directory
+class ColumnStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.column_names = [] # in registry order, e.g. ["WORD.0", "WORDCON.0", ...]
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + ".npy")
+
+    # Vectorizes every token of the input file once with an ArrayVectorizer for
+    # all feature types, appending the ids to the column files
+    def extract(self, input_file_str, vectorizer):
+        os.makedirs(self.directory, exist_ok=True)
+        labels = csr.NpyStream(self._path("labels"), np.int8)
+        streams = {}
+        input_file = fileio.open_input(input_file_str)
+        for block in corpus.read_blocks(input_file):
+            label_codes, columns = vectorizer.labeled_columns(block)
+            labels.write(label_codes)
+            for feature_type, type_columns in columns.items():
+                for k, column in enumerate(type_columns):
+                    name = feature_type + "." + str(k)
+                    if name not in streams:
+                        streams[name] = csr.NpyStream(self._path(name), np.int32)
+                        self.column_names.append(name)
+                    streams[name].write(column)
+        input_file.close()
+        labels.close()
+        for stream in streams.values():
+            stream.close()
+
+    def labels(self):
+        return np.load(self._path("labels"), mmap_mode="r")
+
+    # Returns the memory-mapped columns of the given feature types
+    def columns(self, feature_types):
+        return [np.load(self._path(name), mmap_mode="r") for name in self.column_names
+                if name.split(".")[0] in feature_types]
+
+# Returns the renumbering of a subset: an array mapping every full-vocabulary id
+# to its id in the subset's vocabulary, or to 0 if its type isn't in the subset
+def subset_ids(id_types, feature_types):
+    keep = np.isin(id_types, [FEATURE_TYPES.index(name) for name in feature_types])
+    return np.cumsum(keep) * keep
+
+# Writes the vectors of one subset of the ColumnStore of input_file_str:
+# <input>.<subset>.vector and/or <input>.<subset>.csr, depending on
+# output_format (as in ner.py)
+def write_subset(store, feature_types, renumbering, input_file_str, output_format="liblinear",
+                 batch_tokens=numpy_engine.BATCH_TOKENS):
+    labels = store.labels()
+    columns = store.columns(feature_types)
+    extension = "." + subset_name(feature_types)
+    vector_file = None
+    csr_writer = None
+    if output_format != "csr":
+        vector_file = fileio.open_output(fileio.output_path(input_file_str, extension + ".vector"))
+    if output_format != "liblinear":
+        csr_writer = csr.CsrWriter(fileio.output_path(input_file_str, extension + ".csr", compressed=False))
+    for start in range(0, len(labels), batch_tokens):
+        end = start + batch_tokens
+        matrix = numpy_engine.sorted_matrix([renumbering[column[start:end]] for column in columns])
+        label_codes = np.asarray(labels[start:end], np.int64)
+        if vector_file is not None:
+            vector_file.write(numpy_engine.vector_text(label_codes, matrix))
+        if csr_writer is not None:
+            csr_writer.append_matrix(label_codes, matrix)
+    if vector_file is not None:
+        vector_file.close()
+    if csr_writer is not None:
+        csr_writer.close()
+
+# Writes the vectors of every subset in subsets (lists of feature types; all 128
+# by default) for the training and the test file. The column stores live in a
+# temporary directory next to the training file and are removed at the end
+def run(training_file_str, test_file_str, locations, subsets=None, output_format="liblinear"):
+    if subsets is None:
+        subsets = all_subsets()
+    feature_ids, features, id_types = build_vocabulary(training_file_str, locations)
+
+    work_dir = tempfile.mkdtemp(prefix=".ablation-", dir=os.path.dirname(os.path.abspath(training_file_str)))
+    try:
+        stores = []
+        for input_file_str, set_type in [(training_file_str, "train"), (test_file_str, "test")]:
+            store = ColumnStore(os.path.join(work_dir, set_type))
+            vectorizer = numpy_engine.ArrayVectorizer(feature_ids, features.feature_types, locations, set_type)
+            store.extract(input_file_str, vectorizer)
+            stores.append((input_file_str, store))
+
+        for feature_types in subsets:
+            renumbering = subset_ids(id_types, set(feature_types) | {"WORD"})
+            for input_file_str, store in stores:
+                write_subset(store, set(feature_types) | {"WORD"}, renumbering, input_file_str, output_format)
+    finally:
+        shutil.rmtree(work_dir)
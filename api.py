@@ -0,0 +1,118 @@
+# Importable API of the feature generator, for Python programs that want
+# feature vectors without going through files and the command line:
+#
+#   import api
+#   extractor = api.load("vocab.bin")      # saved by "ner.py build-vocab"
+#   for label, ids in extractor.vectorize(api.read_sentences(open("test.txt"))):
+#       ...                                 # 0, [150, 265, 2394, ...]
+#
+# or, building the vocabulary from training sentences in memory:
+#
+#   extractor = api.build(api.read_sentences(open("train.txt")), ["WORD", "POS", "CAP"],
+#                         api.load_locations("locs.txt"))
+#
+# read_sentences yields every sentence as a corpus.Sentence, which holds the
+# label codes, pos tags and words of its tokens as three lists (see corpus.py).
+# Anywhere a sentence is taken, a list of tokens, each a [label, pos, word] list
+# as split from a corpus line, works too. Tokens of unlabeled text can take any
+# label, e.g. "O". vectorize is a generator that pulls one sentence at a time
+# from any iterable, so a stream of any length is vectorized in constant memory,
+# and its ids are exactly those of the .vector files ner.py writes.
+#
+# This module only imports the feature code (corpus.py, extractors.py,
+# vocabfile.py, gazetteer.py, fileio.py), and a loaded vocabulary is
+# memory-mapped, so it is cheap to import and load in short-lived processes.
+# ner.py's command line is built on it; "python -m ner ..." runs the same
+# command line as "ner.py ...". Either works from this directory, or anywhere
+# once "pip install ." has installed the modules (and a "ner" command).
+
+import corpus
+import extractors
+import fileio
+import gazetteer
+import vocabfile
+
+# BIO labels, in the order of their codes in the .vector files
+LABELS = corpus.LABELS
+
+# Returns the label code of token i of a sentence, checking that it is a BIO label
+def label_code(sentence, i):
+    code = sentence.labels[i]
+    if code == corpus.BAD_LABEL:
+        raise Exception("Received a bad BIO label!")
+    return code
+
+# Yields the corpus.Sentences of an open corpus file or of any iterable of
+# corpus lines. As everywhere in ner.py, a sentence only counts once a blank
+# line follows it
+def read_sentences(lines):
+    return corpus.read_sentences(lines)
+
+# Returns the set of locations in a locations file, or the memory-mapped
+# gazetteer.Gazetteer if it is a compiled gazetteer
+def load_locations(locations_file_str):
+    if gazetteer.is_gazetteer(locations_file_str):
+        return gazetteer.load_gazetteer(locations_file_str)
+    locations = set()
+    locations_file = fileio.open_input(locations_file_str)
+    for location in locations_file:
+        locations.add(location.strip())
+    locations_file.close()
+    return locations
+
+# Returns the feature_ids dictionary of the training sentences for features
+# (an extractors.CompiledFeatures), numbered like ner.py's two-pass vocabulary
+def build_feature_ids(sentences, features):
+    feature_ids = {}
+    current_id = [1] # initialize; array instead of int to get pass-by-reference
+    for sentence in sentences:
+        features.add_sentence(corpus.as_sentence(sentence), feature_ids, current_id)
+    # Add feature entries for abbreviation, capitalization, and location, then
+    # entries for the special cases PHI, UNK, etc.
+    features.finish_vocabulary(feature_ids, current_id)
+    return feature_ids
+
+# Turns sentences into feature ids with one vocabulary and set of feature types
+class FeatureExtractor:
+    # feature_ids is a vocabulary (a dictionary, a vocabfile.MappedStringTable
+    # or a hashing.HashedFeatureIds), feature_types a list of feature type
+    # names (WORD is always on), locations as from load_locations
+    def __init__(self, feature_ids, feature_types, locations):
+        self.feature_ids = feature_ids
+        self.features = extractors.compile_features(feature_types, locations)
+
+    # Returns the sorted, distinct feature ids of token i of the sentence
+    def token_ids(self, sentence, i):
+        return sorted(set(self.features.token_ids(corpus.as_sentence(sentence), i, self.feature_ids)))
+
+    # Yields (label code, sorted feature ids) for every token of every sentence,
+    # reading the sentences only as they are needed
+    def vectorize(self, sentences):
+        features = self.features
+        feature_ids = self.feature_ids
+        for sentence in sentences:
+            sentence = corpus.as_sentence(sentence)
+            for i in range(len(sentence)):
+                yield label_code(sentence, i), sorted(set(features.token_ids(sentence, i, feature_ids)))
+
+    # Returns the readable block of token i, as in a .readable file
+    def readable(self, sentence, i, set_type="test"):
+        return self.features.token_readable(corpus.as_sentence(sentence), i, self.feature_ids, set_type)
+
+    # Saves the vocabulary, feature types and locations for load
+    def save(self, vocab_file_str):
+        vocabfile.save_vocabulary(vocab_file_str, self.feature_ids, self.features.feature_types,
+                                  self.features.locations)
+
+# Returns a FeatureExtractor for a vocabulary file saved by "ner.py build-vocab"
+# or FeatureExtractor.save. The file is memory-mapped, not read
+def load(vocab_file_str):
+    feature_ids, feature_types, locations = vocabfile.load_vocabulary(vocab_file_str)
+    return FeatureExtractor(feature_ids, feature_types, locations)
+
+# Returns a FeatureExtractor whose vocabulary is built from an iterable of
+# training sentences
+def build(sentences, feature_types, locations):
+    extractor = FeatureExtractor({}, feature_types, locations)
+    extractor.feature_ids = build_feature_ids(sentences, extractor.features)
+    return extractor
@@ -0,0 +1,279 @@
+# Scalability benchmark for ner.py. Generates synthetic corpora in the format of
+# train.txt (label, POS tag, word; blank line between sentences) at several sizes,
+# runs every stage of ner.py on them for each feature-type combination, and
+# prints a JSON report with the time, tokens/sec, peak RSS and output bytes of
+# every stage. The report can be saved and later compared against, to catch
+# performance regressions.
+#
+# Stages (each runs as its own ner.py process, so peak RSS is per stage):
+#           build-vocab      ner.py build-vocab on the training corpus
+#           vectorize-train  ner.py vectorize of the training corpus
+#           vectorize-test   ner.py vectorize of a test corpus a quarter the size
+# The vectorize stages write a sentence index along with the vectors, and the
+# .readable files only when --readable is passed on; their sizes are reported
+# separately as index_bytes and readable_bytes.
+#
+# The corpora are deterministic for a given size and --seed, and are kept in
+# --work-dir, so later runs reuse them. Words are drawn from a Zipf distribution
+# over a large synthetic vocabulary, so the number of distinct words keeps
+# growing with the corpus the way it does in real text, and sentence lengths are
+# log-normal around the ~12 tokens of the bundled data.
+#
+# Example:
+#           $ python benchmark.py --tokens 10k,100k,1M --save baseline.json
+#           $ python benchmark.py --tokens 10k,100k,1M --baseline baseline.json
+#
+# Any other options (e.g. --engine numpy --workers 4) are passed on to the
+# vectorize stages.
+
+import argparse
+import bisect
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+
+NER_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ner.py")
+
+FEATURE_COMBINATIONS = [
+    "WORD",
+    "WORD WORDCON",
+    "WORD POS POSCON",
+    "WORD WORDCON POS POSCON ABBR CAP LOCATION",
+]
+
+VOCABULARY_SIZE = 2000000
+ZIPF_EXPONENT = 1.1
+
+# The most frequent words are function words and never part of an entity
+FUNCTION_WORDS = 200
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ra", "tu", "sa", "be", "do", "gi", "ha", "jo", "pe",
+             "vi", "zo", "an", "el", "ir", "on", "us", "ter", "son", "berg", "ville", "ton"]
+
+POS_TAGS = ["NN", "NN", "NN", "IN", "DT", "JJ", "NNS", "VBD", "RB", "VB", "VBZ", "CC", "PRP",
+            "VBN", "TO", "CD", "VBG", "VBP", "MD", "PRP$", "WDT", "JJR", "POS", "FW"]
+
+# Regressions are reported when a stage gets this much slower, or uses this much
+# more memory, than in the baseline
+TOLERANCE = 0.2
+
+# Parses "10k", "2.5M" or "100000" into a number of tokens
+def _parse_size(size_str):
+    multiplier = {"k": 1000, "m": 1000000, "g": 1000000000}.get(size_str[-1].lower())
+    if multiplier is None:
+        return int(size_str)
+    return int(float(size_str[:-1]) * multiplier)
+
+# Returns the synthetic word of the given frequency rank, and its entity type
+# ("PER", "LOC", "ORG" or None)
+def _word(rank):
+    syllables = []
+    n = rank
+    while True:
+        syllables.append(SYLLABLES[n % len(SYLLABLES)])
+        n //= len(SYLLABLES)
+        if n == 0:
+            break
+    word = "".join(syllables)
+    if rank < FUNCTION_WORDS:
+        return word, None
+    if rank % 41 == 7:
+        return ".".join(word[:2].upper()) + ".", "ORG" # abbreviations like "K.A."
+    entity_type = {0: "PER", 1: "LOC", 2: "ORG"}.get(rank % 9)
+    if entity_type is not None or rank % 7 == 0:
+        word = word.capitalize()
+    return word, entity_type
+
+# Writes a synthetic corpus of about num_tokens tokens, and returns its statistics
+def generate_corpus(corpus_file_str, num_tokens, seed=0, vocabulary_size=VOCABULARY_SIZE):
+    random_state = random.Random(seed)
+    cumulative_weights = list(itertools.accumulate(1.0 / (rank + 1) ** ZIPF_EXPONENT
+                                                   for rank in range(vocabulary_size)))
+    total_weight = cumulative_weights[-1]
+    words = {}
+    corpus_file = open(corpus_file_str, "w")
+    tokens = 0
+    sentences = 0
+    while tokens < num_tokens:
+        length = max(1, min(100, int(random_state.lognormvariate(2.3, 0.6))))
+        lines = []
+        previous_type = None
+        for i in range(length):
+            rank = bisect.bisect(cumulative_weights, random_state.random() * total_weight)
+            if rank not in words:
+                words[rank] = _word(rank)
+            word, entity_type = words[rank]
+            if entity_type is None:
+                label = "O"
+                pos = POS_TAGS[rank % len(POS_TAGS)]
+            else:
+                label = ("I-" if entity_type == previous_type else "B-") + entity_type
+                pos = "NNP"
+            previous_type = entity_type
+            lines.append(label + "  " + pos + "    " + word + "\n")
+        lines.append("O  .    .\n\n")
+        corpus_file.write("".join(lines))
+        tokens += length + 1
+        sentences += 1
+    corpus_file.close()
+    return {"tokens": tokens, "sentences": sentences, "distinct_words": len(words)}
+
+# Writes a locations file with some of the LOC words of the synthetic vocabulary
+def _generate_locations(locations_file_str, count=1000):
+    locations_file = open(locations_file_str, "w")
+    rank = FUNCTION_WORDS
+    while count > 0:
+        word, entity_type = _word(rank)
+        if entity_type == "LOC":
+            locations_file.write(word + "\n")
+            count -= 1
+        rank += 1
+    locations_file.close()
+
+# Returns the path of the corpus of the given size, generating it unless it is
+# already in work_dir
+def _corpus(work_dir, name, num_tokens, seed):
+    corpus_file_str = os.path.join(work_dir, "%s-%d-seed%d.txt" % (name, num_tokens, seed))
+    if not os.path.exists(corpus_file_str):
+        # In a separate process, so that the memory for the Zipf table is not
+        # counted in the peak RSS of the stages forked from this one later
+        process = multiprocessing.Process(target=generate_corpus,
+                                          args=(corpus_file_str + ".tmp", num_tokens, seed))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise Exception("Could not generate " + corpus_file_str + "!")
+        os.rename(corpus_file_str + ".tmp", corpus_file_str)
+    return corpus_file_str
+
+# Runs ner.py with the given arguments and returns (seconds, peak RSS in bytes)
+def _run_stage(arguments):
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, NER_PY] + arguments, stdout=subprocess.DEVNULL)
+    pid, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    if status != 0:
+        raise Exception("ner.py " + " ".join(arguments) + " failed!")
+    peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return elapsed, peak_rss
+
+# Returns the total size of the given files and directories, in bytes
+def _output_bytes(paths):
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            total += sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        elif os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
+
+# Returns the number of tokens (non-blank lines) of a corpus file
+def _count_tokens(corpus_file_str):
+    corpus_file = open(corpus_file_str, "rb")
+    tokens = sum(1 for line in corpus_file if line.strip())
+    corpus_file.close()
+    return tokens
+
+# Runs every stage for every size and feature combination and returns the report
+def run(sizes, feature_combinations=FEATURE_COMBINATIONS, work_dir="benchmark-data", seed=0,
+        extra_arguments=()):
+    os.makedirs(work_dir, exist_ok=True)
+    locations_file_str = os.path.join(work_dir, "locs.txt")
+    _generate_locations(locations_file_str)
+    vocab_file_str = os.path.join(work_dir, "vocab.bin")
+
+    results = []
+    for num_tokens in sizes:
+        train_file_str = _corpus(work_dir, "train", num_tokens, seed)
+        test_file_str = _corpus(work_dir, "test", max(1, num_tokens // 4), seed + 1)
+        train_tokens = _count_tokens(train_file_str)
+        test_tokens = _count_tokens(test_file_str)
+        for feature_types in feature_combinations:
+            stages = [
+                ("build-vocab", train_tokens, ["build-vocab", train_file_str, locations_file_str,
+                                               vocab_file_str] + feature_types.split(), [vocab_file_str]),
+                ("vectorize-train", train_tokens, ["vectorize", vocab_file_str, train_file_str]
+                 + list(extra_arguments), [train_file_str + ".vector", train_file_str + ".csr"]),
+                ("vectorize-test", test_tokens, ["vectorize", vocab_file_str, test_file_str]
+                 + list(extra_arguments), [test_file_str + ".vector", test_file_str + ".csr"]),
+            ]
+            for stage, tokens, arguments, outputs in stages:
+                seconds, peak_rss = _run_stage(arguments)
+                result = {
+                    "size": num_tokens,
+                    "features": feature_types,
+                    "stage": stage,
+                    "tokens": tokens,
+                    "seconds": seconds,
+                    "tokens_per_second": tokens / seconds,
+                    "peak_rss_bytes": peak_rss,
+                    "output_bytes": _output_bytes(outputs),
+                }
+                if stage != "build-vocab":
+                    result["index_bytes"] = _output_bytes([arguments[2] + ".index"])
+                    result["readable_bytes"] = _output_bytes([arguments[2] + ".readable"])
+                results.append(result)
+                print("%-16s %10d tokens  %-42s %8.2fs %12.0f tok/s %8.1f MB" % (
+                    stage, tokens, feature_types, seconds, tokens / seconds, peak_rss / 1e6), file=sys.stderr)
+    return {"python": sys.version.split()[0], "seed": seed, "arguments": list(extra_arguments),
+            "results": results}
+
+# Compares a report against a baseline report and returns a list of regressions:
+# stages that got slower or bigger by more than tolerance, or whose output changed
+def compare(report, baseline, tolerance=TOLERANCE):
+    baseline_results = {(result["size"], result["features"], result["stage"]): result
+                        for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        key = (result["size"], result["features"], result["stage"])
+        if key not in baseline_results:
+            continue
+        before = baseline_results[key]
+        name = "%s %d tokens [%s]" % (result["stage"], result["size"], result["features"])
+        if result["tokens_per_second"] < before["tokens_per_second"] * (1 - tolerance):
+            regressions.append("%s: %.0f tokens/s, was %.0f" % (
+                name, result["tokens_per_second"], before["tokens_per_second"]))
+        if result["peak_rss_bytes"] > before["peak_rss_bytes"] * (1 + tolerance):
+            regressions.append("%s: peak RSS %d bytes, was %d" % (
+                name, result["peak_rss_bytes"], before["peak_rss_bytes"]))
+        if result["output_bytes"] != before["output_bytes"]:
+            regressions.append("%s: %d output bytes, was %d" % (
+                name, result["output_bytes"], before["output_bytes"]))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark ner.py on synthetic corpora")
+    parser.add_argument("--tokens", default="10k,100k,1M",
+                        help="comma-separated training corpus sizes, e.g. 10k,1M,100M")
+    parser.add_argument("--features", action="append", default=None, metavar="TYPES",
+                        help="a space-separated feature-type combination to run "
+                             "(repeatable; default: " + "; ".join(FEATURE_COMBINATIONS) + ")")
+    parser.add_argument("--work-dir", default="benchmark-data",
+                        help="where the corpora and outputs are kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", default=None, metavar="FILE", help="also write the report to FILE")
+    parser.add_argument("--baseline", default=None, metavar="FILE",
+                        help="compare against a saved report; exits with status 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args, extra_arguments = parser.parse_known_args()
+
+    sizes = [_parse_size(size_str) for size_str in args.tokens.split(",")]
+    report = run(sizes, args.features or FEATURE_COMBINATIONS, args.work_dir, args.seed, extra_arguments)
+    print(json.dumps(report, indent=2))
+    if args.save is not None:
+        save_file = open(args.save, "w")
+        json.dump(report, save_file, indent=2)
+        save_file.close()
+    if args.baseline is not None:
+        baseline_file = open(args.baseline)
+        regressions = compare(report, json.load(baseline_file), args.tolerance)
+        baseline_file.close()
+        for regression in regressions:
+            print("REGRESSION " + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,171 @@
+# Content-addressed on-disk cache of vocabularies and output files (--cache DIR),
+# so that repeated runs on unchanged inputs restore their results instead of
+# re-reading and re-vectorizing the corpora.
+#
+# Every cache entry is a directory named by a SHA-256 key and holds the files of
+# one result: a vocabulary (vocabfile format), or the .readable/.vector/.csr
+# outputs of one input file. The keys are built from the SHA-256 of the input
+# file contents (never their names or dates), the feature types, the hash of
+# the locations file and the options that change the output, so editing any
+# input or option misses the cache, and renaming or touching a file doesn't.
+# File hashes are memoized by (path, size, mtime, inode) in hashes.json, so an
+# unchanged file is only hashed once.
+#
+# Entries are written to a temporary directory and renamed into place, so
+# concurrent runs sharing a cache never see half-written entries. The cache is
+# kept under a size cap by evicting the least recently used entries (an
+# entry's mtime is bumped every time it is used).
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+# Part of every key: bump it whenever a change to the feature code changes the
+# output files, so old entries are never restored
+CACHE_VERSION = "1"
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+_HASH_CHUNK = 1 << 20
+
+# Parses "500M", "2G" or "1000000" into a number of bytes
+def parse_size(size_str):
+    multiplier = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}.get(size_str[-1].lower())
+    if multiplier is None:
+        return int(size_str)
+    return int(float(size_str[:-1]) * multiplier)
+
+# Returns the total size of a file or directory tree, in bytes
+def _tree_bytes(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for directory, subdirectories, names in os.walk(path):
+        for name in names:
+            total += os.path.getsize(os.path.join(directory, name))
+    return total
+
+def _copy(source, destination):
+    if os.path.isdir(destination):
+        shutil.rmtree(destination)
+    if os.path.isdir(source):
+        shutil.copytree(source, destination)
+    else:
+        shutil.copyfile(source, destination)
+
+class FeatureCache:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(directory, "entries"), exist_ok=True)
+        self._hashes_file_str = os.path.join(directory, "hashes.json")
+        self._hashes = {}
+        if os.path.exists(self._hashes_file_str):
+            hashes_file = open(self._hashes_file_str)
+            try:
+                self._hashes = json.load(hashes_file)
+            except ValueError:
+                pass # a damaged memo only costs rehashing
+            hashes_file.close()
+        self.evict() # in case max_bytes is smaller than in earlier runs
+
+    # Returns the SHA-256 of a file's contents, memoized by its stat
+    def file_hash(self, file_str):
+        stat = os.stat(file_str)
+        path = os.path.abspath(file_str)
+        signature = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        memo = self._hashes.get(path)
+        if memo is not None and memo[0] == signature:
+            return memo[1]
+
+        digest = hashlib.sha256()
+        input_file = open(file_str, "rb")
+        chunk = input_file.read(_HASH_CHUNK)
+        while chunk:
+            digest.update(chunk)
+            chunk = input_file.read(_HASH_CHUNK)
+        input_file.close()
+        self._hashes[path] = [signature, digest.hexdigest()]
+        self._save_hashes()
+        return digest.hexdigest()
+
+    def _save_hashes(self):
+        hashes_fd, temporary_str = tempfile.mkstemp(dir=self.directory, suffix=".json")
+        hashes_file = os.fdopen(hashes_fd, "w")
+        json.dump(self._hashes, hashes_file)
+        hashes_file.close()
+        os.replace(temporary_str, self._hashes_file_str)
+
+    # Returns the key of a list of strings (hashes, feature types, options)
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256("\0".join((CACHE_VERSION,) + parts).encode("utf-8")).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.directory, "entries", key)
+
+    # Returns the path of the file called name in the entry of key, or None if
+    # there is no such entry. Counts as a use of the entry
+    def lookup(self, key, name):
+        path = os.path.join(self._entry(key), name)
+        if not os.path.exists(path):
+            return None
+        self._touch(key)
+        return path
+
+    def _touch(self, key):
+        try:
+            os.utime(self._entry(key))
+        except FileNotFoundError:
+            pass # evicted by another run in the meantime
+
+    # Copies the files of the entry of key to their destinations, given as a
+    # {name: path} dictionary. Returns False (and copies nothing) on a miss
+    def fetch(self, key, destinations):
+        entry = self._entry(key)
+        if not all(os.path.exists(os.path.join(entry, name)) for name in destinations):
+            return False
+        for name, destination in destinations.items():
+            _copy(os.path.join(entry, name), destination)
+        self._touch(key)
+        return True
+
+    # Stores copies of files, given as a {name: path} dictionary, as the entry
+    # of key, then evicts old entries if the cache is over its size cap
+    def store(self, key, sources):
+        entry = self._entry(key)
+        if os.path.exists(entry):
+            self._touch(key)
+            return
+        temporary = tempfile.mkdtemp(dir=os.path.join(self.directory, "entries"), prefix=".tmp-")
+        for name, source in sources.items():
+            _copy(source, os.path.join(temporary, name))
+        try:
+            os.rename(temporary, entry)
+        except OSError: # another run stored the same entry first
+            shutil.rmtree(temporary)
+        self.evict()
+
+    # Removes the least recently used entries until the cache fits in max_bytes
+    def evict(self):
+        entries_str = os.path.join(self.directory, "entries")
+        entries = []
+        total = 0
+        for key in os.listdir(entries_str):
+            if key.startswith(".tmp-"):
+                continue
+            entry = os.path.join(entries_str, key)
+            try:
+                size = _tree_bytes(entry)
+                entries.append((os.path.getmtime(entry), size, entry))
+            except FileNotFoundError:
+                continue # evicted by another run
+            total += size
+        entries.sort()
+        for last_used, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
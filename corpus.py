@@ -0,0 +1,213 @@
+# Columnar corpus reader. A corpus file is read in blocks of about BLOCK_CHARS
+# characters, and the whole sentences of a block are parsed into a SentenceBlock
+# of typed arrays rather than a list of [label, pos, word] lists per token:
+#
+#   labels       array of label codes (LABELS order; BAD_LABEL if unknown)
+#   pos_codes    array of indices into pos_names, the block's distinct pos tags
+#   word_codes   array of indices into word_names, the block's distinct words
+#   starts       array of sentence offsets: sentence k is tokens
+#                starts[k]..starts[k+1]-1
+#
+# so a token costs 9 bytes plus its share of the distinct strings, and parsing
+# a block is a handful of C-level calls (one str.split for the whole block,
+# slices for the three fields, dict lookups through map) instead of a Python
+# loop over its lines. Only blocks in which some line doesn't have exactly three
+# fields (a line with extra columns, say) are split line by line.
+#
+# Only the numpy engine and ablation's column store read SentenceBlocks. The
+# per-token extractor hooks (add_token, add_indicators, add_pseudos, add_ids,
+# readable), and with them the python engine, api.py, vocabbuilder.py and
+# "ner.py show", work on one Sentence at a time: the label codes, pos tags and
+# words of a sentence as three lists, so the word of token i is
+# sentence.words[i]. read_sentences slices them straight from the fields of
+# smaller blocks, without the codes, since the extractors need the strings.
+# That is no faster than the old split() per line (0.20 s vs 0.18 s for a
+# 630k-line corpus; read_blocks takes 0.56 s, but saves the numpy engine its
+# per-token encoding), so those paths would only gain from hooks on columns.
+# As everywhere in ner.py, a sentence only counts once a blank line follows it.
+
+import array
+import itertools
+import re
+
+# Characters read at a time into a SentenceBlock, and by read_sentences, which
+# only keeps a block's strings while its sentences are used: smaller blocks stay
+# in the CPU caches
+BLOCK_CHARS = 1 << 19
+SENTENCE_BLOCK_CHARS = 1 << 15
+
+# BIO labels, in the order of their codes in the .vector files
+LABELS = ["O", "B-PER", "I-PER", "B-LOC", "I-LOC", "B-ORG", "I-ORG"]
+
+# Label code of a label that isn't a BIO label. It only matters once a vector
+# is written, so vocabularies can still be built from such corpora
+BAD_LABEL = -1
+
+# One or more blank lines (that may hold spaces) between two lines
+_BLANK_LINES = re.compile(r"\n\s*\n")
+
+_LABEL_CODES = {label: code for code, label in enumerate(LABELS)}
+
+# Marks the end of every line in _split_fields: not whitespace, so str.split keeps it
+_LINE_END = "\0"
+
+# Returns the codes of a list of strings, as an array of indices into the
+# distinct strings in the order they first occur, and those strings
+def _encode(values):
+    names = list(dict.fromkeys(values))
+    codes = dict(zip(names, range(len(names))))
+    return array.array("i", list(map(codes.__getitem__, values))), names
+
+# Returns the label codes of a list of labels
+def _label_codes(labels):
+    try:
+        return list(map(_LABEL_CODES.__getitem__, labels))
+    except KeyError:
+        return [_LABEL_CODES.get(label, BAD_LABEL) for label in labels]
+
+# One sentence: the label codes, pos tags and words of its tokens
+class Sentence:
+    __slots__ = ("labels", "poses", "words")
+
+    def __init__(self, labels, poses, words):
+        self.labels = labels
+        self.poses = poses
+        self.words = words
+
+    def __len__(self):
+        return len(self.words)
+
+    # Returns the sentence of a list of [label, pos, word] tokens
+    @classmethod
+    def from_tokens(cls, tokens):
+        return cls([_LABEL_CODES.get(token[0], BAD_LABEL) for token in tokens],
+                   [token[1] for token in tokens], [token[2] for token in tokens])
+
+# Returns sentence as a Sentence, converting it if it is a list of tokens
+def as_sentence(sentence):
+    if isinstance(sentence, Sentence):
+        return sentence
+    return Sentence.from_tokens(sentence)
+
+# The sentences of one block of a corpus file, as columns (see above)
+class SentenceBlock:
+    def __init__(self, labels, pos_codes, pos_names, word_codes, word_names, starts):
+        self.labels = labels
+        self.pos_codes = pos_codes
+        self.pos_names = pos_names
+        self.word_codes = word_codes
+        self.word_names = word_names
+        self.starts = starts
+
+    # Number of sentences
+    def __len__(self):
+        return len(self.starts) - 1
+
+    # Returns the pos tags and the words of all tokens as lists of strings
+    def poses(self):
+        return list(map(self.pos_names.__getitem__, self.pos_codes))
+
+    def words(self):
+        return list(map(self.word_names.__getitem__, self.word_codes))
+
+    # Yields the Sentence of every sentence in order
+    def __iter__(self):
+        labels = self.labels.tolist()
+        poses = self.poses()
+        words = self.words()
+        starts = self.starts
+        for k in range(len(starts) - 1):
+            start, end = starts[k], starts[k + 1]
+            yield Sentence(labels[start:end], poses[start:end], words[start:end])
+
+# Yields the text of the sentences of an open corpus file (text mode), a list
+# of them for every block, without the blank lines
+def _read_sentence_texts(input_file, block_chars):
+    rest = "" # the text after the last blank line: a sentence still being read
+    while True:
+        data = input_file.read(block_chars)
+        if not data:
+            break
+        sentence_texts = _BLANK_LINES.split(rest + data)
+        rest = sentence_texts.pop()
+        if sentence_texts:
+            yield sentence_texts
+
+    # A last line with only spaces and no newline is a blank line too, and a
+    # last sentence that isn't followed by a blank line doesn't count
+    if not rest.endswith("\n"):
+        rest += "\n"
+    sentence_texts = _BLANK_LINES.split(rest)[:-1]
+    if sentence_texts:
+        yield sentence_texts
+
+# Returns the labels, pos tags and words of the tokens of the sentence texts, as
+# three lists, and the number of tokens of each sentence
+def _split_fields(sentence_texts):
+    sentence_texts = [sentence_text.strip() for sentence_text in sentence_texts]
+    sentence_texts = [sentence_text for sentence_text in sentence_texts if sentence_text]
+    lengths = [sentence_text.count("\n") + 1 for sentence_text in sentence_texts]
+    text = "\n".join(sentence_texts)
+    if text and _LINE_END not in text:
+        # Every line gets _LINE_END as a field of its own, so a line with an
+        # extra field can't make up for a line with a missing one: the lines all
+        # have three fields only if every fourth field is a _LINE_END
+        fields = (text.replace("\n", " " + _LINE_END + "\n") + " " + _LINE_END).split()
+        lines = sum(lengths)
+        if len(fields) == 4 * lines and fields[3::4].count(_LINE_END) == lines:
+            return fields[0::4], fields[1::4], fields[2::4], lengths
+
+    # Some line doesn't have exactly three fields: take the first three of each
+    fields = []
+    for sentence_text in sentence_texts:
+        for line in sentence_text.split("\n"):
+            line_fields = line.split()
+            if len(line_fields) < 3:
+                raise Exception("Received a corpus line without label, pos tag and word: " + line + "!")
+            fields.extend(line_fields[:3])
+    return fields[0::3], fields[1::3], fields[2::3], lengths
+
+# Yields the SentenceBlocks of an open corpus file (text mode)
+def read_blocks(input_file, block_chars=BLOCK_CHARS):
+    for sentence_texts in _read_sentence_texts(input_file, block_chars):
+        labels, poses, words, lengths = _split_fields(sentence_texts)
+        if not lengths:
+            continue
+        starts = array.array("q", [0])
+        starts.extend(itertools.accumulate(lengths))
+        pos_codes, pos_names = _encode(poses)
+        word_codes, word_names = _encode(words)
+        labels = array.array("b", _label_codes(labels))
+        del poses, words # don't keep a string per field while the block is used
+        yield SentenceBlock(labels, pos_codes, pos_names, word_codes, word_names, starts)
+
+# Yields the Sentences of an open corpus file, or of any iterable of corpus lines
+def read_sentences(input_file, block_chars=SENTENCE_BLOCK_CHARS):
+    if not hasattr(input_file, "read"):
+        input_file = _LinesReader(input_file)
+    for sentence_texts in _read_sentence_texts(input_file, block_chars):
+        labels, poses, words, lengths = _split_fields(sentence_texts)
+        labels = _label_codes(labels)
+        start = 0
+        for length in lengths:
+            end = start + length
+            yield Sentence(labels[start:end], poses[start:end], words[start:end])
+            start = end
+
+# Gives an iterable of lines (e.g. a list, with or without newlines) the read
+# method of a file
+class _LinesReader:
+    def __init__(self, lines):
+        self._lines = iter(lines)
+
+    def read(self, size):
+        chunks = []
+        length = 0
+        for line in self._lines:
+            if not line.endswith("\n"):
+                line += "\n"
+            chunks.append(line)
+            length += len(line)
+            if length >= size:
+                break
+        return "".join(chunks)
@@ -0,0 +1,164 @@
+# Binary sparse-matrix (CSR) output for the feature vectors: an alternative to the
+# liblinear text of the .vector files that can be loaded without parsing.
+# Requires numpy.
+#
+# A CSR output is a directory (e.g. train.txt.csr/) with three .npy files:
+#           labels.npy    int8[rows]       label of each token, as in api.LABELS
+#           indptr.npy    int64[rows + 1]  row i's ids are indices[indptr[i]:indptr[i+1]]
+#           indices.npy   int32[nnz]       feature ids, ascending within each row
+# Every feature is binary (id:1), so there is no data array.
+#
+# The writer appends whole batches of rows with a few bulk writes and fills in the
+# .npy headers when it is closed. The reader memory-maps the files, so loading is
+# zero-copy, and can also stream the rows back in batches.
+
+import os
+
+import numpy as np
+
+# Every .npy header written here is padded to this many bytes, which leaves room
+# for any shape. The header is written last, once the length is known
+_HEADER_BYTES = 128
+
+# A .npy file that is written in chunks before its length is known
+class NpyStream:
+    def __init__(self, file_str, dtype):
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self._file = open(file_str, "wb")
+        self._file.write(b"\0" * _HEADER_BYTES) # placeholder until close
+
+    def write(self, values):
+        values = np.ascontiguousarray(values, self.dtype)
+        values.tofile(self._file)
+        self.length += len(values)
+
+    def close(self):
+        self._file.seek(0)
+        np.lib.format.write_array_header_1_0(self._file, {
+            "descr": np.lib.format.dtype_to_descr(self.dtype),
+            "fortran_order": False,
+            "shape": (self.length,),
+        })
+        if self._file.tell() != _HEADER_BYTES:
+            raise Exception("Unexpected .npy header size!")
+        self._file.close()
+
+# Writes rows of feature ids to a CSR directory
+class CsrWriter:
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.rows = 0
+        self._nnz = 0
+        self._labels = NpyStream(os.path.join(directory, "labels.npy"), np.int8)
+        self._indptr = NpyStream(os.path.join(directory, "indptr.npy"), np.int64)
+        self._indices = NpyStream(os.path.join(directory, "indices.npy"), np.int32)
+        self._indptr.write([0])
+
+    # Appends rows given their labels, the number of ids in each row, and all of
+    # their ids concatenated
+    def append_rows(self, labels, counts, indices):
+        self._labels.write(labels)
+        self._indptr.write(self._nnz + np.cumsum(counts))
+        self._indices.write(indices)
+        self.rows += len(labels)
+        self._nnz += len(indices)
+
+    # Appends rows given as a (rows x features) matrix whose rows are sorted in
+    # ascending order, with 0 for features that don't fire (numpy_engine's
+    # feature_matrix)
+    def append_matrix(self, labels, matrix):
+        present = matrix != 0
+        self.append_rows(labels, present.sum(axis=1), matrix[present])
+
+    def close(self):
+        self._labels.close()
+        self._indptr.close()
+        self._indices.close()
+
+# Collects the rows of one shard in memory, so that a --workers process can hand
+# them back to the parent to be appended to a CsrWriter in order
+class CsrBatches:
+    def __init__(self):
+        self.batches = []
+
+    def append_matrix(self, labels, matrix):
+        present = matrix != 0
+        self.batches.append((np.asarray(labels, np.int8), present.sum(axis=1), matrix[present]))
+
+    # Appends the collected rows to a CsrWriter
+    def write_to(self, writer):
+        for labels, counts, indices in self.batches:
+            writer.append_rows(labels, counts, indices)
+
+# The arrays of a CSR directory. With mmap=True (the default) they are read-only
+# memory maps of the files, so nothing is copied until it is used
+class CsrMatrix:
+    def __init__(self, labels, indptr, indices):
+        self.labels = labels
+        self.indptr = indptr
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.labels)
+
+    # Returns the feature ids of row i
+    def row(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+    # Returns the highest feature id, i.e. the number of columns liblinear would use
+    def num_features(self):
+        if len(self.indices) == 0:
+            return 0
+        return int(self.indices.max())
+
+    # Returns a scipy.sparse.csr_matrix with a column for every feature id
+    # (column 0 is never used, since ids start at 1). Requires scipy
+    def to_scipy(self):
+        import scipy.sparse
+        data = np.ones(len(self.indices), np.float32)
+        return scipy.sparse.csr_matrix((data, self.indices, self.indptr),
+                                       shape=(len(self), self.num_features() + 1))
+
+# Loads a CSR directory written by CsrWriter
+def load_csr(directory, mmap=True):
+    mmap_mode = "r" if mmap else None
+    return CsrMatrix(np.load(os.path.join(directory, "labels.npy"), mmap_mode=mmap_mode),
+                     np.load(os.path.join(directory, "indptr.npy"), mmap_mode=mmap_mode),
+                     np.load(os.path.join(directory, "indices.npy"), mmap_mode=mmap_mode))
+
+# Streams a CSR directory back in batches of up to batch_rows rows. Yields
+# (labels, indptr, indices) for each batch, with indptr rebased to start at 0
+def iter_csr(directory, batch_rows=65536):
+    matrix = load_csr(directory)
+    for start in range(0, len(matrix), batch_rows):
+        end = min(start + batch_rows, len(matrix))
+        indptr = np.asarray(matrix.indptr[start:end + 1])
+        yield (matrix.labels[start:end], indptr - indptr[0],
+               matrix.indices[indptr[0]:indptr[-1]])
+
+# Writes a CSR matrix back out as liblinear text, exactly as ner.py writes
+# .vector files
+def write_liblinear(matrix, vector_file):
+    for i in range(len(matrix)):
+        vector_file.write(str(int(matrix.labels[i])) + " ")
+        for feature_id in matrix.row(i).tolist():
+            vector_file.write(str(feature_id) + ":1 ")
+        vector_file.write("\n")
+
+# Parses liblinear text (a .vector file written by ner.py) into an in-memory
+# CsrMatrix
+def read_liblinear(vector_file):
+    labels, counts, indices = [], [], []
+    for line in vector_file:
+        fields = line.split()
+        if not fields:
+            continue
+        labels.append(int(fields[0]))
+        counts.append(len(fields) - 1)
+        for field in fields[1:]:
+            indices.append(int(field.split(":")[0]))
+    indptr = np.zeros(len(counts) + 1, np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return CsrMatrix(np.array(labels, np.int8), indptr, np.array(indices, np.int32))
@@ -0,0 +1,189 @@
+# Sequence decoding of per-token label scores: a Viterbi search that only
+# allows valid BIO sequences (I-X must follow B-X or I-X), and extraction of the
+# entity spans of the decoded labels. Requires numpy.
+#
+# The classifier scores every token on its own, so its argmax labels can contain
+# sequences such as O I-ORG. decode() picks, for every sentence, the label
+# sequence with the highest total score: the sum of the token scores plus a
+# transition score for every pair of neighbouring labels (and one for the first
+# label). The default transitions are 0 for allowed and -inf for forbidden
+# pairs, so the result is the best-scoring valid sequence; with every pair
+# allowed it is exactly the per-token argmax. learn_transitions estimates log
+# transition probabilities from gold label sequences instead; since the
+# classifier's scores aren't log probabilities, they are scaled by the weight
+# that decodes the training data best (tune_transition_weight).
+#
+# Decoding is batched: sentences are sorted by length and cut into batches of
+# about BATCH_TOKENS tokens, each padded to its longest sentence, and every
+# time step of the Viterbi recursion is a few array operations over the
+# sentences of the batch that are still going (the longest ones, since a batch
+# is sorted by length too).
+
+import numpy as np
+
+import numpy_engine
+
+LABELS = numpy_engine.LABELS
+NUM_LABELS = len(LABELS)
+
+# Roughly how many tokens (including padding) are decoded at once
+BATCH_TOKENS = 65536
+
+# The scales of learned transitions tried by tune_transition_weight
+TRANSITION_WEIGHTS = [0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 1.0]
+
+# Entity type of every label: "PER" for B-PER and I-PER, ..., None for O
+_TYPES = [None if label == "O" else label[2:] for label in LABELS]
+_TYPE_CODES = np.array([0 if label == "O" else 1 + sorted(set(_TYPES) - {None}).index(label[2:])
+                        for label in LABELS], np.int64)
+_TYPE_NAMES = [None] + sorted(set(_TYPES) - {None})
+_IS_INSIDE = np.array([label.startswith("I-") for label in LABELS])
+
+# Returns the BIO constraints as (start, transitions) scores: start[j] is the
+# score of a sentence starting with label j, transitions[i, j] that of label j
+# following label i. Allowed: 0, forbidden: -inf
+def bio_transitions():
+    start = np.where(_IS_INSIDE, -np.inf, 0.0)
+    transitions = np.zeros((NUM_LABELS, NUM_LABELS))
+    for j in range(NUM_LABELS):
+        if _IS_INSIDE[j]:
+            transitions[_TYPE_CODES != _TYPE_CODES[j], j] = -np.inf
+    return start, transitions
+
+# Returns the position of every sentence's first token, given the sentence lengths
+def _sentence_starts(lengths):
+    starts = np.zeros(len(lengths), np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    return starts
+
+# Estimates (start, transitions) as smoothed log probabilities from gold label
+# codes (all sentences one after another) and the sentence lengths. Transitions
+# the BIO constraints forbid stay -inf
+def learn_transitions(labels, lengths, smoothing=1.0):
+    labels = np.asarray(labels, np.int64)
+    lengths = np.asarray(lengths, np.int64)
+    starts = _sentence_starts(lengths)
+    follows = np.ones(len(labels), bool) # token follows another of its sentence
+    follows[starts[lengths > 0]] = False
+    follows[0] = False
+
+    start_counts = np.bincount(labels[starts[lengths > 0]], minlength=NUM_LABELS) + smoothing
+    pairs = labels[:-1][follows[1:]] * NUM_LABELS + labels[1:][follows[1:]]
+    pair_counts = np.bincount(pairs, minlength=NUM_LABELS * NUM_LABELS).reshape(NUM_LABELS, NUM_LABELS)
+    pair_counts = pair_counts + smoothing
+
+    allowed_start, allowed = bio_transitions()
+    start = np.log(start_counts / start_counts.sum()) + allowed_start
+    transitions = np.log(pair_counts / pair_counts.sum(axis=1, keepdims=True)) + allowed
+    return start, transitions
+
+# Returns the weight in weights whose scaling of (start, transitions) decodes
+# scores best against the gold labels, keeping the first on ties
+def tune_transition_weight(scores, labels, lengths, start, transitions, weights=TRANSITION_WEIGHTS):
+    labels = np.asarray(labels, np.int64)
+    best_weight = None
+    best_correct = -1
+    for weight in weights:
+        correct = int((decode(scores, lengths, start * weight, transitions * weight) == labels).sum())
+        if correct > best_correct:
+            best_weight, best_correct = weight, correct
+    return best_weight
+
+# Decodes one batch of padded token scores (sentences x positions x labels)
+# with the sentence lengths, which must be in ascending order: the sentences
+# still going at step t are then always the last ones. Returns the (sentences x
+# positions) label codes; positions past a sentence's end are left 0
+def _viterbi_batch(scores, lengths, start, transitions):
+    num_sentences, num_positions = scores.shape[:2]
+    backpointers = np.zeros((num_positions, num_sentences, NUM_LABELS), np.int8)
+    best = scores[:, 0] + start
+    stepped = np.empty_like(best)
+    candidate = np.empty_like(best)
+    better = np.empty(best.shape, bool)
+    for t in range(1, num_positions):
+        k = np.searchsorted(lengths, t, side="right") # first sentence still going
+        # Max over the previous label, one label at a time: much faster than
+        # an argmax over a (sentences x labels x labels) array
+        np.add(best[k:, 0:1], transitions[0], out=stepped[k:])
+        previous = backpointers[t, k:]
+        for i in range(1, NUM_LABELS):
+            np.add(best[k:, i:i+1], transitions[i], out=candidate[k:])
+            np.greater(candidate[k:], stepped[k:], out=better[k:])
+            np.maximum(stepped[k:], candidate[k:], out=stepped[k:])
+            np.putmask(previous, better[k:], i)
+        np.add(stepped[k:], scores[k:, t], out=best[k:])
+
+    labels = np.zeros((num_sentences, num_positions), np.int64)
+    current = best.argmax(axis=1)
+    for t in range(num_positions - 1, -1, -1):
+        k = np.searchsorted(lengths, t, side="right")
+        labels[k:, t] = current[k:]
+        if t > 0:
+            current[k:] = backpointers[t, np.arange(k, num_sentences), current[k:]]
+    return labels
+
+# Decodes the (tokens x labels) scores of whole sentences, one after another,
+# given the sentence lengths. Returns the best label code of every token.
+# start and transitions default to the BIO constraints
+def decode(scores, lengths, start=None, transitions=None, batch_tokens=BATCH_TOKENS):
+    if start is None or transitions is None:
+        start, transitions = bio_transitions()
+    lengths = np.asarray(lengths, np.int64)
+    if lengths.sum() != len(scores):
+        raise Exception("The sentence lengths don't add up to the number of tokens!")
+    starts = _sentence_starts(lengths)
+    labels = np.empty(len(scores), np.int64)
+
+    order = np.argsort(lengths, kind="stable")
+    sorted_lengths = lengths[order]
+    first = 0
+    while first < len(order):
+        # Sentences are sorted by length, so a batch is padded to its last one.
+        # Take as many as fit in batch_tokens, and at least one
+        window = sorted_lengths[first:first + batch_tokens]
+        padded_tokens = np.arange(1, len(window) + 1) * window
+        end = first + max(1, int(np.searchsorted(padded_tokens, batch_tokens, side="right")))
+        batch = order[first:end]
+        batch_lengths = lengths[batch]
+        width = max(int(batch_lengths[-1]), 1)
+        positions = np.arange(width)
+        valid = positions[None, :] < batch_lengths[:, None]
+        token_rows = (starts[batch][:, None] + positions[None, :])[valid]
+        padded = np.zeros((len(batch), width, NUM_LABELS))
+        padded[valid] = scores[token_rows]
+        labels[token_rows] = _viterbi_batch(padded, batch_lengths, start, transitions)[valid]
+        first = end
+    return labels
+
+# Returns the entity spans of decoded label codes, as one list per sentence of
+# (start, end, type) triples with token positions in the sentence (end
+# excluded). An I- label that doesn't continue an entity of its type starts one
+def entity_spans(labels, lengths):
+    labels = np.asarray(labels, np.int64)
+    lengths = np.asarray(lengths, np.int64)
+    types = _TYPE_CODES[labels]
+    sentence_first = np.zeros(len(labels), bool)
+    sentence_first[_sentence_starts(lengths)[lengths > 0]] = True
+
+    previous_types = np.concatenate([[0], types[:-1]])
+    begins = (types != 0) & (~_IS_INSIDE[labels] | sentence_first | (previous_types != types))
+    next_begins = np.concatenate([begins[1:], [True]])
+    next_types = np.concatenate([types[1:], [0]])
+    next_first = np.concatenate([sentence_first[1:], [True]])
+    ends = (types != 0) & (next_begins | next_first | (next_types != types))
+
+    begin_tokens = np.flatnonzero(begins)
+    end_tokens = np.flatnonzero(ends) + 1
+    sentences = np.searchsorted(np.cumsum(lengths), begin_tokens, side="right")
+    offsets = _sentence_starts(lengths)
+
+    spans = [[] for length in lengths]
+    for sentence, begin, end in zip(sentences.tolist(), begin_tokens.tolist(), end_tokens.tolist()):
+        offset = int(offsets[sentence])
+        spans[sentence].append((begin - offset, end - offset, _TYPE_NAMES[types[begin]]))
+    return spans
+
+# Returns the text of one sentence's spans: "start-end:TYPE" items separated by
+# spaces, e.g. "0-2:LOC 5-6:PER"
+def format_spans(spans):
+    return " ".join("%d-%d:%s" % span for span in spans)
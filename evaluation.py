@@ -0,0 +1,418 @@
+# Evaluation of predicted labels against the gold labels, in constant memory:
+# the predictions file (one label per line, from liblinear's predict or
+# "ner.py predict") is streamed in lockstep with the gold labels, read from the
+# corpus file (test.txt) or from its vectors (test.txt.vector).
+#
+#   $ ner.py evaluate predictions.txt test.txt
+#
+# The report has the token accuracy (in liblinear's format, so it can replace
+# accuracy.txt), CoNLL-style entity precision, recall and F1, overall and per
+# entity type, and the label confusion matrix. An entity is a maximal run of
+# B-X I-X ... tokens, and it is correct if the predicted labels have an entity of
+# the same type with exactly the same first and last token. As in conlleval, an
+# I-X that doesn't continue an entity of type X starts a new one.
+#
+# With the corpus as gold, entities end at sentence boundaries, and a trailing
+# sentence without a blank line after it is skipped, as ner.py doesn't vectorize
+# it. A .vector file has no sentence boundaries, so its labels are one long
+# sequence. Predictions may be label codes (as in api.LABELS) or label names,
+# and the header line of liblinear's "predict -b 1" output is skipped.
+#
+# With workers > 1, the files are cut into shards that are evaluated by separate
+# processes and whose counts are added up. Shards start at a sentence (corpus
+# gold, found with its sentence index) or at a token that is O in both the gold
+# and the predicted labels (vector gold), so that no entity is cut in two and
+# the counts are exactly those of one pass.
+
+import itertools
+import json
+import multiprocessing
+import os
+
+import api
+import fileio
+import sentence_index
+
+LABELS = api.LABELS
+NUM_LABELS = len(LABELS)
+ENTITY_TYPES = ["PER", "LOC", "ORG"]
+
+# How many lines are evaluated at once when the gold labels are vectors
+BATCH_LINES = 65536
+
+# Label text (name or code, as str or bytes) -> label code
+_CODES = {}
+for _code, _label in enumerate(LABELS):
+    for _text in [_label, str(_code)]:
+        _CODES[_text] = _code
+        _CODES[_text.encode()] = _code
+
+# Entity type of every label code (0 for O, 1 + its index in ENTITY_TYPES for the others)
+_TYPES = [0 if label == "O" else 1 + ENTITY_TYPES.index(label[2:]) for label in LABELS]
+
+# _STARTS[previous * NUM_LABELS + label] is True if label starts an entity after
+# previous, _ENDS if an entity ends at previous (before label)
+_STARTS = []
+_ENDS = []
+for _previous in range(NUM_LABELS):
+    for _code, _label in enumerate(LABELS):
+        _starts = _label != "O" and (_label.startswith("B-") or _TYPES[_previous] != _TYPES[_code])
+        _STARTS.append(_starts)
+        _ENDS.append(_previous != 0 and (_TYPES[_previous] != _TYPES[_code] or _starts))
+
+# Returns the code of a label text, the first field of a line
+def _label_code(field):
+    code = _CODES.get(field)
+    if code is None:
+        raise Exception("Received a bad label: " + repr(field) + "!")
+    return code
+
+# True if gold_file_str holds vectors (.vector, maybe compressed) and not a corpus
+def is_vector_file(gold_file_str):
+    suffix = fileio.compression_suffix(gold_file_str)
+    return gold_file_str[:len(gold_file_str) - len(suffix)].endswith(".vector")
+
+# The counts of an evaluation: tokens by (gold, predicted) label, and entities
+# by type. add() takes the labels of consecutive tokens and can be called again
+# with the tokens that follow; end_sentence() closes the entities still open
+class Evaluation:
+    def __init__(self):
+        self.confusion = [0] * (NUM_LABELS * NUM_LABELS) # gold * NUM_LABELS + predicted
+        self.gold_entities = [0] * (len(ENTITY_TYPES) + 1) # by type, 0 unused
+        self.predicted_entities = [0] * (len(ENTITY_TYPES) + 1)
+        self.correct_entities = [0] * (len(ENTITY_TYPES) + 1)
+        # The sequence so far: the last gold and predicted label, and whether
+        # their open entities have matched since they started
+        self._gold = 0
+        self._predicted = 0
+        self._matching = False
+
+    # Adds the gold and predicted label codes of the next tokens
+    def add(self, gold_codes, predicted_codes):
+        confusion = self.confusion
+        gold_entities = self.gold_entities
+        predicted_entities = self.predicted_entities
+        correct_entities = self.correct_entities
+        gold_previous = self._gold
+        predicted_previous = self._predicted
+        matching = self._matching
+        for gold, predicted in zip(gold_codes, predicted_codes):
+            confusion[gold * NUM_LABELS + predicted] += 1
+            gold_pair = gold_previous * NUM_LABELS + gold
+            predicted_pair = predicted_previous * NUM_LABELS + predicted
+            if matching:
+                gold_ends = _ENDS[gold_pair]
+                if gold_ends and _ENDS[predicted_pair] and _TYPES[gold_previous] == _TYPES[predicted_previous]:
+                    correct_entities[_TYPES[gold_previous]] += 1
+                    matching = False
+                elif gold_ends != _ENDS[predicted_pair] or _TYPES[gold] != _TYPES[predicted]:
+                    matching = False
+            gold_starts = _STARTS[gold_pair]
+            predicted_starts = _STARTS[predicted_pair]
+            if gold_starts:
+                gold_entities[_TYPES[gold]] += 1
+            if predicted_starts:
+                predicted_entities[_TYPES[predicted]] += 1
+                if gold_starts and _TYPES[gold] == _TYPES[predicted]:
+                    matching = True
+            gold_previous = gold
+            predicted_previous = predicted
+        self._gold = gold_previous
+        self._predicted = predicted_previous
+        self._matching = matching
+
+    # Ends the current sentence (or sequence): entities still open end here
+    def end_sentence(self):
+        if self._matching:
+            self.correct_entities[_TYPES[self._gold]] += 1
+        self._gold = 0
+        self._predicted = 0
+        self._matching = False
+
+    # Adds the counts of another (finished) Evaluation
+    def merge(self, other):
+        for counts, other_counts in [(self.confusion, other.confusion),
+                                     (self.gold_entities, other.gold_entities),
+                                     (self.predicted_entities, other.predicted_entities),
+                                     (self.correct_entities, other.correct_entities)]:
+            for k in range(len(counts)):
+                counts[k] += other_counts[k]
+
+    def num_tokens(self):
+        return sum(self.confusion)
+
+    def num_correct_tokens(self):
+        return sum(self.confusion[code * NUM_LABELS + code] for code in range(NUM_LABELS))
+
+    # Returns (precision, recall, F1, gold, predicted, correct) of one entity
+    # type, or of all of them for entity_type None. Precision and recall are 0
+    # when nothing was predicted or there is nothing to find
+    def entity_scores(self, entity_type=None):
+        if entity_type is None:
+            gold, predicted, correct = (sum(self.gold_entities), sum(self.predicted_entities),
+                                        sum(self.correct_entities))
+        else:
+            k = 1 + ENTITY_TYPES.index(entity_type)
+            gold, predicted, correct = self.gold_entities[k], self.predicted_entities[k], self.correct_entities[k]
+        precision = correct / predicted if predicted else 0.0
+        recall = correct / gold if gold else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        return precision, recall, f1, gold, predicted, correct
+
+    # Returns the report as text
+    def report(self):
+        lines = []
+        total = self.num_tokens()
+        correct = self.num_correct_tokens()
+        lines.append("Accuracy = %g%% (%d/%d)" % (100.0 * correct / total if total else 0.0, correct, total))
+        for entity_type in [None] + ENTITY_TYPES:
+            precision, recall, f1, gold, predicted, correct = self.entity_scores(entity_type)
+            name = "Entities" if entity_type is None else "  " + entity_type
+            lines.append("%s: precision %.2f%%, recall %.2f%%, F1 %.2f (%d gold, %d predicted, %d correct)"
+                         % (name, 100 * precision, 100 * recall, 100 * f1, gold, predicted, correct))
+        lines.append("")
+        lines.append("Confusion matrix (rows: gold, columns: predicted)")
+        width = max(len(label) for label in LABELS + [str(max(self.confusion))]) + 1
+        lines.append(" " * width + "".join(label.rjust(width) for label in LABELS))
+        for gold, label in enumerate(LABELS):
+            row = self.confusion[gold * NUM_LABELS:(gold + 1) * NUM_LABELS]
+            lines.append(label.rjust(width) + "".join(str(count).rjust(width) for count in row))
+        return "\n".join(lines) + "\n"
+
+    # Returns the report as a dictionary, for JSON
+    def to_dict(self):
+        report = {"tokens": self.num_tokens(), "correct_tokens": self.num_correct_tokens(), "entities": {}}
+        report["accuracy"] = report["correct_tokens"] / report["tokens"] if report["tokens"] else 0.0
+        for entity_type in [None] + ENTITY_TYPES:
+            precision, recall, f1, gold, predicted, correct = self.entity_scores(entity_type)
+            report["entities"][entity_type or "all"] = {
+                "precision": precision, "recall": recall, "f1": f1,
+                "gold": gold, "predicted": predicted, "correct": correct}
+        report["labels"] = LABELS
+        report["confusion"] = [self.confusion[gold * NUM_LABELS:(gold + 1) * NUM_LABELS]
+                               for gold in range(NUM_LABELS)]
+        return report
+
+# Returns the lines of an open predictions file, without the header line of
+# liblinear's "predict -b 1" output ("labels 0 1 2 ...")
+def _prediction_lines(predictions_file):
+    first_line = predictions_file.readline()
+    if first_line.startswith("labels" if isinstance(first_line, str) else b"labels"):
+        return predictions_file
+    return itertools.chain([first_line], predictions_file)
+
+# Evaluates the open gold and predictions files into evaluation, in lockstep
+# from their current positions: all the way to the end of both, or only the
+# next num_tokens tokens (with corpus gold, they must end a sentence)
+def _evaluate_files(gold_file, predictions, vector_gold, evaluation, num_tokens=None):
+    if vector_gold:
+        _evaluate_vectors(gold_file, predictions, evaluation, num_tokens)
+    else:
+        _evaluate_corpus(gold_file, predictions, evaluation, num_tokens)
+    if num_tokens is None and next(iter(predictions), None) is not None:
+        raise Exception("There are more predictions than gold labels!")
+
+def _evaluate_vectors(gold_file, predictions, evaluation, num_tokens):
+    remaining = num_tokens
+    while remaining is None or remaining > 0:
+        batch_lines = BATCH_LINES if remaining is None else min(BATCH_LINES, remaining)
+        gold_codes = [_label_code(line.split(None, 1)[0]) for line in itertools.islice(gold_file, batch_lines)]
+        predicted_codes = [_label_code(line.split(None, 1)[0])
+                           for line in itertools.islice(predictions, len(gold_codes))]
+        if len(predicted_codes) != len(gold_codes):
+            raise Exception("There are fewer predictions than gold labels!")
+        if remaining is not None:
+            if len(gold_codes) != batch_lines:
+                raise Exception("The gold labels ended early!")
+            remaining -= len(gold_codes)
+        evaluation.add(gold_codes, predicted_codes)
+        if len(gold_codes) < batch_lines:
+            break
+    evaluation.end_sentence()
+
+def _evaluate_corpus(gold_file, predictions, evaluation, num_tokens):
+    evaluated = 0
+    gold_codes = []
+    for line in gold_file:
+        fields = line.split(None, 1)
+        if fields:
+            gold_codes.append(_label_code(fields[0]))
+        elif gold_codes: # a sentence ends; nec. bc there can be consecutive blank lines
+            predicted_codes = [_label_code(line.split(None, 1)[0])
+                               for line in itertools.islice(predictions, len(gold_codes))]
+            if len(predicted_codes) != len(gold_codes):
+                raise Exception("There are fewer predictions than gold labels!")
+            evaluation.add(gold_codes, predicted_codes)
+            evaluation.end_sentence()
+            evaluated += len(gold_codes)
+            gold_codes = []
+            if evaluated == num_tokens:
+                return
+    if num_tokens is not None:
+        raise Exception("The gold labels ended early!")
+
+# Evaluates the predictions file against the gold file (corpus or vectors, see
+# is_vector_file) and returns the Evaluation. workers > 1 evaluates shards of
+# the files in that many processes, which needs uncompressed files
+def evaluate(predictions_file_str, gold_file_str, workers=1):
+    vector_gold = is_vector_file(gold_file_str)
+    if workers > 1:
+        return _evaluate_in_parallel(predictions_file_str, gold_file_str, vector_gold, workers)
+    evaluation = Evaluation()
+    gold_file = fileio.open_input(gold_file_str)
+    predictions_file = fileio.open_input(predictions_file_str)
+    _evaluate_files(gold_file, _prediction_lines(predictions_file), vector_gold, evaluation)
+    predictions_file.close()
+    gold_file.close()
+    return evaluation
+
+# Worker of _evaluate_in_parallel: evaluates one shard, given as (gold file,
+# gold offset, predictions file, predictions offset, number of tokens or None
+# for the rest of the files, vector_gold)
+def _evaluate_shard(shard):
+    gold_file_str, gold_offset, predictions_file_str, predictions_offset, num_tokens, vector_gold = shard
+    evaluation = Evaluation()
+    gold_file = fileio.open_input(gold_file_str)
+    gold_file.seek(gold_offset) # a line start, so the text decoder has no state there
+    predictions_file = fileio.open_input(predictions_file_str)
+    predictions_file.seek(predictions_offset)
+    _evaluate_files(gold_file, predictions_file, vector_gold, evaluation, num_tokens)
+    predictions_file.close()
+    gold_file.close()
+    return evaluation
+
+# Returns the byte offsets of the given lines (numbered from 0, ascending) of a
+# file, counting lines from the byte offset start. Lines past the end are left out
+def _line_offsets(file_str, line_numbers, start=0):
+    offsets = []
+    input_file = open(file_str, "rb")
+    input_file.seek(start)
+    position = start
+    lines = 0 # lines before position
+    targets = iter(line_numbers)
+    target = next(targets, None)
+    while target is not None:
+        if target == lines:
+            offsets.append(position)
+            target = next(targets, None)
+            continue
+        block = input_file.read(fileio.BUFFER_BYTES)
+        if not block:
+            break
+        block_lines = block.count(b"\n")
+        if lines + block_lines < target:
+            lines += block_lines
+            position += len(block)
+            continue
+        # The target lines start in this block, each after its (target - base)-th newline
+        base = lines
+        end = -1
+        while target is not None and target <= base + block_lines:
+            for k in range(target - lines):
+                end = block.index(b"\n", end + 1)
+            lines = target
+            offsets.append(position + end + 1)
+            target = next(targets, None)
+        lines = base + block_lines
+        position += len(block)
+    input_file.close()
+    return offsets
+
+# Returns the number of lines of a file before each of the given (ascending) byte offsets
+def _line_numbers(file_str, offsets):
+    line_numbers = []
+    input_file = open(file_str, "rb")
+    lines = 0
+    position = 0
+    for offset in offsets:
+        while position < offset:
+            block = input_file.read(min(fileio.BUFFER_BYTES, offset - position))
+            if not block:
+                break
+            lines += block.count(b"\n")
+            position += len(block)
+        line_numbers.append(lines)
+    input_file.close()
+    return line_numbers
+
+# Returns the shards of vector gold and predictions (both files' offsets and
+# token numbers) for _evaluate_in_parallel. The files are cut at about even byte
+# offsets of the gold file, each moved forward to a token that is O in both
+def _vector_shard_starts(gold_file_str, predictions_file_str, predictions_start, num_shards):
+    size = os.path.getsize(gold_file_str)
+    gold_file = open(gold_file_str, "rb")
+    gold_offsets = []
+    for k in range(1, num_shards):
+        gold_file.seek(size * k // num_shards)
+        gold_file.readline() # skip the rest of the line we landed in
+        if gold_file.tell() < size and (not gold_offsets or gold_file.tell() > gold_offsets[-1]):
+            gold_offsets.append(gold_file.tell())
+    line_numbers = _line_numbers(gold_file_str, gold_offsets)
+    predictions_offsets = _line_offsets(predictions_file_str, line_numbers, predictions_start)
+
+    starts = [(0, predictions_start, 0)]
+    predictions_file = open(predictions_file_str, "rb")
+    for gold_offset, predictions_offset, line_number in zip(gold_offsets, predictions_offsets, line_numbers):
+        if gold_offset <= starts[-1][0]:
+            continue
+        gold_file.seek(gold_offset)
+        predictions_file.seek(predictions_offset)
+        while True:
+            gold_line = gold_file.readline()
+            predicted_line = predictions_file.readline()
+            if not gold_line or not predicted_line:
+                break
+            if _label_code(gold_line.split(None, 1)[0]) == 0 and _label_code(predicted_line.split(None, 1)[0]) == 0:
+                starts.append((gold_offset, predictions_offset, line_number))
+                break
+            gold_offset += len(gold_line)
+            predictions_offset += len(predicted_line)
+            line_number += 1
+    predictions_file.close()
+    gold_file.close()
+    return starts
+
+# Returns the shards of corpus gold and predictions: every shard starts at a
+# sentence, found with the corpus's sentence index
+def _corpus_shard_starts(gold_file_str, predictions_file_str, predictions_start, num_shards):
+    index = sentence_index.load_index(gold_file_str, fileio.output_path(gold_file_str, ".index", compressed=False))
+    sentences = sorted(set(len(index) * k // num_shards for k in range(num_shards)))
+    sentences = [k for k in sentences if k < len(index)] or [0]
+    token_numbers = [index.first_token(k) for k in sentences]
+    predictions_offsets = _line_offsets(predictions_file_str, token_numbers, predictions_start)
+    gold_offsets = [index.offset(k) if k < len(index) else 0 for k in sentences]
+    return list(zip(gold_offsets, predictions_offsets, token_numbers))
+
+def _evaluate_in_parallel(predictions_file_str, gold_file_str, vector_gold, workers):
+    for file_str in [predictions_file_str, gold_file_str]:
+        if not fileio.is_seekable(file_str):
+            raise Exception("--workers needs uncompressed files, not " + file_str + "!")
+    predictions_file = open(predictions_file_str, "rb")
+    first_line = predictions_file.readline()
+    predictions_file.close()
+    predictions_start = len(first_line) if first_line.startswith(b"labels") else 0
+
+    # A few shards per worker keeps the workers busy when shards are uneven
+    if vector_gold:
+        starts = _vector_shard_starts(gold_file_str, predictions_file_str, predictions_start, workers * 4)
+    else:
+        starts = _corpus_shard_starts(gold_file_str, predictions_file_str, predictions_start, workers * 4)
+    shards = []
+    for k, (gold_offset, predictions_offset, first_token) in enumerate(starts):
+        num_tokens = starts[k + 1][2] - first_token if k + 1 < len(starts) else None
+        shards.append((gold_file_str, gold_offset, predictions_file_str, predictions_offset, num_tokens, vector_gold))
+
+    evaluation = Evaluation()
+    pool = multiprocessing.Pool(workers)
+    for shard_evaluation in pool.imap(_evaluate_shard, shards):
+        evaluation.merge(shard_evaluation)
+    pool.close()
+    pool.join()
+    return evaluation
+
+# Writes evaluation.to_dict() as JSON to file_str ("-" for stdout)
+def save_json(evaluation, file_str):
+    output_file = fileio.open_output(file_str)
+    json.dump(evaluation.to_dict(), output_file, indent=2)
+    output_file.write("\n")
+    output_file.close()
@@ -0,0 +1,465 @@
+# Feature extractor registry. Every feature type (WORD, WORDCON, POS, ...) is a
+# plugin class with four groups of hooks:
+#
+#   vocabulary      add_token is called for every token of the training file and
+#                   adds the token's feature strings to feature_ids; add_indicators
+#                   and add_pseudos then add the fixed entries ("abbreviated",
+#                   "word-UNK", "prev-word-PHI", ...) once the training file is done
+#   vectorization   add_ids appends the ids of the features that fire for a token
+#   readable        readable returns the text after "<name>: " in a .readable file
+#   arrays          the numpy engine (numpy_engine.py) calls word_values and
+#                   pos_values once per distinct word and pos tag for the values
+#                   the feature needs (ids, readable text, ...), and array_ids and
+#                   array_readable build the id columns and readable texts of a
+#                   whole batch of tokens from them (see numpy_engine.ArrayBatch)
+#
+# compile_features turns the feature types from the command line into a
+# CompiledFeatures object holding a fixed list of the active extractors, so the
+# per-token loops never test feature_types membership and disabled feature types
+# cost nothing. To add a feature type, write one extractor class and decorate it
+# with @register; the command line, vocabulary, vectors and readable files of
+# both engines all pick it up from the registry. Registration order is the order of the lines in
+# the readable files and of the ids handed out to new features.
+#
+# A sentence is a corpus.Sentence, so sentence.poses[i] is the pos tag of
+# token i and sentence.words[i] its word.
+
+import re
+
+import gazetteer
+
+# Abbreviations end with a period and consist entirely of alphabetic characters
+# and 1 or more periods, and are less than 5 characters
+_ABBREVIATION = re.compile("^(\\.*[a-zA-Z]*\\.*)+\\.$")
+
+# The length test comes first: the pattern backtracks badly on long words
+def is_abbreviated(word):
+    return len(word) < 5 and _ABBREVIATION.match(word) is not None
+
+def is_capitalized(word):
+    return word[:1].isupper()
+
+# Feature type name -> extractor class, in registration order
+FEATURE_EXTRACTORS = {}
+
+# Class decorator that adds a feature extractor to the registry
+def register(extractor_class):
+    FEATURE_EXTRACTORS[extractor_class.name] = extractor_class
+    return extractor_class
+
+# Base class of the feature extractors. All hooks do nothing by default
+class FeatureExtractor:
+    name = None
+
+    # False for feature types that only get a readable line while they are on,
+    # so the readable files of runs without them keep the assignment's format
+    readable_when_off = True
+
+    # locations is the set of locations from the locations file, or a
+    # gazetteer.Gazetteer if it is a compiled gazetteer
+    def __init__(self, locations):
+        self.locations = locations
+
+    # Vocabulary: adds the features of token i to feature_ids
+    def add_token(self, sentence, i, feature_ids, current_id):
+        pass
+
+    # Vocabulary: adds the indicator features ("abbreviated", ...) after the
+    # training file has been read
+    def add_indicators(self, feature_ids, current_id):
+        pass
+
+    # Vocabulary: adds the pseudo features (UNK, PHI, OMEGA) after all indicators
+    def add_pseudos(self, feature_ids, current_id):
+        pass
+
+    # Vectorization: appends the ids of token i's features to ids
+    def add_ids(self, sentence, i, feature_ids, ids):
+        pass
+
+    # Readable: returns the readable text for token i. set_type is "train" or
+    # "test"; for "test", strings missing from feature_ids are shown as UNK
+    def readable(self, sentence, i, feature_ids, set_type):
+        return "n/a"
+
+    # Arrays: returns a tuple of the values the feature needs of a word (or a pos
+    # tag). The numpy engine keeps them in tables, one per tuple position
+    def word_values(self, word, feature_ids, set_type):
+        return ()
+
+    def pos_values(self, pos, feature_ids, set_type):
+        return ()
+
+    # Arrays: returns a list of id columns for batch, each with one id per token
+    # (0 where the feature doesn't fire)
+    def array_ids(self, batch, feature_ids):
+        return []
+
+    # Arrays: returns the readable texts of every token of batch
+    def array_readable(self, batch, feature_ids, set_type):
+        return "n/a"
+
+# Adds key to feature_ids with the next free id, unless it is already there
+def _add(feature_ids, current_id, key):
+    if key not in feature_ids:
+        feature_ids[key] = current_id[0]
+        current_id[0] += 1
+
+# Gives key the next free id, even if it is already there (indicators and pseudos
+# always get their own id, after every word)
+def _assign(feature_ids, current_id, key):
+    feature_ids[key] = current_id[0]
+    current_id[0] += 1
+
+# Returns the id of key, or the id of unk_key if key isn't in feature_ids
+def _id_or_unk(feature_ids, key, unk_key):
+    if key in feature_ids:
+        return feature_ids[key]
+    return feature_ids[unk_key]
+
+# Returns word, or "UNK" on the test set if it wasn't in the training data
+def _known_word(feature_ids, word, set_type):
+    if set_type == "test" and ("word-" + word) not in feature_ids:
+        return "UNK"
+    return word
+
+# Returns pos, or "UNKPOS" on the test set if it wasn't in the training data
+def _known_pos(feature_ids, pos, set_type):
+    if set_type == "test" and ("pos-" + pos) not in feature_ids:
+        return "UNKPOS"
+    return pos
+
+@register
+class WordFeature(FeatureExtractor):
+    name = "WORD"
+
+    def add_token(self, sentence, i, feature_ids, current_id):
+        _add(feature_ids, current_id, "word-" + sentence.words[i])
+
+    def add_pseudos(self, feature_ids, current_id):
+        _assign(feature_ids, current_id, "word-UNK")
+
+    def add_ids(self, sentence, i, feature_ids, ids):
+        ids.append(_id_or_unk(feature_ids, "word-" + sentence.words[i], "word-UNK"))
+
+    def readable(self, sentence, i, feature_ids, set_type):
+        return _known_word(feature_ids, sentence.words[i], set_type)
+
+    def word_values(self, word, feature_ids, set_type):
+        return (_id_or_unk(feature_ids, "word-" + word, "word-UNK"), _known_word(feature_ids, word, set_type))
+
+    def array_ids(self, batch, feature_ids):
+        return [batch.words(self, 0)]
+
+    def array_readable(self, batch, feature_ids, set_type):
+        return batch.words(self, 1)
+
+# The words before and after the word. Sentence boundaries are PHI and OMEGA
+@register
+class WordContextFeature(FeatureExtractor):
+    name = "WORDCON"
+
+    def add_token(self, sentence, i, feature_ids, current_id):
+        # prev-word-PHI and next-word-OMEGA are added in add_pseudos
+        if i > 0:
+            _add(feature_ids, current_id, "prev-word-" + sentence.words[i-1])
+        if i < len(sentence) - 1:
+            _add(feature_ids, current_id, "next-word-" + sentence.words[i+1])
+
+    def add_pseudos(self, feature_ids, current_id):
+        for key in ["prev-word-UNK", "next-word-UNK", "prev-word-PHI", "next-word-OMEGA"]:
+            _assign(feature_ids, current_id, key)
+
+    def add_ids(self, sentence, i, feature_ids, ids):
+        if i == 0:
+            ids.append(feature_ids["prev-word-PHI"])
+        else:
+            ids.append(_id_or_unk(feature_ids, "prev-word-" + sentence.words[i-1], "prev-word-UNK"))
+        if i == len(sentence) - 1:
+            ids.append(feature_ids["next-word-OMEGA"])
+        else:
+            ids.append(_id_or_unk(feature_ids, "next-word-" + sentence.words[i+1], "next-word-UNK"))
+
+    def readable(self, sentence, i, feature_ids, set_type):
+        prev_word = "PHI"
+        if i > 0:
+            prev_word = _known_word(feature_ids, sentence.words[i-1], set_type)
+        next_word = "OMEGA"
+        if i < len(sentence) - 1:
+            next_word = _known_word(feature_ids, sentence.words[i+1], set_type)
+        return prev_word + " " + next_word
+
+    def word_values(self, word, feature_ids, set_type):
+        return (_id_or_unk(feature_ids, "prev-word-" + word, "prev-word-UNK"),
+                _id_or_unk(feature_ids, "next-word-" + word, "next-word-UNK"),
+                _known_word(feature_ids, word, set_type))
+
+    def array_ids(self, batch, feature_ids):
+        return [batch.previous(batch.words(self, 0), feature_ids["prev-word-PHI"]),
+                batch.following(batch.words(self, 1), feature_ids["next-word-OMEGA"])]
+
+    def array_readable(self, batch, feature_ids, set_type):
+        words = batch.words(self, 2)
+        return batch.previous(words, "PHI") + " " + batch.following(words, "OMEGA")
+
+@register
+class PosFeature(FeatureExtractor):
+    name = "POS"
+
+    def add_token(self, sentence, i, feature_ids, current_id):
+        _add(feature_ids, current_id, "pos-" + sentence.poses[i])
+
+    def add_pseudos(self, feature_ids, current_id):
+        _assign(feature_ids, current_id, "pos-UNKPOS")
+
+    def add_ids(self, sentence, i, feature_ids, ids):
+        ids.append(_id_or_unk(feature_ids, "pos-" + sentence.poses[i], "pos-UNKPOS"))
+
+    def readable(self, sentence, i, feature_ids, set_type):
+        return _known_pos(feature_ids, sentence.poses[i], set_type)
+
+    def pos_values(self, pos, feature_ids, set_type):
+        return (_id_or_unk(feature_ids, "pos-" + pos, "pos-UNKPOS"), _known_pos(feature_ids, pos, set_type))
+
+    def array_ids(self, batch, feature_ids):
+        return [batch.poses(self, 0)]
+
+    def array_readable(self, batch, feature_ids, set_type):
+        return batch.poses(self, 1)
+
+# The pos tags before and after the word's. Sentence boundaries are PHIPOS and OMEGAPOS
+@register
+class PosContextFeature(FeatureExtractor):
+    name = "POSCON"
+
+    def add_token(self, sentence, i, feature_ids, current_id):
+        # prev-pos-PHIPOS and next-pos-OMEGAPOS are added in add_pseudos
+        if i > 0:
+            _add(feature_ids, current_id, "prev-pos-" + sentence.poses[i-1])
+        if i < len(sentence) - 1:
+            _add(feature_ids, current_id, "next-pos-" + sentence.poses[i+1])
+
+    def add_pseudos(self, feature_ids, current_id):
+        for key in ["prev-pos-UNKPOS", "next-pos-UNKPOS", "prev-pos-PHIPOS", "next-pos-OMEGAPOS"]:
+            _assign(feature_ids, current_id, key)
+
+    def add_ids(self, sentence, i, feature_ids, ids):
+        if i == 0:
+            ids.append(feature_ids["prev-pos-PHIPOS"])
+        else:
+            ids.append(_id_or_unk(feature_ids, "prev-pos-" + sentence.poses[i-1], "prev-pos-UNKPOS"))
+        if i == len(sentence) - 1:
+            ids.append(feature_ids["next-pos-OMEGAPOS"])
+        else:
+            ids.append(_id_or_unk(feature_ids, "next-pos-" + sentence.poses[i+1], "next-pos-UNKPOS"))
+
+    def readable(self, sentence, i, feature_ids, set_type):
+        prev_pos = "PHIPOS"
+        if i > 0:
+            prev_pos = _known_pos(feature_ids, sentence.poses[i-1], set_type)
+        next_pos = "OMEGAPOS"
+        if i < len(sentence) - 1:
+            next_pos = _known_pos(feature_ids, sentence.poses[i+1], set_type)
+        return prev_pos + " " + next_pos
+
+    def pos_values(self, pos, feature_ids, set_type):
+        return (_id_or_unk(feature_ids, "prev-pos-" + pos, "prev-pos-UNKPOS"),
+                _id_or_unk(feature_ids, "next-pos-" + pos, "next-pos-UNKPOS"),
+                _known_pos(feature_ids, pos, set_type))
+
+    def array_ids(self, batch, feature_ids):
+        return [batch.previous(batch.poses(self, 0), feature_ids["prev-pos-PHIPOS"]),
+                batch.following(batch.poses(self, 1), feature_ids["next-pos-OMEGAPOS"])]
+
+    def array_readable(self, batch, feature_ids, set_type):
+        poses = batch.poses(self, 2)
+        return batch.previous(poses, "PHIPOS") + " " + batch.following(poses, "OMEGAPOS")
+
+# Base class of the yes/no features of a single word. Subclasses set
+# indicator (the feature string) and implement fires(word)
+class WordIndicatorFeature(FeatureExtractor):
+    indicator = None
+
+    def fires(self, word):
+        raise NotImplementedError
+
+    def add_indicators(self, feature_ids, current_id):
+        _assign(feature_ids, current_id, self.indicator)
+
+    def add_ids(self, sentence, i, feature_ids, ids):
+        if self.fires(sentence.words[i]):
+            ids.append(feature_ids[self.indicator])
+
+    def readable(self, sentence, i, feature_ids, set_type):
+        if self.fires(sentence.words[i]):
+            return "yes"
+        return "no"
+
+    def word_values(self, word, feature_ids, set_type):
+        return (self.fires(word),)
+
+    def array_ids(self, batch, feature_ids):
+        return [batch.where(batch.words(self, 0), feature_ids[self.indicator])]
+
+    def array_readable(self, batch, feature_ids, set_type):
+        return batch.where(batch.words(self, 0), "yes", "no")
+
+@register
+class AbbreviationFeature(WordIndicatorFeature):
+    name = "ABBR"
+    indicator = "abbreviated"
+
+    def fires(self, word):
+        return is_abbreviated(word)
+
+@register
+class CapitalizationFeature(WordIndicatorFeature):
+    name = "CAP"
+    indicator = "capitalized"
+
+    def fires(self, word):
+        return is_capitalized(word)
+
+@register
+class LocationFeature(WordIndicatorFeature):
+    name = "LOCATION"
+    indicator = "is-location"
+
+    def fires(self, word):
+        return word in self.locations
+
+# Names from the gazetteer (or the locations file) that span one or more tokens,
+# matched over the whole sentence: every token of a match gets the feature
+# "gaz-B-<category>" (first token) or "gaz-I-<category>" (the others). These
+# features are added to the vocabulary as they fire in the training file, so a
+# tag that never fired there doesn't fire on the test set either
+@register
+class GazetteerFeature(FeatureExtractor):
+    name = "GAZ"
+    readable_when_off = False
+
+    def __init__(self, locations):
+        super().__init__(locations)
+        self.gazetteer = gazetteer.as_gazetteer(locations)
+        # The last sentence and its tags, and the last batch and its matches
+        self._sentence = None
+        self._sentence_tags = None
+        self._batch = None
+        self._batch_spans = None
+
+    # Returns the BIO tags of every token of sentence, matching the sentence
+    # only once even though the hooks are called token by token
+    def _tags(self, sentence):
+        if sentence is not self._sentence:
+            self._sentence_tags = self.gazetteer.bio_tags(sentence.words)
+            self._sentence = sentence
+        return self._sentence_tags
+
+    def add_token(self, sentence, i, feature_ids, current_id):
+        for tag in self._tags(sentence)[i]:
+            _add(feature_ids, current_id, "gaz-" + tag)
+
+    def add_ids(self, sentence, i, feature_ids, ids):
+        for tag in self._tags(sentence)[i]:
+            feature_id = feature_ids.get("gaz-" + tag)
+            if feature_id is not None:
+                ids.append(feature_id)
+
+    def readable(self, sentence, i, feature_ids, set_type):
+        tags = self._tags(sentence)[i]
+        if not tags:
+            return "O"
+        return " ".join(tags)
+
+    def word_values(self, word, feature_ids, set_type):
+        return (self.gazetteer.token_id(word),)
+
+    # Returns the matches of batch as (start, end, category bits) with positions
+    # in the batch, matching the batch only once for its ids and readable texts
+    def _spans(self, batch):
+        if batch is not self._batch:
+            token_ids = batch.words(self, 0).tolist()
+            self._batch_spans = []
+            for start, end in batch.sentences():
+                for span_start, span_end, bits in self.gazetteer.match_token_ids(token_ids[start:end]):
+                    self._batch_spans.append((start + span_start, start + span_end, bits))
+            self._batch = batch
+        return self._batch_spans
+
+    def array_ids(self, batch, feature_ids):
+        columns = []
+        for k, category in enumerate(self.gazetteer.categories):
+            column = batch.zeros()
+            begin_id = feature_ids.get("gaz-B-" + category) or 0
+            inside_id = feature_ids.get("gaz-I-" + category) or 0
+            for start, end, bits in self._spans(batch):
+                if bits & (1 << k):
+                    column[start] = begin_id
+                    column[start + 1:end] = inside_id
+            columns.append(column)
+        return columns
+
+    def array_readable(self, batch, feature_ids, set_type):
+        tags = batch.texts("O")
+        for start, end, bits in self._spans(batch):
+            names = self.gazetteer.category_names(bits)
+            tags[start] = " ".join("B-" + category for category in names)
+            tags[start + 1:end] = " ".join("I-" + category for category in names)
+        return tags
+
+# The feature types given on the command line, compiled into the active
+# extractors. feature_types and locations are kept for the code that needs the
+# raw settings (saving a vocabulary, the numpy engine)
+class CompiledFeatures:
+    def __init__(self, feature_types, locations):
+        self.feature_types = feature_types
+        self.locations = locations
+        self.extractors = []
+        # (readable line prefix, extractor or None for "n/a") for every registered type
+        self.readable_lines = []
+        for name, extractor_class in FEATURE_EXTRACTORS.items():
+            extractor = None
+            if name in feature_types:
+                extractor = extractor_class(locations)
+                self.extractors.append(extractor)
+            elif not extractor_class.readable_when_off:
+                continue
+            self.readable_lines.append((name + ": ", extractor))
+
+    # Adds the features of every token of a training sentence to feature_ids
+    def add_sentence(self, sentence, feature_ids, current_id):
+        for i in range(len(sentence)):
+            for extractor in self.extractors:
+                extractor.add_token(sentence, i, feature_ids, current_id)
+
+    # Adds the indicator features and then the pseudo features to feature_ids
+    def finish_vocabulary(self, feature_ids, current_id):
+        for extractor in self.extractors:
+            extractor.add_indicators(feature_ids, current_id)
+        for extractor in self.extractors:
+            extractor.add_pseudos(feature_ids, current_id)
+
+    # Returns the ids of token i's features, unsorted
+    def token_ids(self, sentence, i, feature_ids):
+        ids = []
+        for extractor in self.extractors:
+            extractor.add_ids(sentence, i, feature_ids, ids)
+        return ids
+
+    # Returns the readable block of token i (every line, including "n/a" ones)
+    def token_readable(self, sentence, i, feature_ids, set_type):
+        lines = []
+        for prefix, extractor in self.readable_lines:
+            if extractor is None:
+                lines.append(prefix + "n/a\n")
+            else:
+                lines.append(prefix + extractor.readable(sentence, i, feature_ids, set_type) + "\n")
+        return "".join(lines)
+
+# Compiles a set of feature type names into a CompiledFeatures. The WORD
+# feature is always on
+def compile_features(feature_types, locations):
+    for name in feature_types:
+        if name not in FEATURE_EXTRACTORS:
+            raise Exception("Unknown feature type " + name + "!")
+    return CompiledFeatures(set(feature_types) | {"WORD"}, locations)
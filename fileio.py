@@ -0,0 +1,63 @@
+# Opening corpus, vector and readable files. Every text file ner.py reads or
+# writes goes through open_input/open_output, which
+#   - read and write gzip, bzip2 and xz files transparently, by extension
+#     (.gz, .bz2, .xz)
+#   - treat "-" as stdin/stdout, so ner.py can sit in a shell pipeline
+#   - buffer BUFFER_BYTES at a time, so output is handed to the OS (and to the
+#     compressor) in large chunks instead of the default 8 KB
+#
+# Output files are named after their input file and keep its compression:
+# train.txt.gz gives train.txt.vector.gz and train.txt.readable.gz.
+
+import bz2
+import gzip
+import io
+import lzma
+import sys
+
+BUFFER_BYTES = 1 << 20
+
+# Compression suffix -> module with a gzip.open-like open function
+_COMPRESSORS = {".gz": gzip, ".bz2": bz2, ".xz": lzma}
+
+# Returns the compression suffix of a file name (".gz", ".bz2", ".xz"), or ""
+def compression_suffix(file_str):
+    for suffix in _COMPRESSORS:
+        if file_str.endswith(suffix):
+            return suffix
+    return ""
+
+# True for files that can be read at arbitrary byte offsets (not stdin and not
+# compressed), which --workers needs to split them into shards
+def is_seekable(file_str):
+    return file_str != "-" and compression_suffix(file_str) == ""
+
+# Returns the name of an output file of input_file_str, e.g. ("train.txt.gz",
+# ".vector") -> "train.txt.vector.gz". Binary outputs (compressed=False) don't
+# get the compression suffix: ("train.txt.gz", ".csr") -> "train.txt.csr"
+def output_path(input_file_str, extension, compressed=True):
+    suffix = compression_suffix(input_file_str)
+    return input_file_str[:len(input_file_str) - len(suffix)] + extension + (suffix if compressed else "")
+
+# Opens a text file for reading
+def open_input(file_str):
+    if file_str == "-":
+        return open(sys.stdin.fileno(), buffering=BUFFER_BYTES, closefd=False)
+    compressor = _COMPRESSORS.get(compression_suffix(file_str))
+    if compressor is not None:
+        return io.TextIOWrapper(io.BufferedReader(compressor.open(file_str, "rb"), BUFFER_BYTES))
+    return open(file_str, buffering=BUFFER_BYTES)
+
+# Opens a text file for writing
+def open_output(file_str):
+    if file_str == "-":
+        sys.stdout.flush()
+        return open(sys.stdout.fileno(), "w", buffering=BUFFER_BYTES, closefd=False)
+    suffix = compression_suffix(file_str)
+    if suffix == ".gz":
+        raw = gzip.open(file_str, "wb", compresslevel=6) # 9 is much slower for little gain
+    elif suffix:
+        raw = _COMPRESSORS[suffix].open(file_str, "wb")
+    else:
+        return open(file_str, "w", buffering=BUFFER_BYTES)
+    return io.TextIOWrapper(io.BufferedWriter(raw, BUFFER_BYTES))
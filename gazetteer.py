@@ -0,0 +1,255 @@
+# Compiled gazetteers: lists of multi-word names (locations, people,
+# organizations, ...) compiled into a token trie that is memory-mapped from disk,
+# so that even lists of millions of names load instantly and cost no Python
+# objects. Used by the GAZ feature type (extractors.py), which tags the tokens
+# of every matched name B-<category> or I-<category>, and by LOCATION, which
+# looks single words up in the LOC category.
+#
+#   $ ner.py compile-gazetteer names.gaz LOC=locs.txt PER=people.txt ORG=orgs.txt
+#   $ ner.py train.txt test.txt names.gaz WORD POS LOCATION GAZ
+#
+# A list file has one name per line; names are split into tokens on whitespace,
+# like the words of the corpus. A plain locations file works too: the GAZ
+# feature then compiles it in memory as the LOC category.
+#
+# Matching is leftmost-longest over the tokens of a sentence: from each token,
+# the trie is walked as far as the following tokens allow, the longest name
+# found becomes a span, and the search resumes after it. A token that is no
+# name's first word costs one dictionary lookup.
+#
+# Layout (all integers little-endian, sections aligned to 8 bytes; positions are
+# relative to the start of the gazetteer, which can be embedded in a vocabulary
+# file, see vocabfile.py):
+#           magic "NERGAZ01"
+#           2 x (count, offsets position, blob position, values position)  uint64
+#               tokens (values: token ids) and categories, as in vocabfile.py
+#           node count, edge count, and the positions of
+#               edge_starts uint32[nodes + 1]   node n's edges are edge_starts[n]..[n+1]
+#               edge_tokens uint32[edges]       sorted by token id within a node
+#               edge_targets uint32[edges]
+#               node_categories uint32[nodes]   bit k set: a name of category k ends here
+#           total size                          uint64
+#
+# Node 0 is the root; categories are numbered in sorted order.
+
+import bisect
+import io
+import mmap
+import os
+import struct
+
+import fileio
+import vocabfile
+
+MAGIC = b"NERGAZ01"
+_NODES = struct.Struct("<7Q")
+_HEADER_SIZE = len(MAGIC) + 2 * vocabfile.SECTION.size + _NODES.size
+
+# The category LOCATION looks words up in
+LOCATION_CATEGORY = "LOC"
+
+# Most categories a gazetteer can have (one bit each in node_categories)
+MAX_CATEGORIES = 32
+
+# True if file_str is a compiled gazetteer (and not a text list)
+def is_gazetteer(file_str):
+    if not fileio.is_seekable(file_str) or not os.path.isfile(file_str):
+        return False
+    gazetteer_file = open(file_str, "rb")
+    magic = gazetteer_file.read(len(MAGIC))
+    gazetteer_file.close()
+    return magic == MAGIC
+
+# Writes the trie of names, given as a {category: iterable of names} dictionary,
+# to the open binary file out, starting at its current position
+def write_gazetteer(out, names_by_category):
+    categories = sorted(names_by_category)
+    if len(categories) > MAX_CATEGORIES:
+        raise Exception("A gazetteer can have at most " + str(MAX_CATEGORIES) + " categories!")
+
+    # Build the trie as nested dictionaries: token -> [children, category bits]
+    root = [{}, 0]
+    tokens = set()
+    for k, category in enumerate(categories):
+        for name in names_by_category[category]:
+            name_tokens = name.split()
+            if not name_tokens:
+                continue
+            node = root
+            for token in name_tokens:
+                child = node[0].get(token)
+                if child is None:
+                    child = node[0][token] = [{}, 0]
+                    tokens.add(token)
+                node = child
+            node[1] |= 1 << k
+    token_ids = {token: k for k, token in enumerate(sorted(tokens))}
+
+    # Number the nodes breadth first and lay out their edges
+    nodes = [root]
+    edge_starts = [0]
+    edge_tokens = []
+    edge_targets = []
+    node_categories = []
+    for node in nodes: # grows while it is iterated
+        node_categories.append(node[1])
+        for token_id, child in sorted((token_ids[token], child) for token, child in node[0].items()):
+            edge_tokens.append(token_id)
+            edge_targets.append(len(nodes))
+            nodes.append(child)
+        edge_starts.append(len(edge_tokens))
+
+    start = out.tell()
+    relative = io.BytesIO() # positions inside the gazetteer, not the file
+    relative.write(b"\0" * _HEADER_SIZE) # header is filled in at the end
+    sections = [vocabfile.write_table(relative, token_ids.keys(), token_ids),
+                vocabfile.write_table(relative, categories)]
+    positions = []
+    for values in [edge_starts, edge_tokens, edge_targets, node_categories]:
+        vocabfile.align(relative)
+        positions.append(relative.tell())
+        relative.write(struct.pack("<%dI" % len(values), *values))
+    vocabfile.align(relative)
+    size = relative.tell()
+    relative.seek(0)
+    relative.write(MAGIC)
+    for section in sections:
+        relative.write(vocabfile.SECTION.pack(*section))
+    relative.write(_NODES.pack(len(nodes), len(edge_tokens), *positions, size))
+    out.write(relative.getbuffer())
+    return out.tell() - start
+
+# Compiles name lists, given as (category, list file) pairs, into a gazetteer
+# file at gazetteer_file_str
+def compile_gazetteer(lists, gazetteer_file_str):
+    names_by_category = {}
+    for category, list_file_str in lists:
+        list_file = fileio.open_input(list_file_str)
+        names_by_category.setdefault(category, []).extend(line.strip() for line in list_file)
+        list_file.close()
+    gazetteer_file = open(gazetteer_file_str, "wb")
+    write_gazetteer(gazetteer_file, names_by_category)
+    gazetteer_file.close()
+
+# Read-only view of a gazetteer inside a buffer (an mmap, or bytes for one
+# compiled in memory), starting at position base
+class Gazetteer:
+    def __init__(self, buffer, base=0, file_str=None):
+        self._buffer = buffer
+        self.file_str = file_str
+        if buffer[base:base + len(MAGIC)] != MAGIC:
+            raise Exception("Not a gazetteer!")
+        view = memoryview(buffer)
+        tables = []
+        for i in range(2):
+            count, offsets_pos, blob_pos, values_pos = vocabfile.SECTION.unpack_from(
+                buffer, base + len(MAGIC) + i * vocabfile.SECTION.size)
+            tables.append(vocabfile.MappedStringTable(buffer, view, count, base + offsets_pos,
+                                                      base + blob_pos, base + values_pos if values_pos else 0))
+        self._tokens = tables[0]
+        self.categories = list(tables[1])
+        (num_nodes, num_edges, starts_pos, tokens_pos, targets_pos, categories_pos,
+         self.size) = _NODES.unpack_from(buffer, base + len(MAGIC) + 2 * vocabfile.SECTION.size)
+        self._view = view[base:base + self.size]
+        self._edge_starts = view[base + starts_pos:base + starts_pos + 4 * (num_nodes + 1)].cast("I")
+        self._edge_tokens = view[base + tokens_pos:base + tokens_pos + 4 * num_edges].cast("I")
+        self._edge_targets = view[base + targets_pos:base + targets_pos + 4 * num_edges].cast("I")
+        self._node_categories = view[base + categories_pos:base + categories_pos + 4 * num_nodes].cast("I")
+
+        # word -> token id (None for words in no name); bounded by the corpus vocabulary
+        self._token_ids = {}
+        location_bit = 0
+        if LOCATION_CATEGORY in self.categories:
+            location_bit = 1 << self.categories.index(LOCATION_CATEGORY)
+        self._location_bit = location_bit
+
+    # Gazetteers loaded from a file are pickled (for --workers) as their path
+    def __reduce__(self):
+        if self.file_str is not None:
+            return load_gazetteer, (self.file_str,)
+        return Gazetteer, (bytes(self._view),)
+
+    # The gazetteer as bytes, for embedding it in another file
+    def to_bytes(self):
+        return bytes(self._view)
+
+    def token_id(self, word):
+        token_id = self._token_ids.get(word, -1)
+        if token_id == -1:
+            token_id = self._token_ids[word] = self._tokens.get(word)
+        return token_id
+
+    # Returns the node reached from node by the token token_id, or 0 if there is none
+    def _child(self, node, token_id):
+        low = self._edge_starts[node]
+        high = self._edge_starts[node + 1]
+        k = bisect.bisect_left(self._edge_tokens, token_id, low, high)
+        if k < high and self._edge_tokens[k] == token_id:
+            return self._edge_targets[k]
+        return 0
+
+    # True if word is a one-word name of the LOC category, so that a Gazetteer
+    # can stand in for the set of locations
+    def __contains__(self, word):
+        token_id = self.token_id(word)
+        if token_id is None:
+            return False
+        return self._node_categories[self._child(0, token_id)] & self._location_bit != 0
+
+    # Returns the matches in a list of token ids (None for unknown words) as
+    # (start, end, category bits) triples, leftmost-longest and non-overlapping
+    def match_token_ids(self, token_ids):
+        node_categories = self._node_categories
+        spans = []
+        i = 0
+        while i < len(token_ids):
+            node = 0
+            end = 0
+            j = i
+            while j < len(token_ids) and token_ids[j] is not None:
+                node = self._child(node, token_ids[j])
+                if node == 0:
+                    break
+                j += 1
+                if node_categories[node]:
+                    end = j
+                    bits = node_categories[node]
+            if end:
+                spans.append((i, end, bits))
+                i = end
+            else:
+                i += 1
+        return spans
+
+    # Returns the names of the categories in category bits
+    def category_names(self, bits):
+        return [category for k, category in enumerate(self.categories) if bits & (1 << k)]
+
+    # Returns the BIO tags of a list of words, one list per word: e.g.
+    # ["B-LOC"] and ["I-LOC"] for "New York", [] for a word outside every name
+    def bio_tags(self, words):
+        tags = [[] for word in words]
+        for start, end, bits in self.match_token_ids([self.token_id(word) for word in words]):
+            names = self.category_names(bits)
+            tags[start] = ["B-" + category for category in names]
+            for i in range(start + 1, end):
+                tags[i] = ["I-" + category for category in names]
+        return tags
+
+# Memory-maps a gazetteer file written by compile_gazetteer
+def load_gazetteer(gazetteer_file_str):
+    gazetteer_file = open(gazetteer_file_str, "rb")
+    mapping = mmap.mmap(gazetteer_file.fileno(), 0, access=mmap.ACCESS_READ)
+    gazetteer_file.close() # the mapping stays valid after the file is closed
+    if mapping[:len(MAGIC)] != MAGIC:
+        raise Exception(gazetteer_file_str + " is not a gazetteer file!")
+    return Gazetteer(mapping, 0, gazetteer_file_str)
+
+# Returns locations as a Gazetteer: itself if it is one, or a set (or table) of
+# location names compiled in memory as the LOC category
+def as_gazetteer(locations):
+    if isinstance(locations, Gazetteer):
+        return locations
+    buffer = io.BytesIO()
+    write_gazetteer(buffer, {LOCATION_CATEGORY: locations})
+    return Gazetteer(buffer.getvalue())
@@ -0,0 +1,115 @@
+# Feature hashing: maps feature strings ("word-Israel", "prev-pos-NNP", ...)
+# straight to ids in a fixed range, instead of numbering them with a vocabulary
+# built from the training file. Memory no longer grows with the corpus, and the
+# vocabulary pass is skipped entirely.
+#
+# A feature's id is 1 + (CRC-32 of its UTF-8 bytes) mod 2^bits, so ids are
+# stable across runs, machines and Python versions. Every string has an id, so
+# a HashedFeatureIds answers "in" with True for everything and the UNK fallbacks
+# of the extractors never fire: unseen test words simply hash like any other.
+#
+# Different strings can share an id (a collision). To report how often that
+# happens without remembering every string, a bitmap with one bit per id records
+# which ids were used, and the number of distinct strings is estimated from how
+# full the bitmap is (linear counting: n ~= -m * ln(1 - used / m) for m ids).
+# Only the ids written to the vectors count as used, so the estimate is the
+# same for both engines: the per-token code in ner.py only looks up features
+# that fire, and marks them as it goes, while the numpy engine looks every
+# distinct word up once through an UnmarkedIds and marks the ids of its
+# output with mark_ids.
+
+import math
+import zlib
+
+MAX_BITS = 31
+
+# Stands in for the feature_ids dictionary in hashing mode
+class HashedFeatureIds:
+    def __init__(self, bits):
+        if bits < 1 or bits > MAX_BITS:
+            raise Exception("--hash-bits must be between 1 and " + str(MAX_BITS) + "!")
+        self.bits = bits
+        self.size = 1 << bits
+        self._mask = self.size - 1
+        self.used = bytearray((self.size + 7) // 8) # one bit per id
+        self.lookups = 0
+
+    def __contains__(self, key):
+        return True
+
+    def __getitem__(self, key):
+        bucket = zlib.crc32(key.encode("utf-8")) & self._mask
+        self.used[bucket >> 3] |= 1 << (bucket & 7)
+        self.lookups += 1
+        return bucket + 1
+
+    # Returns the id of key without marking it used
+    def hash_id(self, key):
+        self.lookups += 1
+        return (zlib.crc32(key.encode("utf-8")) & self._mask) + 1
+
+    # Marks ids (an iterable of ids, 0 for none) as used
+    def mark_ids(self, ids):
+        used = self.used
+        for feature_id in ids:
+            if feature_id:
+                bucket = feature_id - 1
+                used[bucket >> 3] |= 1 << (bucket & 7)
+
+    def get(self, key, default=None):
+        return self[key]
+
+    # Merges in the used-id bitmap of another HashedFeatureIds with the same bits
+    # (e.g. from a --workers process)
+    def merge_used(self, used, lookups):
+        merged = int.from_bytes(self.used, "little") | int.from_bytes(used, "little")
+        self.used = bytearray(merged.to_bytes(len(self.used), "little"))
+        self.lookups += lookups
+
+    # Returns the collision statistics as a dictionary. Once every id is taken
+    # ("saturated") the estimate breaks down, and the estimates are None
+    def collision_stats(self):
+        used_ids = bin(int.from_bytes(self.used, "little")).count("1")
+        stats = {
+            "hash_bits": self.bits,
+            "ids": self.size,
+            "used_ids": used_ids,
+            "lookups": self.lookups,
+            "saturated": used_ids == self.size,
+            "estimated_distinct_features": None,
+            "estimated_colliding_features": None,
+            "estimated_collision_rate": None,
+        }
+        if not stats["saturated"]:
+            distinct = -self.size * math.log(1.0 - used_ids / self.size)
+            collided = distinct - used_ids
+            stats["estimated_distinct_features"] = distinct
+            stats["estimated_colliding_features"] = collided
+            stats["estimated_collision_rate"] = collided / distinct if distinct else 0.0
+        return stats
+
+# The ids of a HashedFeatureIds for code that marks the ids it writes itself
+# (with mark_ids), instead of every id it looks up
+class UnmarkedIds:
+    def __init__(self, hashed_ids):
+        self.hashed_ids = hashed_ids
+
+    def __contains__(self, key):
+        return True
+
+    def __getitem__(self, key):
+        return self.hashed_ids.hash_id(key)
+
+    def get(self, key, default=None):
+        return self.hashed_ids.hash_id(key)
+
+# Returns a one-line summary of collision_stats
+def format_collision_stats(stats):
+    if stats["saturated"]:
+        return ("Hashed features: %d ids (%d bits), all used: the table is saturated, so the number "
+                "of collisions can't be estimated; use more --hash-bits" % (stats["ids"], stats["hash_bits"]))
+    return ("Hashed features: %d ids (%d bits), %d used, ~%.0f distinct features, "
+            "~%.0f colliding (%.2f%%)" % (stats["ids"], stats["hash_bits"], stats["used_ids"],
+                                          stats["estimated_distinct_features"],
+                                          stats["estimated_colliding_features"],
+                                          100.0 * stats["estimated_collision_rate"]))
@@ -0,0 +1,199 @@
+# Run instrumentation for ner.py (--stats and --profile). Off by default; while
+# it is off, the only cost is an "is active None" test per sentence.
+#
+# --stats FILE writes a JSON report of the run:
+#           stages      wall and CPU seconds per stage (get_locations,
+#                       create_feature_ids, vectorize <file>, ...), plus the time
+#                       spent inside the readable and vector writers
+#           inputs      per input file: sentences, tokens, and how often each UNK
+#                       feature fired (word-UNK, prev-word-UNK, pos-UNKPOS, ...)
+#                       with its rate per token
+#           vocabulary  number of feature ids, in total and per namespace
+#                       (word-, prev-word-, pos-, ...)
+#           outputs     bytes written per output file
+#
+# --profile FILE runs the vectorization loops under cProfile and dumps the
+# profile to FILE (read it with "python -m pstats FILE"). With --workers, every
+# worker process dumps its own profile to FILE.<pid>.
+
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import time
+
+# The UNK pseudo features whose firing is counted as out-of-vocabulary
+UNKNOWN_KEYS = ["word-UNK", "prev-word-UNK", "next-word-UNK", "pos-UNKPOS",
+                "prev-pos-UNKPOS", "next-pos-UNKPOS"]
+
+# Vocabulary namespaces, longest prefix first. Keys without one of these
+# prefixes (abbreviated, capitalized, is-location) are their own namespace
+NAMESPACES = ["prev-word-", "next-word-", "word-", "prev-pos-", "next-pos-", "pos-", "gaz-"]
+
+# Returns the namespace of a vocabulary key: "word" for "word-Israel", ...,
+# or the key itself if it has none
+def namespace(key):
+    for prefix in NAMESPACES:
+        if key.startswith(prefix):
+            return prefix[:-1]
+    return key
+
+# The Recorder of the current run, or None when instrumentation is off
+active = None
+
+# Collects the timings and counters of one process
+class Recorder:
+    def __init__(self, profile_file_str=None):
+        self.stages = {}
+        self.inputs = {}
+        self.vocabulary = None
+        self.outputs = {}
+        self.profile_file_str = profile_file_str
+        self.profiler = cProfile.Profile() if profile_file_str is not None else None
+        self._unknown_ids = {}
+        self._input = None
+
+    # Context manager that adds the wall and CPU time of its block to a stage
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = (time.perf_counter(), time.process_time())
+        try:
+            yield
+        finally:
+            self.add_time(name, started)
+
+    # Returns a start time for add_time
+    def clock(self):
+        return time.perf_counter(), time.process_time()
+
+    def add_time(self, name, started):
+        timing = self.stages.setdefault(name, {"wall_seconds": 0.0, "cpu_seconds": 0.0, "calls": 0})
+        timing["wall_seconds"] += time.perf_counter() - started[0]
+        timing["cpu_seconds"] += time.process_time() - started[1]
+        timing["calls"] += 1
+
+    # Starts counting the sentences of an input file against the vocabulary
+    # feature_ids. Hashed feature ids have no UNK features to count
+    def begin_input(self, input_file_str, feature_ids, hashed=False):
+        self._input = self.inputs.setdefault(input_file_str, _new_input_counts())
+        self._unknown_ids = {}
+        if not hashed:
+            for key in UNKNOWN_KEYS:
+                if key in feature_ids:
+                    self._unknown_ids[feature_ids[key]] = key
+
+    # Counts one token, given the ids of its features
+    def count_token(self, ids):
+        self._input["tokens"] += 1
+        for feature_id in ids:
+            key = self._unknown_ids.get(feature_id)
+            if key is not None:
+                self._input["unknown"][key] += 1
+
+    def count_sentence(self):
+        self._input["sentences"] += 1
+
+    # Counts a batch of sentences given as a feature matrix (numpy_engine)
+    def count_matrix(self, num_sentences, matrix):
+        self._input["sentences"] += num_sentences
+        self._input["tokens"] += len(matrix)
+        for feature_id, key in self._unknown_ids.items():
+            self._input["unknown"][key] += int((matrix == feature_id).sum())
+
+    # Returns and resets the input counters and stage timings, for a --workers
+    # process to hand back to the parent with each shard
+    def take_counts(self):
+        counts = {"inputs": self.inputs, "stages": self.stages}
+        self.inputs = {}
+        self.stages = {}
+        self._input = None
+        return counts
+
+    # Adds the counts of take_counts from another process. Worker CPU time is
+    # added to the stages of the same name (write_readable, write_vector)
+    def merge_counts(self, counts):
+        for input_file_str, input_counts in counts["inputs"].items():
+            total = self.inputs.setdefault(input_file_str, _new_input_counts())
+            total["sentences"] += input_counts["sentences"]
+            total["tokens"] += input_counts["tokens"]
+            for key, count in input_counts["unknown"].items():
+                total["unknown"][key] += count
+        for name, timing in counts["stages"].items():
+            total = self.stages.setdefault(name, {"wall_seconds": 0.0, "cpu_seconds": 0.0, "calls": 0})
+            for field in total:
+                total[field] += timing[field]
+
+    # Records the vocabulary size per namespace
+    def record_vocabulary(self, feature_ids):
+        namespaces = {}
+        for key in feature_ids:
+            key_namespace = namespace(key)
+            namespaces[key_namespace] = namespaces.get(key_namespace, 0) + 1
+        self.vocabulary = {"size": sum(namespaces.values()), "namespaces": namespaces}
+
+    # Records the size of an output file, or of all the files of a directory
+    def record_output(self, path):
+        if os.path.isdir(path):
+            size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        else:
+            size = os.path.getsize(path)
+        self.outputs[path] = size
+
+    # Context manager that runs its block under the profiler, if there is one
+    @contextlib.contextmanager
+    def profiling(self):
+        if self.profiler is None:
+            yield
+            return
+        self.profiler.enable()
+        try:
+            yield
+        finally:
+            self.profiler.disable()
+
+    def dump_profile(self):
+        if self.profiler is not None:
+            self.profiler.dump_stats(self.profile_file_str)
+
+    def report(self):
+        inputs = {}
+        for input_file_str, counts in self.inputs.items():
+            unknown = {}
+            for key, count in counts["unknown"].items():
+                unknown[key] = {"count": count, "rate": count / counts["tokens"] if counts["tokens"] else 0.0}
+            inputs[input_file_str] = {"sentences": counts["sentences"], "tokens": counts["tokens"],
+                                      "unknown": unknown}
+        return {"stages": self.stages, "inputs": inputs, "vocabulary": self.vocabulary,
+                "outputs": self.outputs}
+
+    # Writes the JSON report to stats_file_str ("-" for stdout)
+    def save(self, stats_file_str):
+        text = json.dumps(self.report(), indent=2) + "\n"
+        if stats_file_str == "-":
+            sys.stdout.write(text)
+            return
+        stats_file = open(stats_file_str, "w")
+        stats_file.write(text)
+        stats_file.close()
+
+def _new_input_counts():
+    return {"sentences": 0, "tokens": 0, "unknown": {key: 0 for key in UNKNOWN_KEYS}}
+
+# Turns instrumentation on for this process and returns the Recorder
+def start(profile_file_str=None):
+    global active
+    active = Recorder(profile_file_str)
+    return active
+
+# Returns a context manager timing a stage, or doing nothing when instrumentation is off
+def stage(name):
+    if active is None:
+        return contextlib.nullcontext()
+    return active.stage(name)
+
+# Returns a context manager profiling its block when --profile is on
+def profiling():
+    if active is None:
+        return contextlib.nullcontext()
+    return active.profiling()
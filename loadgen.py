@@ -0,0 +1,151 @@
+# Load generator for server.py. Sends the sentences of a corpus file (e.g.
+# test.txt) to a running tagging server from several concurrent client threads,
+# then prints a JSON report: client-side throughput and p50/p99 latency, token
+# accuracy against the corpus labels, and the server's own /stats.
+#
+# Example:
+#           $ ner.py serve vocab.bin model.npz --port 8000 &
+#           $ python loadgen.py test.txt --url http://127.0.0.1:8000 --concurrency 8
+#           $ python loadgen.py test.txt --unix /tmp/ner.sock
+
+import argparse
+import http.client
+import json
+import socket
+import threading
+import time
+import urllib.parse
+
+# Reads a corpus file into a list of sentences of (label, pos, word) tokens
+def _read_sentences(corpus_file_str):
+    sentences = []
+    sentence = []
+    corpus_file = open(corpus_file_str)
+    for line in corpus_file:
+        fields = line.split()
+        if fields:
+            sentence.append(fields[:3])
+        elif sentence:
+            sentences.append(sentence)
+            sentence = []
+    corpus_file.close()
+    return sentences
+
+# HTTPConnection over a Unix socket
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_str):
+        http.client.HTTPConnection.__init__(self, "localhost")
+        self.socket_str = socket_str
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_str)
+
+# Returns a function that opens a new connection to the server
+def _connection_factory(url, unix_socket_str):
+    if unix_socket_str is not None:
+        return lambda: UnixHTTPConnection(unix_socket_str)
+    parsed = urllib.parse.urlparse(url)
+    return lambda: http.client.HTTPConnection(parsed.hostname, parsed.port or 80)
+
+# Sends one request and returns the decoded JSON response
+def _request(connection, method, path, value=None):
+    body = None
+    headers = {}
+    if value is not None:
+        body = json.dumps(value).encode("utf-8")
+        headers["Content-Type"] = "application/json"
+    connection.request(method, path, body, headers)
+    response = connection.getresponse()
+    result = json.loads(response.read())
+    if response.status != 200:
+        raise Exception("Server error: " + result.get("error", str(response.status)))
+    return result
+
+# Returns the p-th percentile (0-100) of a list of numbers
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+# Runs the load test and returns the report
+def run(corpus_file_str, url="http://127.0.0.1:8000", unix_socket_str=None, concurrency=8,
+        num_requests=1000, sentences_per_request=1):
+    sentences = _read_sentences(corpus_file_str)
+    connect = _connection_factory(url, unix_socket_str)
+    next_request = [0]
+    lock = threading.Lock()
+    latencies = []
+    counts = {"tokens": 0, "correct": 0, "errors": 0}
+
+    def client():
+        connection = connect()
+        while True:
+            with lock:
+                request_number = next_request[0]
+                next_request[0] += 1
+            if request_number >= num_requests:
+                break
+            start = request_number * sentences_per_request
+            batch = [sentences[(start + k) % len(sentences)] for k in range(sentences_per_request)]
+            payload = {"sentences": [[[word, pos] for label, pos, word in sentence] for sentence in batch]}
+
+            started = time.perf_counter()
+            try:
+                labels = _request(connection, "POST", "/tag", payload)["labels"]
+            except Exception:
+                with lock:
+                    counts["errors"] += 1
+                connection.close()
+                connection = connect()
+                continue
+            latency = time.perf_counter() - started
+
+            correct = 0
+            tokens = 0
+            for sentence, predicted in zip(batch, labels):
+                tokens += len(sentence)
+                correct += sum(1 for token, label in zip(sentence, predicted) if token[0] == label)
+            with lock:
+                latencies.append(latency)
+                counts["tokens"] += tokens
+                counts["correct"] += correct
+        connection.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    connection = connect()
+    server_stats = _request(connection, "GET", "/stats")
+    connection.close()
+    return {
+        "requests": len(latencies),
+        "errors": counts["errors"],
+        "tokens": counts["tokens"],
+        "seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed,
+        "tokens_per_second": counts["tokens"] / elapsed,
+        "latency_ms_p50": _percentile(latencies, 50) * 1000 if latencies else None,
+        "latency_ms_p99": _percentile(latencies, 99) * 1000 if latencies else None,
+        "token_accuracy": counts["correct"] / counts["tokens"] if counts["tokens"] else None,
+        "server": server_stats,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="load-test a running ner.py serve")
+    parser.add_argument("corpus_file", help="labeled corpus to send, e.g. test.txt")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--unix", dest="unix_socket", default=None, metavar="PATH")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--sentences-per-request", type=int, default=1)
+    args = parser.parse_args()
+    report = run(args.corpus_file, args.url, args.unix_socket, args.concurrency, args.requests,
+                 args.sentences_per_request)
+    print(json.dumps(report, indent=2))
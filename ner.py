@@ -7,533 +7,1203 @@
 #       part-of-speech tag (POS), part-of-speech tag context (POSCON),
 #       word context (WORDCON), capitalized word (CAP), abbreviated word (ABBR),
 #       and location (LOCATION).  See assignment doc for more details...
+#       Each feature type is an extractor plugin registered in extractors.py.
+#       Input files are read in blocks into columnar sentences (corpus.py).
+#       GAZ (not part of the assignment) tags multi-word names such as "New York"
+#       B-LOC/I-LOC, using the locations file or a compiled gazetteer given in
+#       its place, which can also hold people, organizations, ...:
+#           $ ner.py compile-gazetteer names.gaz LOC=locs.txt PER=people.txt
+#           $ ner.py train.txt test.txt names.gaz WORD POS LOCATION GAZ
+#       (see gazetteer.py). Its readable line only appears when it is on.
 #
 # Example:
 #           $ ner.py train.txt test.txt locs.txt WORD WORDPOS CAP POS LOCATION
 #
+#       Add --single-pass to read the training file only once: feature ids are
+#       assigned while the training vectors are written. The pseudo features
+#       (word-UNK, prev-word-PHI, abbreviated, ...) then get the reserved ids 1-13,
+#       so the ids differ from the default two-pass numbering.
+#
+#       To vectorize test sets or new documents without re-reading the training
+#       file, save the vocabulary once and reuse it (see vocabfile.py):
+#           $ ner.py build-vocab train.txt locs.txt vocab.bin WORD WORDCON POS ...
+#           $ ner.py vectorize vocab.bin test.txt other.txt
+#
+#       Both the pipeline and vectorize take --workers N to split the input files
+#       into shards of whole sentences and vectorize them in N processes. The
+#       output files are identical to a run with one worker.
+#
+#       --min-count [NAMESPACE=]N and --top-k [NAMESPACE=]K drop rare features
+#       from the vocabulary (per namespace: word, prev-word, pos, ...; dropped
+#       features become UNK), and --memory SIZE caps the memory used to count
+#       them: the counts are spilled to disk and merged (see vocabbuilder.py).
+#
+#       --hash-bits N skips the vocabulary: feature strings are hashed into the
+#       ids 1..2^N (see hashing.py), and the collision rate is printed at the end.
+#
+#       To sweep feature-type combinations, "ner.py ablate train.txt test.txt
+#       locs.txt" extracts every feature type once and writes the vectors of all
+#       128 subsets (or of each --subset WORD,POS,...) as <file>.<subset>.vector,
+#       identical to separate runs (see ablation.py; requires numpy).
+#
+#       Input files ending in .gz, .bz2 or .xz are decompressed on the fly, and
+#       their outputs are compressed the same way (train.txt.gz gives
+#       train.txt.vector.gz and train.txt.readable.gz, but no index; see fileio.py). An input
+#       file of "-" is read from stdin and its vectors are written to stdout:
+#           $ zcat new.txt.gz | ner.py vectorize vocab.bin - > new.vector
+#       A training file can only come from stdin with --single-pass or
+#       --hash-bits, which read it once.
+#
+#       --cache DIR keeps the vocabulary and the output files of every run in a
+#       content-addressed cache (see cache.py): when the input files, feature
+#       types and options are unchanged, the outputs are restored from DIR
+#       instead of being recomputed. --cache-size caps it (LRU eviction).
+#
+#       --stats FILE writes a JSON report of the run (time per stage, sentence,
+#       token and OOV counts, vocabulary and output sizes), and --profile FILE
+#       dumps a cProfile profile of the vectorization (see instrument.py).
+#
+#       The .readable files are only written with --readable. Otherwise each input
+#       file gets a sentence offset index (train.txt.index; see sentence_index.py),
+#       the vocabulary is saved next to it as train.txt.vocab, and "ner.py show"
+#       prints the readable features of any sentence or token range on demand,
+#       seeking straight to it:
+#           $ ner.py show train.txt.vocab train.txt 1234
+#           $ ner.py show train.txt.vocab test.txt 5000:5010 --tokens
+#       It renders the training file as in train.txt.readable and any other file
+#       as in test.txt.readable (--set-type overrides this; with a --hash-bits
+#       run, pass the same --hash-bits). A vocabulary from build-vocab works too.
+#
+#       --engine numpy switches to the batched NumPy feature extraction in
+#       numpy_engine.py, which also writes identical files (requires numpy).
+#       --output-format csr (or both) writes the vectors as binary CSR arrays in
+#       train.txt.csr/ and test.txt.csr/ instead of (or next to) the .vector files.
+#
+#       Instead of liblinear, the built-in classifier (classifier.py) can train on
+#       the vectors and write predictions.txt:
+#           $ ner.py train train.txt.vector model.npz
+#           $ ner.py predict model.npz test.txt.vector predictions.txt
+#       predict --decode viterbi --sentences test.txt decodes every sentence to
+#       its best valid BIO label sequence and --spans writes its entity spans
+#       (see decoding.py).
+#
+#       "ner.py evaluate predictions.txt test.txt" compares predictions (from
+#       liblinear or predict) with the gold labels of test.txt or test.txt.vector
+#       in constant memory: token accuracy, CoNLL entity precision/recall/F1 per
+#       type, and the confusion matrix (see evaluation.py; --workers N shards it).
+#
+#       For production tagging, "ner.py serve vocab.bin model.npz" keeps both
+#       loaded and tags sentences sent over HTTP (see server.py and loadgen.py).
+#
+#       The command line is a thin layer over api.py, which other Python programs
+#       can import to vectorize sentences themselves, lazily and without
+#       files. "python -m ner ..." is the same as "ner.py ...", and so is the
+#       "ner" command that "pip install ." installs (see pyproject.toml).
+#
 # Output:
 #           train.txt.vector: can be supplied to liblinear program to train a classifier
 #           test.txt.vector: determine the accuracy of your classifier by running it on this file
 #
-#           train.txt.readable and test.txt.readable:
+#           train.txt.index and test.txt.index: sentence offsets for "ner.py show"
+#           train.txt.vocab: the vocabulary, for "ner.py show"
+#
+#           train.txt.readable and test.txt.readable (with --readable):
 #                           human-readable files showing how this program applied
 #                           features to the words in the training and test input files
 #
 # University Of Utah Natural Language Processing, Assignment 3
 # Written by Jackson Murphy. Last updated October 25, 2017
 
-import re
+import argparse
+import io
+import os
 import sys
 
-# Returns a set of all the locations provided in the locations file
-def _get_locations(locations_file_str):
-    locations = set()
-    locations_file = open(locations_file_str)
-    for location in locations_file:
-        locations.add(location.strip())
-    locations_file.close()
-    return locations
-
-# Returns a set of all the feature types provided in the command line arguments
-# "WORD" is a mandatory feature type. The rest are optional: WORDCON, POS,
-# POSCON, CAP, ABBR, and LOCATION
-def _get_feature_types(argv):
-    feature_types = set()
-    for i in range(4, len(argv)):
-        feature_types.add(argv[i])
-    return feature_types
+import api
+import extractors
+import fileio
+import gazetteer
+import hashing
+import instrument
+import sentence_index
+import vocabfile
+
+# Every feature type that can be given on the command line. "WORD" is mandatory
+# (it is always on); the rest are optional. See extractors.py
+FEATURE_TYPES = list(extractors.FEATURE_EXTRACTORS)
 
 # Returns a dictionary of all possible feature ids
-def _create_feature_ids(training_file_str, feature_types, locations):
-    feature_ids = {}
-    current_id = [1] # initialize; array instead of int to get pass-by-reference
-    training_file = open(training_file_str)
-    sentence = [] # initialize the first sentence
-    line = training_file.readline()
-
-    while line:
-        # Build up a sentence like so: [[B-LOC,NNP,Israel], [O,NN,television], ...]
-        if line.strip():
-            sentence.append(line.split())
-        else:
-            if len(sentence) != 0: # Nec. bc there can be consecutive blank lines
-                _add_sentence(sentence, feature_ids, current_id, feature_types, locations)
-                sentence.clear() # empty the list to accommodate next sentence
-        line = training_file.readline()
-
-    # Add feature entries for abbreviation, capitalization, and location
-    _add_abbreviation(feature_types, feature_ids, current_id)
-    _add_capitalization(feature_types, feature_ids, current_id)
-    _add_location(feature_types, feature_ids, current_id)
-
-    # Add entries for the special cases PHI, UNK, etc.
-    _add_pseudos(feature_ids, current_id)
+def _create_feature_ids(training_file_str, features):
+    training_file = fileio.open_input(training_file_str)
+    feature_ids = api.build_feature_ids(api.read_sentences(training_file), features)
     training_file.close()
     return feature_ids
 
-# Adds all possible feature_types from the sentence to the feature_id dictionary
-def _add_sentence(sentence, feature_ids, current_id, feature_types, locations):
-    for i in range(len(sentence)):
-        _add_word(sentence, i, feature_types, feature_ids, current_id)
-        _add_word_context(sentence, i, feature_types, feature_ids, current_id)
-        _add_pos(sentence, i, feature_types, feature_ids, current_id)
-        _add_pos_context(sentence, i, feature_types, feature_ids, current_id)
-
-# Adds a word to the feature_id dictionary, if not already included
-def _add_word(sentence, i, feature_types, feature_ids, current_id):
-    word = sentence[i][2]
-    if ("word-" + word) not in feature_ids:
-        feature_ids["word-" + word] = current_id[0]
-        current_id[0] += 1
-
-# Adds the words before and after sentence[i][2] to the feature id dictionary,
-# as long as WORDCON was provided in the command line arguments
-def _add_word_context(sentence, i, feature_types, feature_ids, current_id):
-    if "WORDCON" not in feature_types:
-        return
-
-    add_prev_word = True
-    add_next_word = True
-    if i == 0 and len(sentence) > 1:
-        # prev-word-PHI is added in _add_pseudos
-        add_prev_word = False
-    elif i == (len(sentence)-1) and len(sentence) > 1:
-        # next-word-PHI is added in _add_pseudos
-        add_next_word = False
-
-    if add_prev_word:
-        prev_word = sentence[i-1][2]
-        if ("prev-word-" + prev_word) not in feature_ids:
-            feature_ids["prev-word-" + prev_word] = current_id[0]
-            current_id[0] += 1
-
-    if add_next_word:
-        next_word = sentence[i+1][2]
-        if ("next-word-" + next_word) not in feature_ids:
-            feature_ids["next-word-" + next_word] = current_id[0]
-            current_id[0] += 1
-
-# Adds a part of speech tag to the feature_id dictionary, if not already included
-def _add_pos(sentence, i, feature_types, feature_ids, current_id):
-    if "POS" not in feature_types:
-        return
-    pos = sentence[i][1]
-    if ("pos-" + pos) not in feature_ids:
-        feature_ids["pos-" + pos] = current_id[0]
-        current_id[0] += 1
-
-# Adds the pos tags before and after sentence[i][1] to the feature id dictionary,
-# as long as POSCON was provided in the command line arguments
-def _add_pos_context(sentence, i, feature_types, feature_ids, current_id):
-    if "POSCON" not in feature_types:
-        return
-
-    add_prev_pos = True
-    add_next_pos = True
-    if i == 0 and len(sentence) > 1:
-        # prev-pos-PHI is added in _add_pseudos
-        add_prev_pos = False
-    elif i == (len(sentence)-1) and len(sentence) > 1:
-        # next-pos-PHI is added in _add_pseudos
-        add_next_pos = False
-
-    if add_prev_pos:
-        prev_pos = sentence[i-1][1]
-        if ("prev-pos-" + prev_pos) not in feature_ids:
-            feature_ids["prev-pos-" + prev_pos] = current_id[0]
-            current_id[0] += 1
-
-    if add_next_pos:
-        next_pos = sentence[i+1][1]
-        if ("next-pos-" + next_pos) not in feature_ids:
-            feature_ids["next-pos-" + next_pos] = current_id[0]
-            current_id[0] += 1
-
-# Adds a feature  to feature_ids indicating whether a word is abbreviated or not
-def _add_abbreviation(feature_types, feature_ids, current_id):
-    if "ABBR" not in feature_types:
-        return
-    feature_ids["abbreviated"] = current_id[0]; current_id[0] += 1
-
-# Adds a feature to feature_ids indicating whether a word is capitalized or not
-def _add_capitalization(feature_types, feature_ids, current_id):
-    if "CAP" not in feature_types:
-        return
-    feature_ids["capitalized"] = current_id[0]; current_id[0] += 1
-
-# Adds a feature to feature_ids indicating whether a word is a location or not
-def _add_location(feature_types, feature_ids, current_id):
-    if "LOCATION" not in feature_types:
-        return
-    feature_ids["is-location"] = current_id[0]; current_id[0] += 1
-
-# Add entries into feature_ids dictionary for the special cases PHI, UNK, etc.
-def _add_pseudos(feature_ids, current_id):
-    feature_ids["word-UNK"] = current_id[0]; current_id[0] += 1
+# Pseudo features used by the single-pass mode, in the order of their reserved ids.
+# They are all reserved no matter which feature types are used, so "word-UNK" is
+# always id 1, "is-location" is always id 13, and so on
+RESERVED_PSEUDOS = ["word-UNK", "prev-word-UNK", "next-word-UNK", "prev-word-PHI",
+                    "next-word-OMEGA", "pos-UNKPOS", "prev-pos-UNKPOS", "next-pos-UNKPOS",
+                    "prev-pos-PHIPOS", "next-pos-OMEGAPOS", "abbreviated", "capitalized",
+                    "is-location"]
+
+# Gives every pseudo feature its reserved low id, before any word or pos is added
+def _add_reserved_pseudos(feature_ids, current_id):
+    for pseudo in RESERVED_PSEUDOS:
+        feature_ids[pseudo] = current_id[0]; current_id[0] += 1
+
+# Single-pass alternative to _create_feature_ids + _generate_files_from_training_set.
+# Reads the training file once, adding each sentence's features to feature_ids and
+# then immediately writing the sentence to the readable and vector files. This works
+# because the pseudo features have reserved ids from the start, and every other
+# feature a training sentence uses has just been added by features.add_sentence.
+# Returns the finished feature_ids dictionary, ready for the test set.
+# outputs must not include "csr"
+def _create_feature_ids_and_training_files(training_file_str, features, outputs):
+    feature_ids = {}
+    current_id = [1] # initialize; array instead of int to get pass-by-reference
+    _add_reserved_pseudos(feature_ids, current_id)
 
-    if "WORDCON" in feature_types:
-        feature_ids["prev-word-UNK"] = current_id[0]; current_id[0] += 1
-        feature_ids["next-word-UNK"] = current_id[0]; current_id[0] += 1
-        feature_ids["prev-word-PHI"] = current_id[0]; current_id[0] += 1
-        feature_ids["next-word-OMEGA"] = current_id[0]; current_id[0] += 1
+    # The two output files we are creating and will write to
+    readable_file, vector_file, csr_writer = _open_output_files(training_file_str, outputs)
 
-    if "POS" in feature_types:
-        feature_ids["pos-UNKPOS"] = current_id[0]; current_id[0] += 1
+    if instrument.active is not None:
+        instrument.active.begin_input(training_file_str, feature_ids)
 
-    if "POSCON" in feature_types:
-        feature_ids["prev-pos-UNKPOS"] = current_id[0]; current_id[0] += 1
-        feature_ids["next-pos-UNKPOS"] = current_id[0]; current_id[0] += 1
-        feature_ids["prev-pos-PHIPOS"] = current_id[0]; current_id[0] += 1
-        feature_ids["next-pos-OMEGAPOS"] = current_id[0]; current_id[0] += 1
+    training_file = fileio.open_input(training_file_str)
+    for sentence in api.read_sentences(training_file):
+        features.add_sentence(sentence, feature_ids, current_id)
+        _write_sentence_to_readable(sentence, features, feature_ids, readable_file, "train")
+        _write_sentence_to_vector(sentence, features, feature_ids, vector_file)
+    training_file.close()
+    _close_output_files(readable_file, vector_file, csr_writer)
+    _write_index(training_file_str, outputs)
+    _record_outputs(training_file_str, outputs)
+    return feature_ids
 
 # Creates 2 files containing the features associated with each word in the test file.
 # 1 file is in human-readable format for a visual check that the program is working properly.
 # The other file is in a special format specifically for the machine learning tool "liblinear"
 # This file can be fed into the liblinear tool to test a classification model
-def _generate_files_from_test_set(test_file_str, feature_ids, locations, feature_types):
+def _generate_files_from_test_set(test_file_str, feature_ids, features, outputs):
     # The two output files we are creating and will write to
-    readable_file = open(test_file_str + ".readable", "w+")
-    vector_file = open(test_file_str + ".vector", "w+")
-
-    test_file = open(test_file_str)
-    sentence = [] # initialize the first sentence
-    line = test_file.readline()
-
-    while line:
-        # Build up a sentence like so: [[B-LOC,NNP,Israel], [O,NN,television], ...]
-        if line.strip(): # line is not empty
-            sentence.append(line.split())
-        else:
-            if len(sentence) != 0: # Nec. bc there can be consecutive blank lines
-                _write_sentence_to_readable(sentence, feature_types, locations, feature_ids, readable_file, "test")
-                _write_sentence_to_vector(sentence, feature_types, locations, feature_ids, vector_file)
-                sentence.clear() # empty the list to accommodate next sentence
-        line = test_file.readline()
+    readable_file, vector_file, csr_writer = _open_output_files(test_file_str, outputs)
 
+    test_file = fileio.open_input(test_file_str)
+    for sentence in api.read_sentences(test_file):
+        _write_sentence_to_readable(sentence, features, feature_ids, readable_file, "test")
+        _write_sentence_to_vector(sentence, features, feature_ids, vector_file)
     test_file.close()
-    readable_file.close()
-    vector_file.close()
+    _close_output_files(readable_file, vector_file, csr_writer)
 
 # Creates 2 files containing the features associated with each word in the training file.
 # 1 file is in human-readable format for a visual check that the program is working properly.
 # The other file is in a special format specifically for the machine learning tool "liblinear"
 # This file can be fed into the liblinear tool to train a classification model
-def _generate_files_from_training_set(training_file_str, feature_ids, locations, feature_types):
+def _generate_files_from_training_set(training_file_str, feature_ids, features, outputs):
     # The two output files we are creating and will write to
-    readable_file = open(training_file_str + ".readable", "w+")
-    vector_file = open(training_file_str + ".vector", "w+")
-
-    training_file = open(training_file_str)
-    sentence = [] # initialize the first sentence
-    line = training_file.readline()
-
-    while line:
-        # Build up a sentence like so: [[B-LOC,NNP,Israel], [O,NN,television], ...]
-        if line.strip(): # line is not empty
-            sentence.append(line.split())
-        else:
-            if len(sentence) != 0: # Nec. bc there can be consecutive blank lines
-                _write_sentence_to_readable(sentence, feature_types, locations, feature_ids, readable_file, "train")
-                _write_sentence_to_vector(sentence, feature_types, locations, feature_ids, vector_file)
-                sentence.clear() # empty the list to accommodate next sentence
-        line = training_file.readline()
+    readable_file, vector_file, csr_writer = _open_output_files(training_file_str, outputs)
 
+    training_file = fileio.open_input(training_file_str)
+    for sentence in api.read_sentences(training_file):
+        _write_sentence_to_readable(sentence, features, feature_ids, readable_file, "train")
+        _write_sentence_to_vector(sentence, features, feature_ids, vector_file)
     training_file.close()
-    readable_file.close()
-    vector_file.close()
-
-
-# Writes to a new readable file the feature_types of each word in the sentence that are
-# contained in the feature types. Specify if you're using the function on a
+    _close_output_files(readable_file, vector_file, csr_writer)
+
+
+# Returns a numpy_engine.ArrayVectorizer. numpy is only imported when the
+# numpy engine is actually used
+def _numpy_vectorizer(feature_ids, features, set_type):
+    import numpy_engine
+    return numpy_engine.ArrayVectorizer(feature_ids, features.feature_types, features.locations, set_type)
+
+# Returns the outputs to write for each input file, from the command line:
+# "vector" (the .vector text file) and/or "csr" (a <input>.csr directory of .npy
+# arrays, see csr.py) depending on --output-format, and the full "readable"
+# file with --readable or else just the sentence "index" (see sentence_index.py)
+def _selected_outputs(args):
+    outputs = {"liblinear": ["vector"], "csr": ["csr"], "both": ["vector", "csr"]}[args.output_format]
+    if args.readable:
+        return ["readable"] + outputs
+    return ["index"] + outputs
+
+# Returns the paths of the given outputs of one input file as a {"readable": ...,
+# "index": ..., "vector": ..., "csr": ...} dictionary. Outputs keep the
+# compression of the input file (see fileio.py), but compressed files have no
+# index, since they can't be read at an offset. For input from stdin ("-"), the
+# vectors go to stdout and there is no readable file or index
+def _output_paths(input_file_str, outputs):
+    if input_file_str == "-":
+        if "csr" in outputs:
+            raise Exception("CSR output needs an input file, not stdin!")
+        return {"vector": "-"}
+    paths = {}
+    if "readable" in outputs:
+        paths["readable"] = fileio.output_path(input_file_str, ".readable")
+    if "index" in outputs and fileio.is_seekable(input_file_str):
+        paths["index"] = fileio.output_path(input_file_str, ".index", compressed=False)
+    if "vector" in outputs:
+        paths["vector"] = fileio.output_path(input_file_str, ".vector")
+    if "csr" in outputs:
+        paths["csr"] = fileio.output_path(input_file_str, ".csr", compressed=False)
+    return paths
+
+# Opens the output files of one input file for the given outputs. Returns
+# (readable file, vector file, csr.CsrWriter), with None for the outputs that
+# aren't written. The index is written separately, by _write_index
+def _open_output_files(input_file_str, outputs):
+    paths = _output_paths(input_file_str, outputs)
+    readable_file = None
+    vector_file = None
+    csr_writer = None
+    if "readable" in paths:
+        readable_file = fileio.open_output(paths["readable"])
+    if "vector" in paths:
+        vector_file = fileio.open_output(paths["vector"])
+    if "csr" in paths:
+        import csr
+        csr_writer = csr.CsrWriter(paths["csr"])
+    return readable_file, vector_file, csr_writer
+
+def _close_output_files(readable_file, vector_file, csr_writer):
+    if readable_file is not None:
+        readable_file.close()
+    if vector_file is not None:
+        vector_file.close()
+    if csr_writer is not None:
+        csr_writer.close()
+
+# Writes the sentence index of one input file, if it is one of the outputs
+def _write_index(input_file_str, outputs):
+    paths = _output_paths(input_file_str, outputs)
+    if "index" in paths:
+        with instrument.stage("index " + input_file_str):
+            sentence_index.build_index(input_file_str, paths["index"])
+
+# Records the sizes of the output files of one input file for --stats
+def _record_outputs(input_file_str, outputs):
+    recorder = instrument.active
+    if recorder is None:
+        return
+    for path in _output_paths(input_file_str, outputs).values():
+        if path != "-":
+            recorder.record_output(path)
+
+# Writes the output files of one input file with the given engine: "python"
+# runs the per-token code above, "numpy" the batched array code in
+# numpy_engine.py. Both produce the same output. CSR output always goes through
+# the numpy engine, which builds the arrays it needs
+def _generate_files(input_file_str, set_type, feature_ids, features, engine,
+                    outputs=("index", "vector")):
+    if instrument.active is not None:
+        instrument.active.begin_input(input_file_str, feature_ids,
+                                      isinstance(feature_ids, hashing.HashedFeatureIds))
+    with instrument.stage("vectorize " + input_file_str), instrument.profiling():
+        if engine == "numpy" or "csr" in outputs:
+            readable_file, vector_file, csr_writer = _open_output_files(input_file_str, outputs)
+            input_file = fileio.open_input(input_file_str)
+            vectorizer = _numpy_vectorizer(feature_ids, features, set_type)
+            vectorizer.write_files(input_file, readable_file, vector_file, csr_writer)
+            input_file.close()
+            _close_output_files(readable_file, vector_file, csr_writer)
+        elif set_type == "train":
+            _generate_files_from_training_set(input_file_str, feature_ids, features, outputs)
+        else:
+            _generate_files_from_test_set(input_file_str, feature_ids, features, outputs)
+    _write_index(input_file_str, outputs)
+    _record_outputs(input_file_str, outputs)
+
+# Returns the byte offsets that split the input file into (at most) num_shards
+# shards: [0, b1, b2, ..., file size]. Every boundary is placed right after a
+# blank line, so no sentence is split between two shards
+def _find_shard_boundaries(input_file_str, num_shards):
+    size = os.path.getsize(input_file_str)
+    boundaries = [0]
+    input_file = open(input_file_str, "rb")
+    for k in range(1, num_shards):
+        input_file.seek(max(size * k // num_shards, boundaries[-1]))
+        input_file.readline() # skip the rest of the line we landed in
+        line = input_file.readline()
+        while line and line.decode("utf-8", "replace").strip():
+            line = input_file.readline()
+        if not line: # no blank line left before the end of the file
+            break
+        if input_file.tell() > boundaries[-1]:
+            boundaries.append(input_file.tell())
+    input_file.close()
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return boundaries
+
+# The vocabulary of a --workers process, memory-mapped once per process so that
+# all the workers share the same read-only pages
+_shard_vocabulary = None
+
+# vocab_source is the vocabulary file, or ("hash", bits, feature_types, locations)
+# for --hash-bits, where there is no vocabulary to share. instrumented turns on
+# instrumentation in the worker, with profile_file_str for --profile
+def _init_shard_worker(vocab_source, instrumented=False, profile_file_str=None):
+    global _shard_vocabulary
+    if instrumented:
+        if profile_file_str is not None:
+            profile_file_str += "." + str(os.getpid())
+        instrument.start(profile_file_str)
+    if isinstance(vocab_source, tuple):
+        hash_mode, bits, feature_types, locations = vocab_source
+        feature_ids = hashing.HashedFeatureIds(bits)
+    else:
+        feature_ids, feature_types, locations = vocabfile.load_vocabulary(vocab_source)
+    _shard_vocabulary = (feature_ids, extractors.compile_features(feature_types, locations))
+
+# Returns what a shard hands back about its hashed ids, so the parent can report
+# collisions: (used-id bitmap, lookups), or None without --hash-bits. The
+# counts are reset, so each shard only reports its own
+def _shard_hash_usage(feature_ids):
+    if not isinstance(feature_ids, hashing.HashedFeatureIds):
+        return None
+    usage = (bytes(feature_ids.used), feature_ids.lookups)
+    feature_ids.used = bytearray(len(feature_ids.used))
+    feature_ids.lookups = 0
+    return usage
+
+# Worker for _generate_files_in_parallel: vectorizes the sentences in the byte
+# range [start, end) of the input file, exactly like the serial loops above.
+# Returns the shard's readable and vector output as two strings (the vector
+# string is None for csr-only output), its rows as csr.CsrBatches, or None
+# unless CSR output was asked for, its _shard_hash_usage, and its instrument
+# counts (None when instrumentation is off)
+def _write_shard(shard):
+    input_file_str = shard[0]
+    feature_ids = _shard_vocabulary[0]
+    recorder = instrument.active
+    if recorder is None:
+        return _vectorize_shard(shard) + (_shard_hash_usage(feature_ids), None)
+    recorder.begin_input(input_file_str, feature_ids, isinstance(feature_ids, hashing.HashedFeatureIds))
+    with recorder.profiling():
+        readable_text, vector_text, csr_batches = _vectorize_shard(shard)
+    recorder.dump_profile()
+    return readable_text, vector_text, csr_batches, _shard_hash_usage(feature_ids), recorder.take_counts()
+
+# Does the work of _write_shard; returns the first three of its results
+def _vectorize_shard(shard):
+    input_file_str, start, end, set_type, engine, outputs = shard
+    feature_ids, features = _shard_vocabulary
+    input_file = open(input_file_str, "rb")
+    input_file.seek(start)
+    shard_file = io.TextIOWrapper(io.BytesIO(input_file.read(end - start)))
+    input_file.close()
+
+    readable_file = io.StringIO() if "readable" in outputs else None
+    vector_file = io.StringIO()
+    if engine == "numpy" or "csr" in outputs:
+        import csr
+        csr_batches = None
+        if "csr" in outputs:
+            csr_batches = csr.CsrBatches()
+        if "vector" not in outputs:
+            vector_file = None
+        vectorizer = _numpy_vectorizer(feature_ids, features, set_type)
+        vectorizer.write_files(shard_file, readable_file, vector_file, csr_batches)
+        return _shard_text(readable_file), _shard_text(vector_file), csr_batches
+
+    for sentence in api.read_sentences(shard_file):
+        _write_sentence_to_readable(sentence, features, feature_ids, readable_file, set_type)
+        _write_sentence_to_vector(sentence, features, feature_ids, vector_file)
+
+    return _shard_text(readable_file), vector_file.getvalue(), None
+
+def _shard_text(shard_file):
+    return shard_file.getvalue() if shard_file is not None else None
+
+# Parallel version of _generate_files_from_training_set/_generate_files_from_test_set.
+# jobs is a list of (input file, set_type) pairs. Each input file is split into
+# shards at sentence boundaries, the shards are vectorized by a pool of worker
+# processes that memory-map the vocabulary in vocab_source (see _init_shard_worker),
+# and the results are written back in shard order, so the output is identical to
+# a serial run. hashed_ids collects the shards' hash usage with --hash-bits
+def _generate_files_in_parallel(jobs, vocab_source, workers, engine, outputs, hashed_ids=None):
+    for input_file_str, set_type in jobs:
+        if not fileio.is_seekable(input_file_str):
+            raise Exception("--workers needs uncompressed input files, not " + input_file_str + "!")
+    recorder = instrument.active
+    instrumented = recorder is not None
+    profile_file_str = recorder.profile_file_str if instrumented else None
+    import multiprocessing
+    pool = multiprocessing.Pool(workers, _init_shard_worker, (vocab_source, instrumented, profile_file_str))
+    for input_file_str, set_type in jobs:
+        # A few shards per worker keeps the workers busy when shards are uneven
+        boundaries = _find_shard_boundaries(input_file_str, workers * 4)
+        shards = []
+        for k in range(len(boundaries) - 1):
+            shards.append((input_file_str, boundaries[k], boundaries[k+1], set_type, engine, outputs))
+
+        with instrument.stage("vectorize " + input_file_str), instrument.profiling():
+            readable_file, vector_file, csr_writer = _open_output_files(input_file_str, outputs)
+            for readable_text, vector_text, csr_batches, hash_usage, counts in pool.imap(_write_shard, shards):
+                if readable_file is not None:
+                    readable_file.write(readable_text)
+                if hash_usage is not None:
+                    hashed_ids.merge_used(*hash_usage)
+                if counts is not None:
+                    recorder.merge_counts(counts)
+                if vector_file is not None:
+                    vector_file.write(vector_text)
+                if csr_writer is not None:
+                    csr_batches.write_to(csr_writer)
+            _close_output_files(readable_file, vector_file, csr_writer)
+        _write_index(input_file_str, outputs)
+        _record_outputs(input_file_str, outputs)
+    pool.close()
+    pool.join()
+
+# Like _generate_files_in_parallel, but for a feature_ids dictionary that only
+# exists in memory: it is saved to a temporary vocabulary file for the workers.
+# Hashed feature ids need no file; every worker hashes on its own
+def _generate_files_in_parallel_from_ids(jobs, feature_ids, features, workers,
+                                         engine, outputs):
+    if isinstance(feature_ids, hashing.HashedFeatureIds):
+        vocab_source = ("hash", feature_ids.bits, features.feature_types, features.locations)
+        _generate_files_in_parallel(jobs, vocab_source, workers, engine, outputs, feature_ids)
+        return
+    import tempfile
+    vocab_fd, vocab_file_str = tempfile.mkstemp(suffix=".vocab")
+    os.close(vocab_fd)
+    try:
+        vocabfile.save_vocabulary(vocab_file_str, feature_ids, features.feature_types, features.locations)
+        _generate_files_in_parallel(jobs, vocab_file_str, workers, engine, outputs)
+    finally:
+        os.remove(vocab_file_str)
+
+
+# Writes to a new readable file the features of each word in the sentence, with
+# "n/a" for the feature types that are off. Specify if you're using the function on a
 # training file or test file bypassing set_type = "train" or "test"
-def _write_sentence_to_readable(sentence, feature_types, locations, feature_ids, readable_file, set_type):
-    # Write info to readable file for each word in the sentence
+def _write_sentence_to_readable(sentence, features, feature_ids, readable_file, set_type):
+    if readable_file is None: # no --readable, or reading from stdin
+        return
+    recorder = instrument.active
+    if recorder is not None:
+        started = recorder.clock()
+    # Write info to readable file for each word in the sentence, in one write
+    lines = []
     for i in range(len(sentence)):
-        readable_file.write("WORD: " +  _get_word(sentence,i, feature_types, feature_ids, set_type) +  "\n")
-        readable_file.write("WORDCON: " +  _get_word_context(sentence, i, feature_types, feature_ids, set_type) + "\n")
-        readable_file.write("POS: " + _get_pos(sentence, i, feature_types, feature_ids, set_type) + "\n")
-        readable_file.write("POSCON: " + _get_pos_context(sentence, i, feature_types, feature_ids, set_type) + "\n")
-        readable_file.write("ABBR: " + _get_abbreviation(sentence, i, feature_types, set_type) + "\n")
-        readable_file.write("CAP: " + _get_capitalization(sentence, i, feature_types, set_type) + "\n")
-        readable_file.write("LOCATION: " + _get_location(sentence, i, feature_types, locations, set_type) + "\n")
-        readable_file.write("\r\n")
-
-# Gets the word from the word line. A word line is an array like: [O, NNP, IBM]
-def _get_word(sentence,i, feature_types, feature_ids, set_type):
-    word = sentence[i][2]
-    if set_type == "test":
-        if ("word-" + word) not in feature_ids:
-            word = "UNK"
-    return word
-
-# Gets the previous and next words of the current word.
-def _get_word_context(sentence, i, feature_types, feature_ids, set_type):
-    if "WORDCON" not in feature_types:
-        return "n/a"
-
-    prev_word, next_word = "", ""
-    got_prev_word, got_next_word = False, False
-
-    if i == 0: # First word in the sentence
-        prev_word = "PHI"
-        got_prev_word = True
-    elif i == (len(sentence)-1): # Last word in the sentence
-        next_word = "OMEGA"
-        got_next_word = True
-
-    if not got_prev_word:
-        prev_word = sentence[i-1][2]
-        if set_type == "test":
-            if ("word-" + prev_word) not in feature_ids:
-                prev_word = "UNK"
-    if not got_next_word:
-        next_word = sentence[i+1][2]
-        if set_type == "test":
-            if ("word-" + next_word) not in feature_ids:
-                next_word = "UNK"
-
-    return prev_word + " " + next_word
-
-def _get_pos(sentence, i, feature_types, feature_ids, set_type):
-    if "POS" not in feature_types:
-        return "n/a"
-
-    pos = sentence[i][1]
-    if set_type == "test":
-        if ("pos-" + pos) not in feature_ids:
-            pos = "UNKPOS"
-    return pos
-
-def _get_pos_context(sentence, i, feature_types, feature_ids, set_type):
-    if "POSCON" not in feature_types:
-        return "n/a"
-    prev_pos, next_pos = "", ""
-    got_prev_pos, got_next_pos = False, False
-
-    if i == 0: # First pos in the sentence
-        prev_pos = "PHIPOS"
-        got_prev_pos = True
-    elif i == (len(sentence)-1): # Last pos in the sentence
-        next_pos = "OMEGAPOS"
-        got_next_pos = True
-    if not got_prev_pos:
-        prev_pos = sentence[i-1][1]
-        if set_type == "test":
-            if ("pos-" + prev_pos) not in feature_ids:
-                prev_pos = "UNKPOS"
-    if not got_next_pos:
-        next_pos = sentence[i+1][1]
-        if set_type == "test":
-            if ("pos-" + next_pos) not in feature_ids:
-                next_pos = "UNKPOS"
-
-    return prev_pos + " " + next_pos
-
-def _get_abbreviation(sentence, i, feature_types, set_type):
-    if "ABBR" not in feature_types:
-        return "n/a"
-    word = sentence[i][2]
-    # Abbreviations end with a period and consists entirely of alphabetic
-    # characters and 1 or more periods, and are less than 5 characters
-    pattern = re.compile("^(\.*[a-zA-Z]*\.*)+\.$")
-    if pattern.match(word) and len(word) < 5:
-        return "yes"
-    else:
-        return "no"
-
-def _get_capitalization(sentence, i, feature_types, set_type):
-    if "CAP" not in feature_types:
-        return "n/a"
-    word = sentence[i][2]
-    if word[0].isupper():
-        return "yes"
-    else:
-        return "no"
-
-def _get_location(sentence, i, feature_types, locations, set_type):
-    if "LOCATION" not in feature_types:
-        return "n/a"
-    word = sentence[i][2]
-    if word in locations:
-        return "yes"
-    else:
-        return "no"
+        lines.append(features.token_readable(sentence, i, feature_ids, set_type))
+        lines.append("\r\n")
+    readable_file.write("".join(lines))
+    if recorder is not None:
+        recorder.add_time("write_readable", started)
 
 # Writes each word in the sentence to a vector output file
-def _write_sentence_to_vector(sentence, feature_types, locations, feature_ids, vector_file):
-    ids = []
-    label = None # initialize integer representation of the word's label
-    # Write info to vector file for each word in the sentence
+def _write_sentence_to_vector(sentence, features, feature_ids, vector_file):
+    recorder = instrument.active
+    if recorder is not None:
+        started = recorder.clock()
+        recorder.count_sentence()
     for i in range(len(sentence)):
-        label = _label2int(sentence[i][0])
-        ids.append(_get_word_id(sentence,i, feature_ids))
-        ids += _get_word_context_ids(sentence,i, feature_types, feature_ids)
-        ids.append(_get_pos_id(sentence, i, feature_types, feature_ids))
-        ids += _get_pos_context_ids(sentence, i, feature_types, feature_ids)
-        ids.append(_get_abbreviation_id(sentence, i, feature_types, feature_ids))
-        ids.append(_get_capitalization_id(sentence, i, feature_types, feature_ids))
-        ids.append(_get_location_id(sentence, i, feature_types, feature_ids, locations))
+        label = api.label_code(sentence, i)
+        ids = features.token_ids(sentence, i, feature_ids)
+        if recorder is not None:
+            recorder.count_token(ids)
         _write_vector(label, ids, vector_file)
-        ids.clear()
-
-# Returns an integer corresponding to the given BIO label
-def _label2int(label):
-    if label == "O":
-        return 0
-    elif label == "B-PER":
-        return 1
-    elif label == "I-PER":
-        return 2
-    elif label == "B-LOC":
-        return 3
-    elif label == "I-LOC":
-        return 4
-    elif label == "B-ORG":
-        return 5
-    elif label == "I-ORG":
-        return 6
-    else:
-        raise Exception("Received a bad BIO label!")
-
-# Returns the id for the word (sentence[i][2]), or the id for "word-UNK"
-# if the word doesn't have an associated id (i.e., wasn't in the training data)
-def _get_word_id(sentence,i, feature_ids):
-    word = sentence[i][2]
-    if ("word-" + word) in feature_ids:
-        word_id = feature_ids[("word-" + word)]
-    else:
-        word_id = feature_ids["word-UNK"]
-    return word_id
-
-# Returns the two id numbers associated with the words before and after the word
-# (sentence[i][2]). If word context is not in the feature_types set, returns None
-# If ids are not found for the previous and/or next words, returns "prev-word-UNK"
-# and "next-word-UNK" respectively
-def _get_word_context_ids(sentence,i, feature_types, feature_ids):
-    if "WORDCON" not in feature_types:
-        return None
-    prev_word_id = None
-    if i == 0:
-        prev_word_id = feature_ids["prev-word-PHI"]
-    else:
-        prev_word = sentence[i-1][2]
-        if ("prev-word-" + prev_word) in feature_ids:
-            prev_word_id = feature_ids[("prev-word-" + prev_word)]
-        else:
-            prev_word_id = feature_ids["prev-word-UNK"]
+    if recorder is not None:
+        recorder.add_time("write_vector", started)
 
-    # Now get the id for the following word
-    next_word_id = None
-    if i == len(sentence)-1:
-        next_word_id = feature_ids["next-word-OMEGA"]
-    else:
-        next_word = sentence[i+1][2]
-        if ("next-word-" + next_word) in feature_ids:
-            next_word_id = feature_ids[("next-word-" + next_word)]
-        else:
-            next_word_id = feature_ids["next-word-UNK"]
+# Sorts in ascending order an array of feature ideas for a word, and then prints
+# on a single line like so: <label> <feature_id1>:1  <feature_id2>:1 ...
+def _write_vector(label, ids, vector_file):
+    line = [str(label) + " "]
+    ids.sort()
+    previous_id = None
+    for id in ids:
+        if id != previous_id: # with --hash-bits two features can share an id
+            line.append(str(id) + ":1 ")
+        previous_id = id
+    line.append("\n") #  Next word on a new line
+    vector_file.write("".join(line))
+
+
+# Parses the command line of the full pipeline. The feature types come after the
+# three input files; options such as --single-pass may appear anywhere
+def _parse_arguments(argv):
+    parser = argparse.ArgumentParser(prog="ner.py")
+    parser.add_argument("train_file")
+    parser.add_argument("test_file")
+    parser.add_argument("locations_file")
+    parser.add_argument("feature_types", nargs="+", choices=FEATURE_TYPES, metavar="feature_type")
+    parser.add_argument("--single-pass", action="store_true",
+                        help="build the vocabulary and the training files in one pass; "
+                             "pseudo features get the reserved ids 1-" + str(len(RESERVED_PSEUDOS)))
+    parser.add_argument("--hash-bits", type=int, default=None, metavar="N",
+                        help="hash feature strings into 2^N ids instead of building a "
+                             "vocabulary from the training file (see hashing.py)")
+    _add_vocabulary_arguments(parser)
+    _add_vectorizing_arguments(parser)
+    _add_instrumentation_arguments(parser)
+    return parser.parse_args(argv)
+
+# Adds the options of the out-of-core vocabulary builder (see vocabbuilder.py)
+def _add_vocabulary_arguments(parser):
+    parser.add_argument("--min-count", dest="min_counts", action="append", type=_cutoff_option,
+                        default=None, metavar="[NAMESPACE=]N",
+                        help="drop features seen fewer than N times in the training file, in "
+                             "one namespace (word, prev-word, pos, ...) or all (repeatable)")
+    parser.add_argument("--top-k", dest="top_ks", action="append", type=_cutoff_option,
+                        default=None, metavar="[NAMESPACE=]K",
+                        help="keep only the K most frequent features of a namespace, or of "
+                             "each namespace (repeatable)")
+    parser.add_argument("--memory", default=None, metavar="SIZE",
+                        help="count the features in about SIZE of memory, spilling to disk "
+                             "(default 1G with --min-count or --top-k)")
+
+# Parses a --min-count or --top-k value, "N" or "NAMESPACE=N", into a
+# (namespace or None for every namespace, N) pair
+def _cutoff_option(cutoff_str):
+    namespace, separator, value_str = cutoff_str.rpartition("=")
+    namespaces = [prefix[:-1] for prefix in instrument.NAMESPACES]
+    if separator and namespace not in namespaces:
+        raise argparse.ArgumentTypeError("unknown namespace " + namespace + ", expected one of "
+                                         + ", ".join(namespaces))
+    try:
+        value = int(value_str)
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise argparse.ArgumentTypeError("expected a positive number, not " + value_str)
+    return namespace or None, value
+
+# Adds the --stats and --profile options (see instrument.py)
+def _add_instrumentation_arguments(parser):
+    parser.add_argument("--stats", default=None, metavar="FILE",
+                        help="write per-stage timings, token/OOV counts, vocabulary and "
+                             "output sizes as JSON to FILE (- for stdout)")
+    parser.add_argument("--profile", default=None, metavar="FILE",
+                        help="run the vectorization under cProfile and dump the profile to FILE")
+
+# Adds the options shared by the pipeline and the vectorize command
+def _add_vectorizing_arguments(parser):
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="vectorize with N processes, each working on a shard of "
+                             "whole sentences; the output is the same as with 1")
+    parser.add_argument("--engine", choices=["python", "numpy"], default="python",
+                        help="feature extraction engine; numpy vectorizes whole batches "
+                             "of sentences with array operations (same output)")
+    parser.add_argument("--output-format", choices=["liblinear", "csr", "both"], default="liblinear",
+                        help="write .vector text for liblinear, a binary .csr directory of "
+                             ".npy arrays (uses the numpy engine), or both")
+    parser.add_argument("--readable", action="store_true",
+                        help="also write the full .readable files; by default only a sentence "
+                             "index is written, for \"ner.py show\" (see sentence_index.py)")
+    parser.add_argument("--cache", default=None, metavar="DIR",
+                        help="restore outputs of unchanged inputs from (and save new ones to) "
+                             "the cache in DIR (see cache.py)")
+    parser.add_argument("--cache-size", default="2G", metavar="SIZE",
+                        help="evict least recently used cache entries beyond SIZE (default 2G)")
+
+# Parses the command line of "ner.py build-vocab"
+def _parse_build_vocab_arguments(argv):
+    parser = argparse.ArgumentParser(prog="ner.py build-vocab",
+                                     description="save the vocabulary of a training file")
+    parser.add_argument("train_file")
+    parser.add_argument("locations_file")
+    parser.add_argument("vocab_file")
+    parser.add_argument("feature_types", nargs="+", choices=FEATURE_TYPES, metavar="feature_type")
+    _add_vocabulary_arguments(parser)
+    _add_instrumentation_arguments(parser)
+    return parser.parse_args(argv)
+
+# Parses the command line of "ner.py vectorize"
+def _parse_vectorize_arguments(argv):
+    parser = argparse.ArgumentParser(prog="ner.py vectorize",
+                                     description="write .vector and .readable files for "
+                                                 "input files, using a saved vocabulary")
+    parser.add_argument("vocab_file")
+    parser.add_argument("input_files", nargs="+", metavar="input_file")
+    _add_vectorizing_arguments(parser)
+    _add_instrumentation_arguments(parser)
+    return parser.parse_args(argv)
+
+# Parses the command line of "ner.py show"
+def _parse_show_arguments(argv):
+    parser = argparse.ArgumentParser(prog="ner.py show",
+                                     description="print the readable features of some sentences "
+                                                 "of an input file, using its sentence index")
+    parser.add_argument("vocab_file")
+    parser.add_argument("input_file")
+    parser.add_argument("range", type=_item_range,
+                        help="N or FIRST:END (end excluded), counting sentences from 0")
+    parser.add_argument("--tokens", action="store_true",
+                        help="count tokens (lines of the .vector file) instead of sentences")
+    parser.add_argument("--set-type", choices=["train", "test"], default=None,
+                        help="render as in train.txt.readable or test.txt.readable, which shows "
+                             "words missing from the vocabulary as UNK (default: train with "
+                             "the input file's own .vocab, test otherwise)")
+    parser.add_argument("--hash-bits", type=int, default=None, metavar="N",
+                        help="the input was vectorized with --hash-bits N")
+    return parser.parse_args(argv)
+
+# Parses a show range, "N" or "FIRST:END", into a (first, end) pair
+def _item_range(range_str):
+    try:
+        if ":" not in range_str:
+            return int(range_str), int(range_str) + 1
+        first_str, end_str = range_str.split(":")
+        return int(first_str or 0), int(end_str) if end_str else None
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected N or FIRST:END, not " + range_str)
+
+# Parses the command line of "ner.py compile-gazetteer"
+def _parse_compile_gazetteer_arguments(argv):
+    parser = argparse.ArgumentParser(prog="ner.py compile-gazetteer",
+                                     description="compile name lists into a memory-mapped "
+                                                 "gazetteer (see gazetteer.py)")
+    parser.add_argument("gazetteer_file")
+    parser.add_argument("lists", nargs="+", type=_name_list, metavar="CATEGORY=FILE",
+                        help="a list of names, one per line, e.g. LOC=locs.txt or PER=people.txt")
+    return parser.parse_args(argv)
+
+# Parses a CATEGORY=FILE name list into a (category, file) pair
+def _name_list(list_str):
+    category, separator, list_file_str = list_str.partition("=")
+    if not separator or not category or not list_file_str:
+        raise argparse.ArgumentTypeError("expected CATEGORY=FILE, not " + list_str)
+    return category, list_file_str
+
+# Parses the command line of "ner.py train"
+def _parse_train_arguments(argv):
+    parser = argparse.ArgumentParser(prog="ner.py train",
+                                     description="train the built-in classifier (see classifier.py)")
+    parser.add_argument("vectors", help="a .vector file or a .csr directory")
+    parser.add_argument("model_file")
+    parser.add_argument("--epochs", type=int, default=None)
+    parser.add_argument("--sentences", default=None, metavar="CORPUS",
+                        help="the corpus file the vectors were made from; its sentence "
+                             "boundaries are used to learn label transitions for Viterbi decoding")
+    return parser.parse_args(argv)
+
+# Parses the command line of "ner.py predict"
+def _parse_predict_arguments(argv):
+    parser = argparse.ArgumentParser(prog="ner.py predict",
+                                     description="label vectors with a model saved by train")
+    parser.add_argument("model_file")
+    parser.add_argument("vectors", help="a .vector file or a .csr directory")
+    parser.add_argument("predictions_file")
+    parser.add_argument("--decode", choices=["argmax", "viterbi"], default="argmax",
+                        help="label every token on its own, or pick the best valid BIO "
+                             "sequence of every sentence (needs --sentences; see decoding.py)")
+    parser.add_argument("--sentences", default=None, metavar="CORPUS",
+                        help="the corpus file the vectors were made from, for its sentence boundaries")
+    parser.add_argument("--spans", default=None, metavar="FILE",
+                        help="write the entity spans of every sentence to FILE, one line per "
+                             "sentence, e.g. \"0-2:LOC 5-6:PER\" (needs --sentences)")
+    return parser.parse_args(argv)
+
+# Parses the command line of "ner.py evaluate"
+def _parse_evaluate_arguments(argv):
+    parser = argparse.ArgumentParser(prog="ner.py evaluate",
+                                     description="score predicted labels against the gold labels "
+                                                 "(see evaluation.py)")
+    parser.add_argument("predictions_file")
+    parser.add_argument("gold_file", help="the corpus file (test.txt) or its .vector file")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="evaluate shards of the files in N processes (uncompressed files only)")
+    parser.add_argument("--json", default=None, metavar="FILE",
+                        help="also write the scores and the confusion matrix as JSON to FILE")
+    return parser.parse_args(argv)
+
+# Parses the command line of "ner.py serve"
+def _parse_serve_arguments(argv):
+    parser = argparse.ArgumentParser(prog="ner.py serve",
+                                     description="serve a vocabulary and model over HTTP (see server.py)")
+    parser.add_argument("vocab_file")
+    parser.add_argument("model_file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix", dest="unix_socket", default=None, metavar="PATH",
+                        help="listen on a Unix socket instead of host:port")
+    parser.add_argument("--max-batch", type=int, default=None, metavar="TOKENS",
+                        help="most tokens tagged in one micro-batch")
+    parser.add_argument("--max-wait-ms", type=float, default=None,
+                        help="how long a micro-batch waits for more requests")
+    parser.add_argument("--decode", choices=["viterbi", "argmax"], default="viterbi",
+                        help="decode valid BIO sequences (default) or label every token on its own")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    return parser.parse_args(argv)
+
+# Parses the command line of "ner.py ablate"
+def _parse_ablate_arguments(argv):
+    parser = argparse.ArgumentParser(prog="ner.py ablate",
+                                     description="write the vectors of many feature-type subsets "
+                                                 "from one extraction (see ablation.py)")
+    parser.add_argument("train_file")
+    parser.add_argument("test_file")
+    parser.add_argument("locations_file")
+    parser.add_argument("--subset", dest="subsets", action="append", type=_feature_subset,
+                        default=None, metavar="TYPES",
+                        help="a comma-separated subset such as WORD,POS,CAP (repeatable; "
+                             "default: all " + str(2 ** (len(FEATURE_TYPES) - 1)) + " subsets)")
+    parser.add_argument("--output-format", choices=["liblinear", "csr", "both"], default="liblinear")
+    return parser.parse_args(argv)
+
+# Parses a --subset value into a list of feature types
+def _feature_subset(subset_str):
+    feature_types = [name for name in subset_str.split(",") if name]
+    for name in feature_types:
+        if name not in FEATURE_TYPES:
+            raise argparse.ArgumentTypeError("unknown feature type " + name)
+    return feature_types
 
-    return [prev_word_id, next_word_id]
 
-# Returns the id number associated with the POS tag for
-# sentence[i][3]. But if POS is not in the feature_types set, returns None
-def _get_pos_id(sentence, i, feature_types, feature_ids):
-    if "POS" not in feature_types:
-        return None
-    pos = sentence[i][1]
-    pos_id = None
-    if ("pos-" + pos) in feature_ids:
-        pos_id = feature_ids[("pos-" + pos)]
+##### START OF PROGRAM #####
+
+# ner.py <train_file> <test_file> <locations_file> <feature types>
+# Builds the vocabulary from the training file, then writes the .vector and
+# .readable files for both the training and the test file
+def _run_pipeline(argv):
+    args = _parse_arguments(argv)
+    if _builds_vocabulary_out_of_core(args) and (args.single_pass or args.hash_bits is not None):
+        raise Exception("--min-count, --top-k and --memory don't work with --single-pass or --hash-bits!")
+    if args.train_file == "-":
+        # Building the vocabulary first would use up stdin before the training
+        # vectors are written, and the cache keys need the file's contents
+        if not args.single_pass and args.hash_bits is None:
+            raise Exception("A training file from stdin needs --single-pass or --hash-bits!")
+        if args.cache is not None:
+            raise Exception("--cache needs a training file, not stdin!")
+    _start_instrumentation(args)
+    with instrument.stage("get_locations"):
+        locations = api.load_locations(args.locations_file)
+    features = extractors.compile_features(args.feature_types, locations)
+
+    jobs = [(args.train_file, "train"), (args.test_file, "test")]
+    outputs = _selected_outputs(args)
+    feature_cache = None
+    if args.cache is not None:
+        import cache
+        feature_cache = cache.FeatureCache(args.cache, cache.parse_size(args.cache_size))
+        vocabulary_key = _vocabulary_key(feature_cache, args, features)
+        output_keys = {}
+        for input_file_str, set_type in jobs:
+            if input_file_str != "-": # stdin can't be hashed ahead of time
+                output_keys[input_file_str] = feature_cache.key(
+                    vocabulary_key, feature_cache.file_hash(input_file_str), set_type, ",".join(outputs))
+        vocab_file_str = None
+        if args.hash_bits is None:
+            vocab_file_str = feature_cache.lookup(vocabulary_key, "vocabulary")
+        restorable_keys = dict(output_keys)
+        if args.single_pass and vocab_file_str is None:
+            # The single pass numbers the features while it writes the training
+            # files, so these are only restored along with that vocabulary
+            restorable_keys.pop(args.train_file, None)
+        jobs = _restore_cached_outputs(feature_cache, restorable_keys, jobs, outputs)
+        if not jobs and (vocab_file_str is not None or args.hash_bits is not None):
+            if vocab_file_str is not None:
+                _save_show_vocabulary(args, vocabfile.load_vocabulary(vocab_file_str)[0], features, outputs)
+            else:
+                _save_show_vocabulary(args, hashing.HashedFeatureIds(args.hash_bits), features, outputs)
+            _finish_instrumentation(args, None)
+            return
+
+    feature_ids = None
+    if args.hash_bits is not None:
+        feature_ids = hashing.HashedFeatureIds(args.hash_bits)
+    elif feature_cache is not None and vocab_file_str is not None:
+        with instrument.stage("load_vocabulary"):
+            feature_ids = vocabfile.load_vocabulary(vocab_file_str)[0]
+    if feature_ids is None:
+        if args.single_pass and (args.train_file, "train") in jobs:
+            # The single pass always writes .vector text, never CSR
+            single_pass_outputs = [name for name in outputs if name != "csr"]
+            if "vector" not in single_pass_outputs:
+                single_pass_outputs.append("vector")
+            with instrument.stage("create_feature_ids_and_training_files"), instrument.profiling():
+                feature_ids = _create_feature_ids_and_training_files(args.train_file, features,
+                                                                     single_pass_outputs)
+            jobs.remove((args.train_file, "train"))
+            if feature_cache is not None:
+                _store_outputs(feature_cache, output_keys, args.train_file, single_pass_outputs)
+        elif _builds_vocabulary_out_of_core(args):
+            feature_ids = _create_pruned_feature_ids(args, features)
+        else:
+            with instrument.stage("create_feature_ids"):
+                feature_ids = _create_feature_ids(args.train_file, features)
+        if feature_cache is not None:
+            _store_vocabulary(feature_cache, vocabulary_key, feature_ids, features)
+    _save_show_vocabulary(args, feature_ids, features, outputs)
+
+    if args.workers > 1:
+        _generate_files_in_parallel_from_ids(jobs, feature_ids, features, args.workers, args.engine, outputs)
     else:
-        pos_id = feature_ids["UNKPOS"]
-    return pos_id
-
-# Returns the two id numbers associated with the pos tags before and after the pos tag
-# sentence[i][1]. If pos context is not in the feature_types set, returns None
-# If ids are not found for the previous and/or next pos, returns "prev-pos-UNKPOS"
-# and "next-pos-UNKPOS" respectively
-def _get_pos_context_ids(sentence, i, feature_types, feature_ids):
-    if "POSCON" not in feature_types:
-        return None
-    prev_pos_id = None
-    if i == 0:
-        prev_pos_id = feature_ids["prev-pos-PHIPOS"]
+        for input_file_str, set_type in jobs:
+            _generate_files(input_file_str, set_type, feature_ids, features, args.engine, outputs)
+    if feature_cache is not None:
+        for input_file_str, set_type in jobs:
+            _store_outputs(feature_cache, output_keys, input_file_str, outputs)
+
+    if args.hash_bits is not None:
+        print(hashing.format_collision_stats(feature_ids.collision_stats()))
+    _finish_instrumentation(args, feature_ids)
+
+# Returns the cache key of the pipeline's vocabulary: the training file, the
+# feature types, the locations, and how the ids are numbered
+def _vocabulary_key(feature_cache, args, features):
+    if args.hash_bits is not None:
+        numbering = "hash-bits=" + str(args.hash_bits)
+    elif args.single_pass:
+        numbering = "single-pass"
     else:
-        prev_pos = sentence[i-1][1]
-        if ("prev-pos-" + prev_pos) in feature_ids:
-            prev_pos_id = feature_ids[("prev-pos-" + prev_pos)]
+        numbering = "two-pass"
+        for option, cutoffs in [("min-count", args.min_counts), ("top-k", args.top_ks)]:
+            for namespace, value in sorted(cutoffs or [], key=str):
+                numbering += " " + option + "=" + (namespace or "*") + ":" + str(value)
+    return feature_cache.key("vocabulary", feature_cache.file_hash(args.train_file),
+                             feature_cache.file_hash(args.locations_file),
+                             " ".join(sorted(features.feature_types)), numbering)
+
+# Restores the outputs of the jobs whose key is in the cache, and returns the
+# jobs that still have to be run
+def _restore_cached_outputs(feature_cache, output_keys, jobs, outputs):
+    pending = []
+    for input_file_str, set_type in jobs:
+        if input_file_str not in output_keys:
+            pending.append((input_file_str, set_type))
+            continue
+        with instrument.stage("restore from cache"):
+            restored = feature_cache.fetch(output_keys[input_file_str],
+                                           _output_paths(input_file_str, outputs))
+        if restored:
+            _record_outputs(input_file_str, outputs)
         else:
-            prev_pos_id = feature_ids["prev-pos-UNK"]
-
-    next_pos_id = None
-    if i == len(sentence)-1:
-        next_pos_id = feature_ids["next-pos-OMEGAPOS"]
+            pending.append((input_file_str, set_type))
+    return pending
+
+def _store_outputs(feature_cache, output_keys, input_file_str, outputs):
+    if input_file_str in output_keys:
+        feature_cache.store(output_keys[input_file_str], _output_paths(input_file_str, outputs))
+
+# Saves the vocabulary of a pipeline run as <train_file>.vocab next to the
+# training file's index, so "ner.py show" can render any of its sentences
+# without a separate build-vocab run. With --hash-bits there are no ids to
+# save, only the feature types and locations (show then needs --hash-bits too)
+def _save_show_vocabulary(args, feature_ids, features, outputs):
+    if "index" not in _output_paths(args.train_file, outputs):
+        return
+    if isinstance(feature_ids, hashing.HashedFeatureIds):
+        feature_ids = {}
+    with instrument.stage("save_vocabulary"):
+        vocabfile.save_vocabulary(fileio.output_path(args.train_file, ".vocab", compressed=False),
+                                  feature_ids, features.feature_types, features.locations)
+
+# Saves feature_ids to the cache as the entry of vocabulary_key
+def _store_vocabulary(feature_cache, vocabulary_key, feature_ids, features):
+    import tempfile
+    vocab_fd, vocab_file_str = tempfile.mkstemp(suffix=".vocab")
+    os.close(vocab_fd)
+    try:
+        vocabfile.save_vocabulary(vocab_file_str, feature_ids, features.feature_types, features.locations)
+        feature_cache.store(vocabulary_key, {"vocabulary": vocab_file_str})
+    finally:
+        os.remove(vocab_file_str)
+
+# Turns on instrumentation if --stats or --profile was given
+def _start_instrumentation(args):
+    if args.stats is not None or args.profile is not None:
+        instrument.start(args.profile)
+
+# Writes the --stats report and the --profile dump
+def _finish_instrumentation(args, feature_ids):
+    recorder = instrument.active
+    if recorder is None:
+        return
+    if isinstance(feature_ids, hashing.HashedFeatureIds):
+        recorder.vocabulary = {"hashed": feature_ids.collision_stats()}
+    elif feature_ids is not None:
+        recorder.record_vocabulary(feature_ids)
+    recorder.dump_profile()
+    if args.stats is not None:
+        recorder.save(args.stats)
+
+# True if the vocabulary is to be built by vocabbuilder.py: with cutoffs or a memory cap
+def _builds_vocabulary_out_of_core(args):
+    return args.min_counts is not None or args.top_ks is not None or args.memory is not None
+
+# Builds the vocabulary out of core with the cutoffs of the command line, saves
+# it to vocab_file_str and prints how many features were kept
+def _build_pruned_vocabulary(args, features, vocab_file_str):
+    import vocabbuilder
+    memory_bytes = vocabbuilder.DEFAULT_MEMORY_BYTES
+    if args.memory is not None:
+        import cache
+        memory_bytes = cache.parse_size(args.memory)
+    with instrument.profiling():
+        sizes = vocabbuilder.build_vocabulary(args.train_file, features, vocab_file_str,
+                                              dict(args.min_counts or []), dict(args.top_ks or []),
+                                              memory_bytes)
+    print(vocabbuilder.format_sizes(sizes))
+
+# Like _create_feature_ids, but builds the vocabulary out of core into a
+# temporary file and returns it memory-mapped
+def _create_pruned_feature_ids(args, features):
+    import tempfile
+    vocab_fd, vocab_file_str = tempfile.mkstemp(suffix=".vocab",
+                                                dir=os.path.dirname(os.path.abspath(args.train_file)))
+    os.close(vocab_fd)
+    try:
+        _build_pruned_vocabulary(args, features, vocab_file_str)
+        return vocabfile.load_vocabulary(vocab_file_str)[0] # the mapping outlives the file
+    finally:
+        os.remove(vocab_file_str)
+
+# ner.py build-vocab <train_file> <locations_file> <vocab_file> <feature types>
+# Builds the vocabulary from the training file and saves it to vocab_file,
+# together with the feature types and the locations
+def _build_vocab(argv):
+    args = _parse_build_vocab_arguments(argv)
+    _start_instrumentation(args)
+    with instrument.stage("get_locations"):
+        locations = api.load_locations(args.locations_file)
+    features = extractors.compile_features(args.feature_types, locations)
+    if _builds_vocabulary_out_of_core(args):
+        _build_pruned_vocabulary(args, features, args.vocab_file)
+        feature_ids = None
+        if instrument.active is not None:
+            feature_ids = vocabfile.load_vocabulary(args.vocab_file)[0]
     else:
-        next_pos = sentence[i+1][1]
-        if ("next-pos-" + next_pos) in feature_ids:
-            next_pos_id = feature_ids[("next-pos-" + next_pos)]
-        else:
-            next_pos_id = feature_ids["next-pos-UNK"]
-
-    return [prev_pos_id, next_pos_id]
-
-# Returns the id number of the abbreviation feature
-# But if ABBR is not in the feature_types set, returns None
-def _get_abbreviation_id(sentence, i, feature_types, feature_ids):
-    if "ABBR" not in feature_types:
+        with instrument.stage("create_feature_ids"), instrument.profiling():
+            feature_ids = _create_feature_ids(args.train_file, features)
+        with instrument.stage("save_vocabulary"):
+            vocabfile.save_vocabulary(args.vocab_file, feature_ids, features.feature_types,
+                                      features.locations)
+    if instrument.active is not None:
+        instrument.active.record_output(args.vocab_file)
+    _finish_instrumentation(args, feature_ids)
+
+# ner.py vectorize <vocab_file> <input_file> ...
+# Memory-maps a vocabulary saved by build-vocab and writes the .vector and
+# .readable files for each input file, treating them like the test set
+def _vectorize(argv):
+    args = _parse_vectorize_arguments(argv)
+    _start_instrumentation(args)
+    jobs = [(input_file_str, "test") for input_file_str in args.input_files]
+    outputs = _selected_outputs(args)
+    if args.cache is not None:
+        import cache
+        feature_cache = cache.FeatureCache(args.cache, cache.parse_size(args.cache_size))
+        vocab_hash = feature_cache.file_hash(args.vocab_file)
+        output_keys = {}
+        for input_file_str, set_type in jobs:
+            if input_file_str != "-": # stdin can't be hashed ahead of time
+                output_keys[input_file_str] = feature_cache.key(
+                    "vectorize", vocab_hash, feature_cache.file_hash(input_file_str), ",".join(outputs))
+        jobs = _restore_cached_outputs(feature_cache, output_keys, jobs, outputs)
+    feature_ids = _vectorize_jobs(args, jobs, outputs)
+    if args.cache is not None:
+        for input_file_str, set_type in jobs:
+            _store_outputs(feature_cache, output_keys, input_file_str, outputs)
+    _finish_instrumentation(args, feature_ids)
+
+# Runs the vectorize jobs that weren't restored from the cache. Returns the
+# vocabulary it loaded, or None
+def _vectorize_jobs(args, jobs, outputs):
+    if not jobs:
         return None
-    if _get_abbreviation(sentence, i, feature_types, "train") == "yes":
-        return feature_ids["abbreviated"]
-    else:
+    if args.workers > 1:
+        _generate_files_in_parallel(jobs, args.vocab_file, args.workers, args.engine, outputs)
         return None
+    with instrument.stage("load_vocabulary"):
+        feature_ids, feature_types, locations = vocabfile.load_vocabulary(args.vocab_file)
+    features = extractors.compile_features(feature_types, locations)
+    for input_file_str, set_type in jobs:
+        _generate_files(input_file_str, set_type, feature_ids, features, args.engine, outputs)
+    return feature_ids
 
-# Returns the id number of the capitalization feature
-# But if CAP is not in the feature_types set, returns None
-def _get_capitalization_id(sentence, i, feature_types, feature_ids):
-    if "CAP" not in feature_types:
-        return None
-    if _get_capitalization(sentence, i, feature_types, "train") == "yes":
-        return feature_ids["capitalized"]
+# ner.py show <vocab_file> <input_file> <range> [--tokens] [--set-type TYPE] [--hash-bits N]
+# Prints the readable features of a range of sentences (or tokens) of an input
+# file, exactly as they appear in its .readable file, seeking straight to them
+# with the sentence index (which is built first if it is missing or stale)
+def _show(argv):
+    args = _parse_show_arguments(argv)
+    if not fileio.is_seekable(args.input_file):
+        raise Exception("show needs an uncompressed input file, not " + args.input_file + "!")
+    index = sentence_index.load_index(args.input_file,
+                                      fileio.output_path(args.input_file, ".index", compressed=False))
+    feature_ids, feature_types, locations = vocabfile.load_vocabulary(args.vocab_file)
+    features = extractors.compile_features(feature_types, locations)
+    if args.hash_bits is not None:
+        feature_ids = hashing.HashedFeatureIds(args.hash_bits)
+    set_type = args.set_type
+    if set_type is None:
+        # The vocabulary the pipeline saved next to its training file
+        set_type = "train" if _is_show_vocabulary(args.vocab_file, args.input_file) else "test"
+
+    first, end = args.range
+    size = index.num_tokens() if args.tokens else len(index)
+    end = size if end is None else min(end, size)
+    if first >= end:
+        return
+    if args.tokens:
+        first_sentence = index.sentence_of_token(first)
+        end_sentence = index.sentence_of_token(end - 1) + 1
     else:
-        return None
-
-# Returns the id number of the location feature
-# But if LOCATION is not in the feature_types set, returns None
-def _get_location_id(sentence, i, feature_types, feature_ids, locations):
-    if "LOCATION" not in feature_types:
-        return None
-    if _get_location(sentence, i, feature_types, locations, "train") == "yes":
-        return feature_ids["is-location"]
+        first_sentence, end_sentence = first, end
+
+    input_file = open(args.input_file, "rb")
+    output_file = fileio.open_output("-")
+    for k in range(first_sentence, end_sentence):
+        sentence = sentence_index.read_sentence(input_file, index, k)
+        first_token = index.first_token(k)
+        for i in range(len(sentence)):
+            if not args.tokens or first <= first_token + i < end:
+                output_file.write(features.token_readable(sentence, i, feature_ids, set_type) + "\r\n")
+    output_file.close()
+    input_file.close()
+
+# True if vocab_file_str is the vocabulary the pipeline saved for the training
+# file input_file_str (see _save_show_vocabulary)
+def _is_show_vocabulary(vocab_file_str, input_file_str):
+    show_vocab_file_str = fileio.output_path(input_file_str, ".vocab", compressed=False)
+    return os.path.exists(show_vocab_file_str) and os.path.samefile(vocab_file_str, show_vocab_file_str)
+
+# ner.py compile-gazetteer <gazetteer_file> <CATEGORY=FILE> ...
+# Compiles name lists into a gazetteer file, which can then be given in place
+# of the locations file
+def _compile_gazetteer(argv):
+    args = _parse_compile_gazetteer_arguments(argv)
+    gazetteer.compile_gazetteer(args.lists, args.gazetteer_file)
+
+# ner.py ablate <train_file> <test_file> <locations_file> [--subset TYPES ...]
+# Writes <file>.<subset>.vector for the training and test file and every
+# requested feature-type subset, extracting the features only once
+def _ablate(argv):
+    args = _parse_ablate_arguments(argv)
+    import ablation
+    ablation.run(args.train_file, args.test_file, api.load_locations(args.locations_file),
+                 args.subsets, args.output_format)
+
+# Reads feature vectors for the classifier: a .csr directory is memory-mapped,
+# anything else is parsed as liblinear text
+def _load_vectors(vectors_str):
+    import csr
+    if os.path.isdir(vectors_str):
+        return csr.load_csr(vectors_str)
+    vector_file = fileio.open_input(vectors_str)
+    matrix = csr.read_liblinear(vector_file)
+    vector_file.close()
+    return matrix
+
+# ner.py train <train vectors> <model_file>
+# Trains the built-in classifier on train.txt.vector (or train.txt.csr) and
+# saves the weights to model_file
+def _train(argv):
+    args = _parse_train_arguments(argv)
+    import classifier
+    options = {}
+    if args.epochs is not None:
+        options["epochs"] = args.epochs
+    matrix = _load_vectors(args.vectors)
+    model = classifier.train(matrix, **options)
+    if args.sentences is not None:
+        import decoding
+        lengths = _sentence_lengths(args.sentences, len(matrix))
+        start, transitions = decoding.learn_transitions(matrix.labels, lengths)
+        weight = decoding.tune_transition_weight(model.all_scores(matrix), matrix.labels, lengths,
+                                                 start, transitions)
+        model.start, model.transitions = start * weight, transitions * weight
+    model.save(args.model_file)
+
+# Returns the number of tokens of every sentence of a corpus file, from its
+# sentence index, after checking that they add up to num_tokens vectors
+def _sentence_lengths(corpus_file_str, num_tokens):
+    import numpy as np
+    if not fileio.is_seekable(corpus_file_str):
+        raise Exception("--sentences needs an uncompressed corpus file, not " + corpus_file_str + "!")
+    index = sentence_index.load_index(corpus_file_str,
+                                      fileio.output_path(corpus_file_str, ".index", compressed=False))
+    if index.num_tokens() != num_tokens:
+        raise Exception(corpus_file_str + " has " + str(index.num_tokens()) + " tokens, but there are "
+                        + str(num_tokens) + " vectors!")
+    return np.diff(np.asarray(index.first_tokens(), np.int64))
+
+# ner.py predict <model_file> <test vectors> <predictions_file>
+# Writes one predicted label per line to predictions_file, like liblinear's
+# predict, and prints the accuracy in the same format. With --decode viterbi the
+# labels of every sentence are decoded together (with the model's learned
+# transitions if it has them, else just the BIO constraints)
+def _predict(argv):
+    args = _parse_predict_arguments(argv)
+    if args.sentences is None and (args.decode == "viterbi" or args.spans is not None):
+        raise Exception("--decode viterbi and --spans need --sentences!")
+    import classifier
+    model = classifier.load_model(args.model_file)
+    matrix = _load_vectors(args.vectors)
+    if args.decode == "viterbi":
+        import decoding
+        lengths = _sentence_lengths(args.sentences, len(matrix))
+        predicted = decoding.decode(model.all_scores(matrix), lengths, model.start, model.transitions)
     else:
-        return None
-
-# Sorts in ascending order an array of feature ideas for a word, and then prints
-# on a single line like so: <label> <feature_id1>:1  <feature_id2>:1 ...
-def _write_vector(label, ids, vector_file):
-    vector_file.write(str(label) + " ")
-
-    # Populate a new array with ids but no None elements from the id array
-    condensed_ids = []
-    for id in ids:
-        if id != None:
-            condensed_ids.append(id)
-
-    condensed_ids.sort()
-    for id in condensed_ids:
-        vector_file.write(str(id) + ":1 ")
-    vector_file.write("\n") #  Next word on a new line
-
-
-##### START OF PROGRAM #####
-
-if len(sys.argv) < 5 or len(sys.argv) > 11:
-    print("You gave the wrong number of arguments.")
-    print("Arguments should be: <train_file> <test_file> <locations_file> <feature types>")
-    sys.exit(0)
+        predicted = model.predict(matrix)
+
+    if args.spans is not None:
+        import decoding
+        if args.decode != "viterbi":
+            lengths = _sentence_lengths(args.sentences, len(matrix))
+        spans_file = fileio.open_output(args.spans)
+        spans_file.write("".join(decoding.format_spans(spans) + "\n"
+                                 for spans in decoding.entity_spans(predicted, lengths)))
+        spans_file.close()
+
+    predictions_file = fileio.open_output(args.predictions_file)
+    predictions_file.write("".join(str(label) + "\n" for label in predicted.tolist()))
+    predictions_file.close()
+    correct, total = classifier.accuracy(matrix, predicted)
+    print("Accuracy = %g%% (%d/%d)" % (100.0 * correct / total, correct, total))
+
+# ner.py evaluate <predictions_file> <gold_file>
+# Prints the token accuracy, the entity scores and the confusion matrix of the
+# predictions
+def _evaluate(argv):
+    args = _parse_evaluate_arguments(argv)
+    import evaluation
+    result = evaluation.evaluate(args.predictions_file, args.gold_file, args.workers)
+    sys.stdout.write(result.report())
+    if args.json is not None:
+        evaluation.save_json(result, args.json)
+
+# ner.py serve <vocab_file> <model_file>
+# Runs the tagging server until interrupted
+def _serve(argv):
+    args = _parse_serve_arguments(argv)
+    import server
+    options = {}
+    if args.max_batch is not None:
+        options["max_batch_tokens"] = args.max_batch
+    if args.max_wait_ms is not None:
+        options["max_wait_ms"] = args.max_wait_ms
+    server.serve(args.vocab_file, args.model_file, args.host, args.port, args.unix_socket,
+                 verbose=args.verbose, decode=args.decode, **options)
+
+# Subcommands; anything else on the command line runs the full pipeline
+COMMANDS = {
+    "build-vocab": _build_vocab,
+    "vectorize": _vectorize,
+    "compile-gazetteer": _compile_gazetteer,
+    "ablate": _ablate,
+    "train": _train,
+    "predict": _predict,
+    "evaluate": _evaluate,
+    "serve": _serve,
+    "show": _show,
+}
+
+def _main(argv):
+    if len(argv) > 1 and argv[1] in COMMANDS:
+        COMMANDS[argv[1]](argv[2:])
+    else:
+        _run_pipeline(argv[1:])
 
-locations = _get_locations(sys.argv[3])
-feature_types = _get_feature_types(sys.argv)
-feature_ids = _create_feature_ids(sys.argv[1], feature_types, locations)
+# Entry point of the "ner" command that pip installs (see pyproject.toml)
+def main():
+    _main(sys.argv)
 
-_generate_files_from_training_set(sys.argv[1], feature_ids, locations, feature_types)
-_generate_files_from_test_set(sys.argv[2], feature_ids, locations, feature_types)
+if __name__ == "__main__":
+    main()
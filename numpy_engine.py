@@ -0,0 +1,303 @@
+# Integer-encoded, NumPy-vectorized alternative to the per-token feature code in
+# ner.py (_write_sentence_to_vector and _write_sentence_to_readable). It writes
+# exactly the same .vector and .readable output. Requires numpy.
+#
+# Sentences are read in corpus.SentenceBlocks (see corpus.py), whose words and
+# pos tags are already codes into the block's distinct strings. Every distinct
+# word and pos tag gets a small integer index the first time it is seen, and the
+# extractors' word_values and pos_values (their feature ids, readable strings,
+# ...; see extractors.py) are looked up only once, into tables indexed by those
+# integers; a block's codes are turned into these indices with one array lookup.
+# The extractors' array_ids and array_readable hooks then turn a whole batch
+# (an ArrayBatch) into columns with a few array operations:
+#   WORD, POS           table lookups of the word/pos indices
+#   WORDCON, POSCON     the same lookups shifted by one token, with the PHI/OMEGA
+#                       ids filled in at sentence boundaries
+#   CAP, ABBR, LOCATION boolean masks of the word indices
+#   GAZ                 one column per gazetteer category, filled in from the
+#                       names matched in each sentence (see gazetteer.py)
+# Each token's ids are sorted with one np.sort over the batch and the output lines
+# are assembled with object-array string concatenation, one write per batch.
+
+import numpy as np
+
+import api
+import corpus
+import extractors
+import hashing
+import instrument
+
+# Roughly how many tokens are handled at once where they don't come in
+# corpus.SentenceBlocks (ablation.py)
+BATCH_TOKENS = 65536
+
+# A vectorizer remembers every distinct word it has seen, with its rows in the
+# tables; it forgets them all once it has seen this many, so memory stays
+# bounded however many distinct words go through it (with --hash-bits there is
+# no vocabulary to bound them, and a server sees an endless stream)
+MAX_CACHED_WORDS = 1000000
+
+# BIO labels in the order of their codes
+LABELS = api.LABELS
+_LABEL_TEXTS = np.array([str(code) + " " for code in range(len(LABELS))], dtype=object)
+
+# Removes the strings from position length on from strings and from index (see
+# ArrayVectorizer._encode)
+def _truncate(index, strings, length):
+    for value in strings[length:]:
+        del index[value]
+    del strings[length:]
+
+# Returns one column of word_values or pos_values (see extractors.py) as an
+# array: strings and None are kept as objects
+def _table_column(values):
+    if values[0] is None or isinstance(values[0], str):
+        return np.array(values, dtype=object)
+    return np.array(values)
+
+# Vectorizes sentences for one vocabulary and one set_type ("train" or "test",
+# which only changes the readable output, as in ner.py)
+class ArrayVectorizer:
+    def __init__(self, feature_ids, feature_types, locations, set_type):
+        self.feature_ids = feature_ids
+        # With --hash-bits the tables look up every distinct word's features,
+        # fired or not, so only the ids of the feature matrices are marked used
+        self._hashed_ids = None
+        if isinstance(feature_ids, hashing.HashedFeatureIds):
+            self._hashed_ids = feature_ids
+            self.feature_ids = hashing.UnmarkedIds(feature_ids)
+        self.features = extractors.compile_features(feature_types, locations)
+        self.set_type = set_type
+
+        # word/pos string -> integer index, and the strings in index order
+        self._word_index, self._words = {}, []
+        self._pos_index, self._poses = {}, []
+
+        # Per-word and per-pos tables of every extractor (extractor -> a list of
+        # arrays, one per position of its word_values/pos_values), grown as new
+        # words and tags show up, and how many words and tags they hold
+        self._word_tables, self._table_words = {}, 0
+        self._pos_tables, self._table_poses = {}, 0
+
+    # Forgets every word and its table rows once there are more than
+    # MAX_CACHED_WORDS; the words of later batches are looked up again
+    def _bound_word_tables(self):
+        if len(self._words) > MAX_CACHED_WORDS:
+            self._word_index, self._words = {}, []
+            self._word_tables, self._table_words = {}, 0
+
+    # Returns the integer indices of values, adding unseen values to index/strings
+    def _encode(self, values, index, strings):
+        new_values = [value for value in dict.fromkeys(values) if value not in index]
+        index.update(zip(new_values, range(len(strings), len(strings) + len(new_values))))
+        strings.extend(new_values)
+        return np.array(list(map(index.__getitem__, values)), np.int64)
+
+    # Fills in the per-word tables for the words added since the last batch
+    def _grow_word_tables(self):
+        if self._table_words < len(self._words):
+            self._word_tables = self._grown_tables(self._word_tables, "word_values",
+                                                   self._words[self._table_words:])
+            self._table_words = len(self._words)
+
+    # Fills in the per-pos tables for the pos tags added since the last batch
+    def _grow_pos_tables(self):
+        if self._table_poses < len(self._poses):
+            self._pos_tables = self._grown_tables(self._pos_tables, "pos_values",
+                                                  self._poses[self._table_poses:])
+            self._table_poses = len(self._poses)
+
+    # Returns new tables with the rows of new_values added, from each extractor's
+    # word_values or pos_values (hook_name). Nothing is changed until every new
+    # value has been looked up
+    def _grown_tables(self, tables, hook_name, new_values):
+        grown = {}
+        for extractor in self.features.extractors:
+            hook = getattr(extractor, hook_name)
+            rows = [hook(value, self.feature_ids, self.set_type) for value in new_values]
+            columns = [_table_column(column) for column in zip(*rows)]
+            if extractor in tables:
+                columns = [np.concatenate([table, column]) for table, column in zip(tables[extractor], columns)]
+            grown[extractor] = columns
+        return grown
+
+    # Encodes one corpus.SentenceBlock. Returns the label codes and the ArrayBatch
+    # of its tokens
+    def _encode_block(self, block):
+        label_codes = np.frombuffer(block.labels, np.int8).astype(np.int64)
+        if (label_codes == corpus.BAD_LABEL).any():
+            raise Exception("Received a bad BIO label!")
+        self._bound_word_tables()
+        # Only the block's distinct words and pos tags are looked up
+        word_codes = self._encode(block.word_names, self._word_index, self._words)
+        pos_codes = self._encode(block.pos_names, self._pos_index, self._poses)
+        return label_codes, self._finish_encoding(word_codes[np.frombuffer(block.word_codes, np.intc)],
+                                                  pos_codes[np.frombuffer(block.pos_codes, np.intc)],
+                                                  np.frombuffer(block.starts, np.int64))
+
+    # Encodes the tokens of one batch, given as lists of strings, into an ArrayBatch
+    def _encode_tokens(self, poses, words, lengths):
+        self._bound_word_tables()
+        starts = np.zeros(len(lengths) + 1, np.int64)
+        np.cumsum(lengths, out=starts[1:])
+        return self._finish_encoding(self._encode(words, self._word_index, self._words),
+                                     self._encode(poses, self._pos_index, self._poses), starts)
+
+    # Grows the tables for the words and pos tags just encoded, and returns the
+    # ArrayBatch of the word and pos indices, given the sentence offsets (as in
+    # corpus.SentenceBlock.starts)
+    def _finish_encoding(self, word_codes, pos_codes, starts):
+        try:
+            self._grow_word_tables()
+            self._grow_pos_tables()
+        except Exception:
+            # Forget the values the tables couldn't be grown for (a word that
+            # isn't a string, say), so later batches don't run into them again
+            _truncate(self._word_index, self._words, self._table_words)
+            _truncate(self._pos_index, self._poses, self._table_poses)
+            raise
+        first = np.zeros(len(word_codes), bool)
+        first[starts[:-1]] = True
+        last = np.zeros(len(word_codes), bool)
+        last[starts[1:] - 1] = True
+        return ArrayBatch(self, word_codes, pos_codes, first, last)
+
+    # Returns the sorted feature matrix (see feature_matrix) of unlabeled tokens,
+    # given as the pos tags and words of all the sentences one after another and
+    # the length of each sentence
+    def unlabeled_matrix(self, poses, words, lengths):
+        return self.feature_matrix(self._encode_tokens(poses, words, lengths))
+
+    # Number of distinct words remembered (each one has a row in the tables)
+    def num_words(self):
+        return len(self._words)
+
+    # Returns the feature id columns of one ArrayBatch by feature type: a dict
+    # from each active feature type, in registry order, to the list of arrays of
+    # its extractor's array_ids. 0 marks a feature that doesn't fire
+    def feature_columns(self, batch):
+        return {extractor.name: extractor.array_ids(batch, self.feature_ids)
+                for extractor in self.features.extractors}
+
+    # Returns the (tokens x features) matrix of feature ids for one ArrayBatch,
+    # each row sorted in ascending order. 0 marks a feature that doesn't fire
+    def feature_matrix(self, batch):
+        columns = self.feature_columns(batch)
+        matrix = sorted_matrix([column for type_columns in columns.values() for column in type_columns])
+        if self._hashed_ids is not None:
+            self._hashed_ids.mark_ids(np.unique(matrix).tolist())
+        return matrix
+
+    # Returns the label codes and the feature_columns of one corpus.SentenceBlock
+    def labeled_columns(self, block):
+        label_codes, batch = self._encode_block(block)
+        return label_codes, self.feature_columns(batch)
+
+    # Returns the .readable text for one ArrayBatch
+    def _readable_text(self, batch):
+        lines = batch.texts("")
+        text = "" # constant text still to be added to every line
+        for prefix, extractor in self.features.readable_lines:
+            if extractor is None:
+                text += prefix + "n/a\n"
+            else:
+                lines = lines + (text + prefix) + extractor.array_readable(batch, self.feature_ids, self.set_type)
+                text = "\n"
+        return "".join((lines + (text + "\r\n")).tolist())
+
+    # Vectorizes every sentence of the open input_file, writing to readable_file
+    # and vector_file (each may be None), and appending the rows to csr_writer
+    # (a csr.CsrWriter or csr.CsrBatches) if one is given
+    def write_files(self, input_file, readable_file, vector_file, csr_writer=None):
+        recorder = instrument.active
+        for block in corpus.read_blocks(input_file):
+            label_codes, batch = self._encode_block(block)
+            if readable_file is not None:
+                if recorder is not None:
+                    started = recorder.clock()
+                readable_file.write(self._readable_text(batch))
+                if recorder is not None:
+                    recorder.add_time("write_readable", started)
+            if recorder is not None:
+                started = recorder.clock()
+            matrix = self.feature_matrix(batch)
+            if vector_file is not None:
+                vector_file.write(vector_text(label_codes, matrix))
+            if csr_writer is not None:
+                csr_writer.append_matrix(label_codes, matrix)
+            if recorder is not None:
+                recorder.add_time("write_vector", started)
+                recorder.count_matrix(len(block), matrix)
+
+# The tokens of one batch as the extractors' array hooks see them (see
+# extractors.py): their word and pos indices into the vectorizer's tables, and
+# masks of the first and last token of every sentence
+class ArrayBatch:
+    def __init__(self, vectorizer, word_codes, pos_codes, first, last):
+        self._vectorizer = vectorizer
+        self.word_codes = word_codes
+        self.pos_codes = pos_codes
+        self.first = first
+        self.last = last
+
+    # Number of tokens
+    def __len__(self):
+        return len(self.word_codes)
+
+    # Returns position k of extractor's word_values (or pos_values) for every token
+    def words(self, extractor, k):
+        return self._vectorizer._word_tables[extractor][k][self.word_codes]
+
+    def poses(self, extractor, k):
+        return self._vectorizer._pos_tables[extractor][k][self.pos_codes]
+
+    # Returns the value of the token before (or after) every token, or boundary
+    # for the first (or last) token of a sentence
+    def previous(self, column, boundary):
+        return np.where(self.first, boundary, np.roll(column, 1))
+
+    def following(self, column, boundary):
+        return np.where(self.last, boundary, np.roll(column, -1))
+
+    # Returns value for every token where mask is true and other elsewhere; the
+    # values may be ids or readable texts
+    def where(self, mask, value, other=0):
+        if isinstance(value, str):
+            return np.array([other, value], dtype=object)[mask.astype(np.int64)]
+        return np.where(mask, value, other)
+
+    # Returns a column of ids that are all 0, or of texts that are all text
+    def zeros(self):
+        return np.zeros(len(self), np.int64)
+
+    def texts(self, text):
+        return np.full(len(self), text, dtype=object)
+
+    # Returns the (start, end) token positions of every sentence, end excluded
+    def sentences(self):
+        return list(zip(np.flatnonzero(self.first).tolist(), (np.flatnonzero(self.last) + 1).tolist()))
+
+# Stacks columns of feature ids (one id per token each) into a (tokens x
+# features) matrix with every row sorted in ascending order
+def sorted_matrix(columns):
+    matrix = np.column_stack(columns)
+    matrix.sort(axis=1)
+
+    # With feature hashing two features of a token can share an id; keep one
+    duplicates = matrix[:, 1:] == matrix[:, :-1]
+    if duplicates.any():
+        matrix[:, 1:][duplicates] = 0
+        matrix.sort(axis=1)
+    return matrix
+
+# Returns the .vector text of a batch of rows, given their label codes and
+# their sorted feature matrix
+def vector_text(label_codes, matrix):
+    unique_ids, inverse = np.unique(matrix, return_inverse=True)
+    id_texts = np.array([("%d:1 " % feature_id) if feature_id else ""
+                         for feature_id in unique_ids.tolist()], dtype=object)
+    cells = id_texts[inverse.reshape(matrix.shape)]
+    lines = _LABEL_TEXTS[label_codes]
+    for column in range(matrix.shape[1]):
+        lines = lines + cells[:, column]
+    return "".join((lines + "\n").tolist())
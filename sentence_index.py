@@ -0,0 +1,132 @@
+# Sentence offset index of an input file (<input>.index), so that single
+# sentences can be read and shown without scanning the file ("ner.py show").
+#
+# A sentence is what ner.py vectorizes: a run of non-blank lines ended by a
+# blank line (a trailing sentence without one is not vectorized and not
+# indexed). The index holds the byte offset of every sentence's first line and
+# the running token count, so the sentence of the t-th token (the t-th line of
+# the .vector file) is found by binary search.
+#
+# Layout (all integers little-endian uint64):
+#           magic "NERIDX01"
+#           size and mtime (ns) of the input file when it was indexed
+#           number of sentences n
+#           offsets[n]          byte offset of each sentence
+#           first_tokens[n + 1] number of tokens before each sentence, then the total
+#
+# An index whose size and mtime don't match its input file is stale.
+
+import bisect
+import locale
+import mmap
+import os
+import struct
+
+import corpus
+import fileio
+
+MAGIC = b"NERIDX01"
+_HEADER = struct.Struct("<8s3Q")
+
+# Bytes that str.strip() removes and that can't be part of a UTF-8 sequence
+_ASCII_WHITESPACE = b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f"
+
+# Text files are read with the locale's encoding, as open() does in ner.py
+_ENCODING = locale.getpreferredencoding(False)
+
+# True for a line that ner.py treats as a sentence break (line.strip() is empty)
+def _is_blank(line):
+    if not line.strip(_ASCII_WHITESPACE):
+        return True
+    if line.isascii():
+        return False
+    return not line.decode(_ENCODING).strip() # non-ASCII whitespace such as U+00A0
+
+# Writes the index of input_file_str to index_file_str
+def build_index(input_file_str, index_file_str):
+    if not fileio.is_seekable(input_file_str):
+        raise Exception("Only uncompressed files can be indexed, not " + input_file_str + "!")
+    stat = os.stat(input_file_str)
+    offsets = []
+    first_tokens = [0]
+    position = 0
+    start = 0
+    num_tokens = 0 # tokens of the current sentence
+    input_file = open(input_file_str, "rb", buffering=fileio.BUFFER_BYTES)
+    for line in input_file:
+        if _is_blank(line):
+            if num_tokens != 0:
+                offsets.append(start)
+                first_tokens.append(first_tokens[-1] + num_tokens)
+                num_tokens = 0
+        else:
+            if num_tokens == 0:
+                start = position
+            num_tokens += 1
+        position += len(line)
+    input_file.close()
+
+    index_file = open(index_file_str, "wb")
+    index_file.write(_HEADER.pack(MAGIC, stat.st_size, stat.st_mtime_ns, len(offsets)))
+    index_file.write(struct.pack("<%dQ" % len(offsets), *offsets))
+    index_file.write(struct.pack("<%dQ" % len(first_tokens), *first_tokens))
+    index_file.close()
+
+# A memory-mapped index. Sentences and tokens are numbered from 0
+class SentenceIndex:
+    def __init__(self, index_file_str):
+        index_file = open(index_file_str, "rb")
+        self._mapping = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        index_file.close()
+        magic, self.input_size, self.input_mtime_ns, count = _HEADER.unpack_from(self._mapping)
+        if magic != MAGIC:
+            raise Exception(index_file_str + " is not a sentence index!")
+        view = memoryview(self._mapping)
+        self._offsets = view[_HEADER.size:_HEADER.size + 8 * count].cast("Q")
+        self._first_tokens = view[_HEADER.size + 8 * count:_HEADER.size + 8 * (2 * count + 1)].cast("Q")
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def num_tokens(self):
+        return self._first_tokens[-1]
+
+    def offset(self, k):
+        return self._offsets[k]
+
+    def first_token(self, k):
+        return self._first_tokens[k]
+
+    # Returns the first token of every sentence and the total, as a uint64 memoryview
+    def first_tokens(self):
+        return self._first_tokens
+
+    # Returns the number of the sentence holding token t
+    def sentence_of_token(self, t):
+        return bisect.bisect_right(self._first_tokens, t) - 1
+
+    # True if input_file_str has changed since it was indexed
+    def is_stale(self, input_file_str):
+        stat = os.stat(input_file_str)
+        return stat.st_size != self.input_size or stat.st_mtime_ns != self.input_mtime_ns
+
+# Returns the SentenceIndex of input_file_str from index_file_str, building
+# (or rebuilding) the index file first if it is missing or stale
+def load_index(input_file_str, index_file_str):
+    if os.path.exists(index_file_str):
+        index = SentenceIndex(index_file_str)
+        if not index.is_stale(input_file_str):
+            return index
+    build_index(input_file_str, index_file_str)
+    return SentenceIndex(index_file_str)
+
+# Returns sentence k of the open (binary) input_file as a corpus.Sentence, like
+# the sentences ner.py reads
+def read_sentence(input_file, index, k):
+    input_file.seek(index.offset(k))
+    tokens = []
+    for line in input_file:
+        if _is_blank(line):
+            break
+        tokens.append(line.decode(_ENCODING).split())
+    return corpus.Sentence.from_tokens(tokens)
@@ -0,0 +1,307 @@
+# Long-running NER tagging server. The vocabulary (from "ner.py build-vocab") and
+# the model (from "ner.py train") are loaded once at startup, and every request
+# then only pays for its own feature extraction and scoring. Requires numpy.
+#
+# Protocol (HTTP/1.1 over TCP, or over a Unix socket with --unix):
+#   POST /tag    {"sentences": [[["EU", "NNP"], ["rejects", "VBZ"], ...], ...]}
+#                -> {"labels": [["B-ORG", "O", ...], ...],
+#                    "entities": [[[0, 1, "ORG"], ...], ...]}
+#                Each token is [word, pos tag]; each entity is [start, end, type]
+#                with token positions in its sentence (end excluded).
+#   GET /stats   request/sentence/token counters, throughput, batch sizes and
+#                p50/p99 request latency
+#
+# Requests are handled by a pool of threads (ThreadingHTTPServer). Each handler
+# thread puts its sentences on a queue and waits; a single batching thread takes
+# everything that arrives within --max-wait-ms (up to --max-batch tokens) and runs
+# it through the numpy feature extractor, the classifier and the Viterbi decoder
+# (decoding.py; --decode argmax labels every token on its own instead) as one
+# batch, so concurrent requests share the per-batch costs.
+
+import collections
+import http.server
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+import numpy as np
+
+import classifier
+import decoding
+import numpy_engine
+import vocabfile
+
+MAX_BATCH_TOKENS = 8192
+MAX_WAIT_MS = 2.0
+
+# How many recent request latencies the percentiles are computed over
+LATENCY_WINDOW = 10000
+
+# One /tag request waiting for its labels
+class _PendingRequest:
+    def __init__(self, sentences):
+        self.sentences = sentences
+        self.tokens = sum(len(sentence) for sentence in sentences)
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+# Counters for /stats. Updated by the batching thread and the handler threads
+class ServerStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.sentences = 0
+        self.tokens = 0
+        self.batches = 0
+        self.errors = 0
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def record_batch(self, requests):
+        with self._lock:
+            self.batches += 1
+            for request in requests:
+                self.sentences += len(request.sentences)
+                self.tokens += request.tokens
+
+    def record_request(self, latency, failed):
+        with self._lock:
+            self.requests += 1
+            self.errors += failed
+            self._latencies.append(latency)
+
+    def report(self):
+        with self._lock:
+            uptime = time.time() - self.started
+            latencies = np.array(self._latencies)
+            report = {
+                "uptime_seconds": uptime,
+                "requests": self.requests,
+                "errors": self.errors,
+                "sentences": self.sentences,
+                "tokens": self.tokens,
+                "batches": self.batches,
+                "requests_per_second": self.requests / uptime,
+                "tokens_per_second": self.tokens / uptime,
+                "mean_requests_per_batch": self.requests / self.batches if self.batches else 0.0,
+                "latency_ms_p50": None,
+                "latency_ms_p99": None,
+            }
+        if len(latencies):
+            report["latency_ms_p50"] = float(np.percentile(latencies, 50)) * 1000
+            report["latency_ms_p99"] = float(np.percentile(latencies, 99)) * 1000
+        return report
+
+# Raises an Exception unless sentences is a list of sentences, each a list of
+# [word, pos] tokens of two non-blank strings, so a bad request fails before it
+# is batched
+def _check_sentences(sentences):
+    if not isinstance(sentences, list):
+        raise Exception("Expected a list of sentences!")
+    for sentence in sentences:
+        if not isinstance(sentence, list):
+            raise Exception("Expected a sentence as a list of tokens, got " + json.dumps(sentence) + "!")
+        for token in sentence:
+            if not (isinstance(token, list) and len(token) == 2
+                    and isinstance(token[0], str) and isinstance(token[1], str)):
+                raise Exception("Expected a token as [word, pos tag] strings, got " + json.dumps(token) + "!")
+            if not (token[0].strip() and token[1].strip()):
+                raise Exception("Expected a token with a non-blank word and pos tag, got "
+                                + json.dumps(token) + "!")
+
+# Loads the vocabulary and model, and tags batches of sentences. decode is
+# "viterbi" or "argmax", as in "ner.py predict"
+class Tagger:
+    def __init__(self, vocab_file_str, model_file_str, decode="viterbi"):
+        self.feature_ids, self.feature_types, self.locations = vocabfile.load_vocabulary(vocab_file_str)
+        self.model = classifier.load_model(model_file_str)
+        self.decode = decode
+        self._new_vectorizer()
+
+    def _new_vectorizer(self):
+        self._vectorizer = numpy_engine.ArrayVectorizer(self.feature_ids, self.feature_types,
+                                                        self.locations, "test")
+
+    # Returns (BIO labels, entity spans) for each sentence (a list of [word, pos]
+    # tokens); the spans are (start, end, type) triples
+    def tag(self, sentences):
+        lengths = [len(sentence) for sentence in sentences if sentence]
+        if not lengths:
+            return [([], []) for sentence in sentences]
+        words = [token[0] for sentence in sentences for token in sentence]
+        poses = [token[1] for sentence in sentences for token in sentence]
+
+        # The vectorizer bounds its own memory (numpy_engine.MAX_CACHED_WORDS)
+        matrix = self._vectorizer.unlabeled_matrix(poses, words, lengths)
+        scores = self.model.dense_scores(matrix)
+        if self.decode == "viterbi":
+            predicted = decoding.decode(scores, lengths, self.model.start, self.model.transitions)
+        else:
+            predicted = scores.argmax(axis=1)
+        spans = iter(decoding.entity_spans(predicted, lengths))
+        predicted = predicted.tolist()
+
+        results = []
+        start = 0
+        for sentence in sentences:
+            labels = [numpy_engine.LABELS[label] for label in predicted[start:start + len(sentence)]]
+            results.append((labels, next(spans) if sentence else []))
+            start += len(sentence)
+        return results
+
+# Takes pending requests off the queue and tags them in micro-batches
+class Batcher(threading.Thread):
+    def __init__(self, tagger, stats, max_batch_tokens=MAX_BATCH_TOKENS, max_wait_ms=MAX_WAIT_MS):
+        threading.Thread.__init__(self, daemon=True)
+        self.tagger = tagger
+        self.stats = stats
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+
+    # Called from a handler thread: tags the sentences in the next batch and
+    # waits for the result, a Tagger.tag list
+    def submit(self, sentences):
+        request = _PendingRequest(sentences)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            tokens = batch[0].tokens
+            deadline = time.monotonic() + self.max_wait
+            while tokens < self.max_batch_tokens:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                tokens += request.tokens
+            self._tag_batch(batch)
+
+    def _tag_batch(self, batch):
+        sentences = [sentence for request in batch for sentence in request.sentences]
+        try:
+            results = self.tagger.tag(sentences)
+        except Exception as error:
+            # Tag the requests one by one, so one bad request doesn't fail the others
+            if len(batch) > 1:
+                for request in batch:
+                    self._tag_batch([request])
+                return
+            batch[0].error = error
+            batch[0].done.set()
+            return
+
+        self.stats.record_batch(batch)
+        start = 0
+        for request in batch:
+            request.results = results[start:start + len(request.sentences)]
+            start += len(request.sentences)
+            request.done.set()
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, so clients can reuse connections
+
+    # Responses are buffered and flushed by _send_json, so the headers and the
+    # body go out in one write, and TCP connections don't wait for Nagle's
+    # algorithm (a keep-alive client would otherwise stall ~40 ms per request)
+    wbufsize = 1 << 16
+
+    def setup(self):
+        self.disable_nagle_algorithm = self.request.family != socket.AF_UNIX
+        http.server.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send_json(200, self.server.stats.report())
+        else:
+            self._send_json(404, {"error": "unknown path " + self.path})
+
+    def do_POST(self):
+        if self.path != "/tag":
+            self._send_json(404, {"error": "unknown path " + self.path})
+            return
+        started = time.perf_counter()
+        failed = False
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            _check_sentences(body["sentences"])
+            results = self.server.batcher.submit(body["sentences"])
+            self._send_json(200, {"labels": [labels for labels, spans in results],
+                                  "entities": [[list(span) for span in spans] for labels, spans in results]})
+        except Exception as error:
+            failed = True
+            self._send_json(400, {"error": str(error)})
+        # The latency includes sending the response, which _send_json flushes
+        self.server.stats.record_request(time.perf_counter() - started, failed)
+
+    def _send_json(self, status, value):
+        body = json.dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    # Unix socket clients have no address to log
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class TaggingServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, tagger, max_batch_tokens=MAX_BATCH_TOKENS, max_wait_ms=MAX_WAIT_MS,
+                 verbose=False):
+        self.stats = ServerStats()
+        self.batcher = Batcher(tagger, self.stats, max_batch_tokens, max_wait_ms)
+        self.verbose = verbose
+        http.server.ThreadingHTTPServer.__init__(self, address, _RequestHandler)
+        self.batcher.start()
+
+class UnixTaggingServer(TaggingServer):
+    address_family = socket.AF_UNIX
+
+    # HTTPServer.server_bind expects a (host, port) address
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+# Loads the vocabulary and model and serves until interrupted. If unix_socket_str
+# is given, listens on that Unix socket instead of host:port
+def serve(vocab_file_str, model_file_str, host="127.0.0.1", port=8000, unix_socket_str=None,
+          max_batch_tokens=MAX_BATCH_TOKENS, max_wait_ms=MAX_WAIT_MS, verbose=False, decode="viterbi"):
+    tagger = Tagger(vocab_file_str, model_file_str, decode)
+    if unix_socket_str is not None:
+        server = UnixTaggingServer(unix_socket_str, tagger, max_batch_tokens, max_wait_ms, verbose)
+        print("Serving on unix socket " + unix_socket_str)
+    else:
+        server = TaggingServer((host, port), tagger, max_batch_tokens, max_wait_ms, verbose)
+        print("Serving on http://%s:%d" % (host, server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
@@ -0,0 +1,84 @@
+# Checks decoding.decode against a brute-force search over every valid BIO
+# label sequence of short sentences with random scores, and entity_spans on
+# hand-written label sequences.
+
+import importlib.util
+import itertools
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+if HAS_NUMPY:
+    import numpy as np
+
+    import decoding
+
+# Returns the label code of every label name in names
+def _codes(names):
+    return [decoding.LABELS.index(name) for name in names]
+
+# Returns the best-scoring valid label sequence of one sentence's scores by
+# trying them all: an I-X label has to follow B-X or I-X
+def _brute_force(scores, start, transitions):
+    best_labels, best_score = None, -np.inf
+    for labels in itertools.product(range(decoding.NUM_LABELS), repeat=len(scores)):
+        names = [decoding.LABELS[code] for code in labels]
+        valid = all(not name.startswith("I-") or (i > 0 and names[i-1][2:] == name[2:])
+                    for i, name in enumerate(names))
+        if not valid:
+            continue
+        score = start[labels[0]] + sum(scores[i, code] for i, code in enumerate(labels))
+        score += sum(transitions[labels[i-1], labels[i]] for i in range(1, len(labels)))
+        if score > best_score:
+            best_labels, best_score = list(labels), score
+    return best_labels
+
+@unittest.skipUnless(HAS_NUMPY, "decoding needs numpy")
+class DecodeTest(unittest.TestCase):
+    def _check(self, rng, start, transitions, batch_tokens):
+        lengths = [int(length) for length in rng.integers(1, 5, size=12)]
+        scores = rng.normal(size=(sum(lengths), decoding.NUM_LABELS))
+        labels = decoding.decode(scores, lengths, start, transitions, batch_tokens=batch_tokens)
+        expected = []
+        first = 0
+        for length in lengths:
+            expected += _brute_force(scores[first:first + length], start, transitions)
+            first += length
+        self.assertEqual(labels.tolist(), expected)
+
+    def test_bio_transitions(self):
+        rng = np.random.default_rng(1)
+        start, transitions = decoding.bio_transitions()
+        for trial in range(5):
+            self._check(rng, start, transitions, decoding.BATCH_TOKENS)
+
+    def test_learned_transitions_in_small_batches(self):
+        rng = np.random.default_rng(2)
+        allowed_start, allowed = decoding.bio_transitions()
+        for trial in range(5):
+            start = rng.normal(size=decoding.NUM_LABELS) + allowed_start
+            transitions = rng.normal(size=(decoding.NUM_LABELS, decoding.NUM_LABELS)) + allowed
+            self._check(rng, start, transitions, 8)
+
+@unittest.skipUnless(HAS_NUMPY, "decoding needs numpy")
+class EntitySpansTest(unittest.TestCase):
+    def test_hand_written_sequences(self):
+        sentences = [["B-PER", "I-PER", "O", "B-LOC"],
+                     ["I-ORG", "I-ORG", "O", "B-PER", "B-PER", "I-LOC"],
+                     ["O", "O"],
+                     ["B-ORG", "I-PER", "I-PER", "O", "I-LOC"],
+                     ["I-LOC", "O"]]
+        labels = _codes(itertools.chain.from_iterable(sentences))
+        spans = decoding.entity_spans(labels, [len(sentence) for sentence in sentences])
+        self.assertEqual(spans, [[(0, 2, "PER"), (3, 4, "LOC")],
+                                 [(0, 2, "ORG"), (3, 4, "PER"), (4, 5, "PER"), (5, 6, "LOC")],
+                                 [],
+                                 [(0, 1, "ORG"), (1, 3, "PER"), (4, 5, "LOC")],
+                                 [(0, 1, "LOC")]])
+        self.assertEqual(decoding.format_spans(spans[1]), "0-2:ORG 3-4:PER 4-5:PER 5-6:LOC")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+# Runs ner.py on a slice of the bundled train.txt and test.txt in different
+# ways that have to write identical files: the python and the numpy engine,
+# one and several worker processes, and "ner.py ablate" against a plain run
+# with the same feature types.
+
+import importlib.util
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NER_PY = os.path.join(REPO, "ner.py")
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+
+FEATURE_TYPES = ["WORD", "WORDCON", "POS", "POSCON", "ABBR", "CAP", "LOCATION"]
+TRAIN_SENTENCES = 300
+TEST_SENTENCES = 150
+
+# Returns the first count sentences of a corpus file, with the blank line after each
+def _corpus_slice(file_str, count):
+    lines = []
+    with open(os.path.join(REPO, file_str)) as input_file:
+        for line in input_file:
+            lines.append(line)
+            if not line.strip() and lines[:-1] and lines[-2].strip():
+                count -= 1
+                if count == 0:
+                    break
+    return "".join(lines)
+
+class EngineEquivalenceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.inputs = {"train.txt": _corpus_slice("train.txt", TRAIN_SENTENCES),
+                      "test.txt": _corpus_slice("test.txt", TEST_SENTENCES)}
+        with open(os.path.join(REPO, "locs.txt")) as locations_file:
+            cls.inputs["locs.txt"] = locations_file.read()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # Runs ner.py with args in a new directory holding the input files, and
+    # returns the contents of the named output files
+    def _run(self, args, names):
+        directory = tempfile.mkdtemp(dir=self.directory)
+        for name, text in self.inputs.items():
+            with open(os.path.join(directory, name), "w") as output_file:
+                output_file.write(text)
+        result = subprocess.run([sys.executable, NER_PY] + args, cwd=directory,
+                                capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        outputs = {}
+        for name in names:
+            with open(os.path.join(directory, name), newline="") as input_file:
+                outputs[name] = input_file.read()
+        return outputs
+
+    def _pipeline(self, feature_types, options, names):
+        return self._run(["train.txt", "test.txt", "locs.txt"] + feature_types + options, names)
+
+    @unittest.skipUnless(HAS_NUMPY, "the numpy engine needs numpy")
+    def test_python_and_numpy_engines(self):
+        names = ["train.txt.vector", "test.txt.vector", "train.txt.readable", "test.txt.readable"]
+        python_outputs = self._pipeline(FEATURE_TYPES, ["--readable", "--engine", "python"], names)
+        numpy_outputs = self._pipeline(FEATURE_TYPES, ["--readable", "--engine", "numpy"], names)
+        self.assertTrue(python_outputs["train.txt.vector"])
+        self.assertEqual(python_outputs, numpy_outputs)
+
+    def test_one_and_several_workers(self):
+        names = ["train.txt.vector", "test.txt.vector", "train.txt.readable", "test.txt.readable"]
+        serial_outputs = self._pipeline(FEATURE_TYPES, ["--readable", "--workers", "1"], names)
+        parallel_outputs = self._pipeline(FEATURE_TYPES, ["--readable", "--workers", "3"], names)
+        self.assertTrue(serial_outputs["test.txt.vector"])
+        self.assertEqual(serial_outputs, parallel_outputs)
+
+    @unittest.skipUnless(HAS_NUMPY, "ablation needs numpy")
+    def test_ablate_and_single_subset_run(self):
+        feature_types = ["WORD", "POS", "CAP", "LOCATION"]
+        ablate_outputs = self._run(["ablate", "train.txt", "test.txt", "locs.txt",
+                                    "--subset", ",".join(feature_types)],
+                                   ["train.txt.WORD+POS+CAP+LOCATION.vector",
+                                    "test.txt.WORD+POS+CAP+LOCATION.vector"])
+        outputs = self._pipeline(feature_types, [], ["train.txt.vector", "test.txt.vector"])
+        self.assertEqual(ablate_outputs["train.txt.WORD+POS+CAP+LOCATION.vector"],
+                         outputs["train.txt.vector"])
+        self.assertEqual(ablate_outputs["test.txt.WORD+POS+CAP+LOCATION.vector"],
+                         outputs["test.txt.vector"])
+
+if __name__ == "__main__":
+    unittest.main()
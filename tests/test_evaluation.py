@@ -0,0 +1,99 @@
+# Checks evaluation.py: the entity and token counts of a small hand-computed
+# example, with the corpus and with its vectors as gold, and that sharding the
+# bundled test.txt predictions over worker processes gives the counts of one
+# serial pass.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NER_PY = os.path.join(REPO, "ner.py")
+sys.path.insert(0, REPO)
+
+import evaluation
+
+# (gold, predicted) labels of every sentence
+SENTENCES = [
+    # PER is correct; the LOC is predicted as ORG
+    [("B-PER", "B-PER"), ("I-PER", "I-PER"), ("O", "O"), ("B-LOC", "B-ORG")],
+    # The ORG ends one token early, so it isn't correct
+    [("B-ORG", "B-ORG"), ("I-ORG", "I-ORG"), ("I-ORG", "O"), ("O", "O")],
+    # An I-LOC that doesn't continue an entity starts one, as in conlleval
+    [("O", "O"), ("B-LOC", "I-LOC"), ("I-LOC", "I-LOC")],
+    # Entities end at sentence boundaries, so this is two PERs with corpus
+    # gold and one with vector gold, which has no boundaries
+    [("B-PER", "B-PER")],
+    [("I-PER", "I-PER"), ("O", "O")],
+]
+
+class HandComputedTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = {}
+        texts = {"gold.txt": "", "gold.txt.vector": "", "predictions.txt": ""}
+        for sentence in SENTENCES:
+            for k, (gold, predicted) in enumerate(sentence):
+                texts["gold.txt"] += gold + " NNP word" + str(k) + "\n"
+                texts["gold.txt.vector"] += str(evaluation.LABELS.index(gold)) + " 1:1\n"
+                texts["predictions.txt"] += predicted + "\n"
+            texts["gold.txt"] += "\n"
+        for name, text in texts.items():
+            self.paths[name] = os.path.join(self.directory, name)
+            with open(self.paths[name], "w") as output_file:
+                output_file.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_corpus_gold(self):
+        result = evaluation.evaluate(self.paths["predictions.txt"], self.paths["gold.txt"])
+        self.assertEqual((result.num_tokens(), result.num_correct_tokens()), (14, 11))
+        # [unused, PER, LOC, ORG]
+        self.assertEqual(result.gold_entities, [0, 3, 2, 1])
+        self.assertEqual(result.predicted_entities, [0, 3, 1, 2])
+        self.assertEqual(result.correct_entities, [0, 3, 1, 0])
+        precision, recall, f1, gold, predicted, correct = result.entity_scores()
+        self.assertEqual((gold, predicted, correct), (6, 6, 4))
+        self.assertAlmostEqual(f1, 4 / 6)
+
+    def test_vector_gold(self):
+        result = evaluation.evaluate(self.paths["predictions.txt"], self.paths["gold.txt.vector"])
+        self.assertEqual((result.num_tokens(), result.num_correct_tokens()), (14, 11))
+        self.assertEqual(result.gold_entities, [0, 2, 2, 1])
+        self.assertEqual(result.predicted_entities, [0, 2, 1, 2])
+        self.assertEqual(result.correct_entities, [0, 2, 1, 0])
+
+class WorkersTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name in ["test.txt", "test.txt.vector", "predictions.txt"]:
+            shutil.copy(os.path.join(REPO, name), self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_workers_match_serial(self):
+        predictions_file_str = os.path.join(self.directory, "predictions.txt")
+        for gold_name in ["test.txt", "test.txt.vector"]:
+            gold_file_str = os.path.join(self.directory, gold_name)
+            serial = evaluation.evaluate(predictions_file_str, gold_file_str).to_dict()
+            self.assertEqual(serial["tokens"], 12878)
+            for workers in [2, 3]:
+                self.assertEqual(evaluation.evaluate(predictions_file_str, gold_file_str, workers).to_dict(),
+                                 serial, (gold_name, workers))
+
+    def test_command_line_workers(self):
+        reports = []
+        for options in [[], ["--workers", "2"]]:
+            result = subprocess.run([sys.executable, NER_PY, "evaluate", "predictions.txt", "test.txt"] + options,
+                                    cwd=self.directory, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            reports.append(result.stdout)
+        self.assertEqual(reports[0], reports[1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+# Runs ner.py with the training file on stdin ("-"): without --single-pass or
+# --hash-bits it has to refuse, since the vocabulary pass would use up stdin and
+# leave the training vectors empty, and with --single-pass it has to write the
+# same training vectors as a run on the file itself.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+NER_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ner.py")
+
+TRAIN_TEXT = ("B-PER NNP John\nI-PER NNP Smith\nO VBZ visits\nB-LOC NNP Paris\nO . .\n\n"
+              "B-ORG NNP EU\nO VBZ rejects\nO JJ German\nO NN call\nO . .\n\n")
+TEST_TEXT = "B-PER NNP Smith\nO VBZ visits\nB-LOC NNP London\nO . .\n\n"
+LOCATIONS_TEXT = "Paris\nLondon\n"
+FEATURE_TYPES = ["WORD", "POS", "WORDCON", "ABBR", "CAP", "LOCATION"]
+
+class StdinTrainingTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name, text in [("train.txt", TRAIN_TEXT), ("test.txt", TEST_TEXT), ("locs.txt", LOCATIONS_TEXT)]:
+            with open(os.path.join(self.directory, name), "w") as output_file:
+                output_file.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _run(self, train_file_str, options):
+        with open(os.path.join(self.directory, "train.txt")) as train_file:
+            return subprocess.run([sys.executable, NER_PY, train_file_str, "test.txt", "locs.txt"]
+                                  + FEATURE_TYPES + options, stdin=train_file, cwd=self.directory,
+                                  capture_output=True, text=True)
+
+    def _read(self, name):
+        with open(os.path.join(self.directory, name)) as input_file:
+            return input_file.read()
+
+    def test_two_pass_rejects_stdin(self):
+        result = self._run("-", [])
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("needs --single-pass or --hash-bits", result.stderr)
+        self.assertEqual(result.stdout, "")
+
+    def test_single_pass_reads_stdin(self):
+        result = self._run("-", ["--single-pass"])
+        self.assertEqual(result.returncode, 0, result.stderr)
+        stdin_test_vectors = self._read("test.txt.vector")
+
+        self.assertEqual(self._run("train.txt", ["--single-pass"]).returncode, 0)
+        self.assertEqual(result.stdout, self._read("train.txt.vector"))
+        self.assertEqual(stdin_test_vectors, self._read("test.txt.vector"))
+        self.assertEqual(len(result.stdout.splitlines()), TRAIN_TEXT.count("\n") - 2)
+
+if __name__ == "__main__":
+    unittest.main()
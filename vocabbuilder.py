@@ -0,0 +1,241 @@
+# Out-of-core vocabulary construction with frequency cutoffs, for training
+# corpora whose vocabulary doesn't fit in memory, and to drop the long tail of
+# rare features. Requires numpy.
+#
+#   $ ner.py build-vocab train.txt locs.txt vocab.bin WORD WORDCON POS \
+#         --min-count 2 --top-k word=50000 --memory 1G
+#
+# 1. Counting: the training file is read like in api.build_feature_ids, but
+#    feature_ids is a KeyCounter that counts how often every key occurs and when
+#    it was first seen. Once the counts take up about --memory, they are sorted
+#    by key and spilled to a run file on disk, and counting starts over.
+# 2. Merging: the runs are k-way merged (at most MERGE_FAN_IN at a time) into
+#    one sorted file with the total count and the first sighting of every key.
+# 3. Cutoffs: per namespace (word, prev-word, next-word, pos, prev-pos, next-pos,
+#    gaz; see instrument.NAMESPACES), keys seen fewer than --min-count times are
+#    dropped, and with --top-k only the K most frequent keys are kept (the first
+#    seen wins ties). A cutoff without a namespace applies to every namespace.
+# 4. Numbering: the kept keys are numbered in the order they were first seen,
+#    followed by the indicators and pseudo features, exactly like
+#    api.build_feature_ids does; without cutoffs the vocabulary is the same. The
+#    vocabulary file is then written straight from the merged file
+#    (vocabfile.write_sorted_table).
+#
+# Memory is bounded by --memory during counting and by a few numbers per kept
+# key during numbering; the keys themselves only ever live in the run files. A
+# dropped feature falls back to its namespace's UNK id (word-UNK, prev-pos-UNKPOS,
+# ...) when vectorizing, the same as a word that isn't in the training file.
+# Dropped gaz- tags simply don't fire.
+
+import heapq
+import itertools
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import api
+import fileio
+import instrument
+import vocabfile
+
+DEFAULT_MEMORY_BYTES = 1 << 30
+
+# Rough memory cost of one counted key besides its characters: the dict slot,
+# the str object and the [count, first] list
+_ENTRY_BYTES = 200
+
+# Most run files merged at once
+MERGE_FAN_IN = 64
+
+# Stands in for the feature_ids dictionary while counting. The extractors add a
+# key with "if key not in feature_ids: feature_ids[key] = current_id[0]", so
+# "in" counts an occurrence of a key that is already there, and setting a key
+# records its first occurrence: current_id keeps growing across spills, so the
+# smallest value of a key over all runs orders keys by their first sighting
+class KeyCounter(dict):
+    def __init__(self):
+        super().__init__()
+        self.bytes = 0 # estimated memory of the counts
+
+    def __contains__(self, key, get=dict.get): # the hot path: one call per key occurrence
+        counts = get(self, key)
+        if counts is None:
+            return False
+        counts[0] += 1
+        return True
+
+    def __setitem__(self, key, first):
+        super().__setitem__(key, [1, first])
+        self.bytes += _ENTRY_BYTES + len(key)
+
+    # Writes the counts, sorted by key, to a run file and starts over
+    def spill(self, run_file_str):
+        run_file = open(run_file_str, "wb", buffering=fileio.BUFFER_BYTES)
+        for key, (count, first) in sorted((key.encode("utf-8"), counts) for key, counts in self.items()):
+            run_file.write(b"%s\t%d\t%d\n" % (key, count, first))
+        run_file.close()
+        self.clear()
+        self.bytes = 0
+
+# Yields the (key bytes, count, first) entries of a run file
+def _read_run(run_file_str):
+    run_file = open(run_file_str, "rb", buffering=fileio.BUFFER_BYTES)
+    for line in run_file:
+        key, count, first = line.split(b"\t")
+        yield key, int(count), int(first)
+    run_file.close()
+
+# Merges sorted run files into one, adding up the counts of a key and keeping
+# its first sighting
+def _merge_runs(run_file_strs, merged_file_str):
+    merged_file = open(merged_file_str, "wb", buffering=fileio.BUFFER_BYTES)
+    entries = heapq.merge(*[_read_run(run_file_str) for run_file_str in run_file_strs])
+    for key, group in itertools.groupby(entries, lambda entry: entry[0]):
+        count = 0
+        first = None
+        for entry in group:
+            count += entry[1]
+            if first is None or entry[2] < first:
+                first = entry[2]
+        merged_file.write(b"%s\t%d\t%d\n" % (key, count, first))
+    merged_file.close()
+
+# Counts the keys of every token of the training file, spilling to run files in
+# work_dir. Returns the run file names
+def _count_keys(training_file_str, features, work_dir, memory_bytes):
+    runs = []
+    counter = KeyCounter()
+    current_id = [1] # the next first-sighting number
+    training_file = fileio.open_input(training_file_str)
+    for sentence in api.read_sentences(training_file):
+        features.add_sentence(sentence, counter, current_id)
+        if counter.bytes >= memory_bytes:
+            runs.append(os.path.join(work_dir, "run%d" % len(runs)))
+            counter.spill(runs[-1])
+    training_file.close()
+    runs.append(os.path.join(work_dir, "run%d" % len(runs)))
+    counter.spill(runs[-1])
+    return runs
+
+# Merges the run files into one sorted file of total counts, in as many passes
+# of at most MERGE_FAN_IN runs as it takes. Returns its name
+def _merge_all(runs, work_dir):
+    passes = 0
+    while True:
+        passes += 1
+        merged = []
+        for k in range(0, len(runs), MERGE_FAN_IN):
+            merged.append(os.path.join(work_dir, "merge%d.%d" % (passes, k // MERGE_FAN_IN)))
+            _merge_runs(runs[k:k + MERGE_FAN_IN], merged[-1])
+            for run_file_str in runs[k:k + MERGE_FAN_IN]:
+                os.remove(run_file_str)
+        runs = merged
+        if len(runs) == 1:
+            return runs[0]
+
+# Returns the value of a cutoff for namespace from {namespace or None: value},
+# where None applies to every namespace, or default if there is neither
+def _cutoff(cutoffs, namespace, default):
+    if namespace in cutoffs:
+        return cutoffs[namespace]
+    return cutoffs.get(None, default)
+
+# Returns, for every namespace with a top-K cutoff, the (count, -first) rank of
+# its K-th most frequent key that passes min_counts, or None if it has fewer keys
+def _top_k_thresholds(merged_file_str, min_counts, top_ks):
+    heaps = {}
+    for key, count, first in _read_run(merged_file_str):
+        namespace = instrument.namespace(key.decode("utf-8"))
+        k = _cutoff(top_ks, namespace, None)
+        if k is None or count < _cutoff(min_counts, namespace, 1):
+            continue
+        heap = heaps.setdefault(namespace, [])
+        if len(heap) < k:
+            heapq.heappush(heap, (count, -first))
+        elif (count, -first) > heap[0]:
+            heapq.heapreplace(heap, (count, -first))
+    return {namespace: heap[0] if len(heap) == _cutoff(top_ks, namespace, None) else None
+            for namespace, heap in heaps.items()}
+
+# Writes the keys of the merged file that pass the cutoffs, with their first
+# sighting, to kept_file_str. Returns {namespace: [keys seen, keys kept]}
+def _apply_cutoffs(merged_file_str, kept_file_str, min_counts, top_ks):
+    thresholds = {}
+    if top_ks:
+        thresholds = _top_k_thresholds(merged_file_str, min_counts, top_ks)
+    sizes = {}
+    kept_file = open(kept_file_str, "wb", buffering=fileio.BUFFER_BYTES)
+    for key, count, first in _read_run(merged_file_str):
+        namespace = instrument.namespace(key.decode("utf-8"))
+        size = sizes.setdefault(namespace, [0, 0])
+        size[0] += 1
+        if count < _cutoff(min_counts, namespace, 1):
+            continue
+        threshold = thresholds.get(namespace)
+        if threshold is not None and (count, -first) < threshold:
+            continue
+        size[1] += 1
+        kept_file.write(b"%s\t%d\n" % (key, first))
+    kept_file.close()
+    return sizes
+
+# Yields the (key bytes, first) entries of the kept file
+def _read_kept(kept_file_str):
+    kept_file = open(kept_file_str, "rb", buffering=fileio.BUFFER_BYTES)
+    for line in kept_file:
+        key, first = line.split(b"\t")
+        yield key, int(first)
+    kept_file.close()
+
+# Builds the vocabulary of the training file for features (an
+# extractors.CompiledFeatures) out of core, keeping only the keys that pass the
+# cutoffs, and saves it to vocab_file_str like vocabfile.save_vocabulary.
+# min_counts and top_ks map a namespace ("word", "prev-pos", ...) or None (every
+# namespace) to a cutoff. Temporary files go to a directory next to
+# vocab_file_str. Returns {namespace: [keys seen, keys kept]}
+def build_vocabulary(training_file_str, features, vocab_file_str, min_counts=None, top_ks=None,
+                     memory_bytes=DEFAULT_MEMORY_BYTES):
+    work_dir = tempfile.mkdtemp(prefix=".vocab-", dir=os.path.dirname(os.path.abspath(vocab_file_str)))
+    try:
+        with instrument.stage("count_features"):
+            runs = _count_keys(training_file_str, features, work_dir, memory_bytes)
+        with instrument.stage("merge_counts"):
+            merged_file_str = _merge_all(runs, work_dir)
+            kept_file_str = os.path.join(work_dir, "kept")
+            sizes = _apply_cutoffs(merged_file_str, kept_file_str, min_counts or {}, top_ks or {})
+            os.remove(merged_file_str)
+
+        with instrument.stage("save_vocabulary"):
+            # Number the kept keys by first sighting: ids[i] is the id of the
+            # i-th kept key in key order
+            firsts = np.fromiter((first for key, first in _read_kept(kept_file_str)), np.int64)
+            ids = np.empty(len(firsts), np.int64)
+            ids[np.argsort(firsts, kind="stable")] = np.arange(1, len(firsts) + 1)
+            del firsts
+
+            # Indicators and pseudo features come after every kept key, as in
+            # api.build_feature_ids; like there, one of them replaces a kept key of
+            # the same name (the word "UNK" gives "word-UNK"), whose id stays unused
+            fixed_ids = {}
+            features.finish_vocabulary(fixed_ids, [len(ids) + 1])
+            fixed = sorted((key.encode("utf-8"), feature_id) for key, feature_id in fixed_ids.items())
+            fixed_keys = set(key for key, feature_id in fixed)
+
+            def items():
+                kept = ((key, feature_id) for (key, first), feature_id
+                        in zip(_read_kept(kept_file_str), ids.tolist()) if key not in fixed_keys)
+                return heapq.merge(kept, fixed)
+            vocabfile.save_sorted_vocabulary(vocab_file_str, items, features.feature_types,
+                                             features.locations)
+    finally:
+        shutil.rmtree(work_dir)
+    return sizes
+
+# Returns a one-line summary of build_vocabulary's sizes
+def format_sizes(sizes):
+    seen = sum(size[0] for size in sizes.values())
+    kept = sum(size[1] for size in sizes.values())
+    return "Vocabulary: kept %d of %d features (%s)" % (kept, seen, ", ".join(
+        "%s %d of %d" % (namespace, size[1], size[0]) for namespace, size in sorted(sizes.items())))
@@ -0,0 +1,203 @@
+# Saves a feature vocabulary to disk, and memory-maps it back, so that test sets
+# and new documents can be vectorized without re-reading the training data.
+#
+# A vocabulary file holds three string tables: the feature ids ("word-Israel" -> 17),
+# the feature types it was built with, and the locations (gazetteer). Each table
+# stores its strings sorted by their UTF-8 bytes, one after another in a blob, with
+# an array of start offsets in front. Keys are found by binary search directly in
+# the mapped file, so loading is just an mmap and nothing is copied into a dict.
+#
+# Layout (all integers little-endian, sections aligned to 8 bytes):
+#           magic "NERVOC01"
+#           3 x (count, offsets position, blob position, values position)  uint64
+#           per table: offsets uint64[count + 1], blob bytes, values uint32[count]
+#
+# The values position is 0 for tables without values (feature types, locations).
+#
+# When the locations are a compiled gazetteer (gazetteer.py), the file starts
+# with "NERVOC02" instead, the locations table is empty, and the header is
+# followed by the position and size of a copy of the gazetteer (uint64 each),
+# which is mapped along with the rest of the file.
+
+import mmap
+import struct
+
+MAGIC = b"NERVOC01"
+MAGIC_WITH_GAZETTEER = b"NERVOC02"
+SECTION = struct.Struct("<4Q")
+_HEADER_SIZE = len(MAGIC) + 3 * SECTION.size
+_GAZETTEER = struct.Struct("<2Q")
+
+# Read-only view of one sorted string table inside a mapped vocabulary file.
+# Supports the parts of the dict/set interface the feature code uses: "in",
+# [key], get, len and iteration over the keys in sorted order.
+# mapping is the mmap object (slicing it gives bytes that can be compared),
+# view a memoryview over it that the offset and value arrays are cast from
+class MappedStringTable:
+    def __init__(self, mapping, view, count, offsets_pos, blob_pos, values_pos):
+        self._buffer = mapping
+        self._count = count
+        self._offsets = view[offsets_pos:offsets_pos + 8 * (count + 1)].cast("Q")
+        self._blob_pos = blob_pos
+        self._values = None
+        if values_pos:
+            self._values = view[values_pos:values_pos + 4 * count].cast("I")
+
+    def __len__(self):
+        return self._count
+
+    # Returns the bytes of the i-th key in sorted order
+    def _key_at(self, i):
+        start = self._blob_pos + self._offsets[i]
+        end = self._blob_pos + self._offsets[i + 1]
+        return self._buffer[start:end]
+
+    # Returns the index of key in the table, or -1 if it isn't there.
+    # This is the hot path of every lookup, so _key_at is inlined
+    def _find(self, key):
+        key = key.encode("utf-8")
+        buffer, offsets, blob_pos = self._buffer, self._offsets, self._blob_pos
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) >> 1
+            if buffer[blob_pos + offsets[middle]:blob_pos + offsets[middle + 1]] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and buffer[blob_pos + offsets[low]:blob_pos + offsets[low + 1]] == key:
+            return low
+        return -1
+
+    def __contains__(self, key):
+        return self._find(key) != -1
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        if i == -1:
+            raise KeyError(key)
+        return self._values[i]
+
+    def get(self, key, default=None):
+        i = self._find(key)
+        if i == -1:
+            return default
+        return self._values[i]
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._key_at(i).decode("utf-8")
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for i, key in enumerate(self):
+            yield key, self._values[i]
+
+
+# Pads the output with zero bytes up to the next multiple of 8
+def align(out):
+    out.write(b"\0" * (-out.tell() % 8))
+
+# Writes one sorted string table and returns its section descriptor
+def write_table(out, strings, values=None):
+    keys = sorted(string.encode("utf-8") for string in strings)
+    if values is None:
+        items = [(key, None) for key in keys]
+    else:
+        items = [(key, values[key.decode("utf-8")]) for key in keys]
+    return write_sorted_table(out, lambda: iter(items), values is not None)
+
+# How many offsets or values write_sorted_table packs at once
+_CHUNK = 65536
+
+# Writes a string table from (key bytes, value) pairs that are already sorted by
+# key, and returns its section descriptor. items is a function returning a new
+# iterator over the pairs: the offsets, the blob and the values are written in
+# three passes, so the keys never have to be in memory all at once
+def write_sorted_table(out, items, with_values=True):
+    align(out)
+    offsets_pos = out.tell()
+    count = 0
+    offset = 0
+    offsets = [0]
+    for key, value in items():
+        count += 1
+        offset += len(key)
+        offsets.append(offset)
+        if len(offsets) == _CHUNK:
+            out.write(struct.pack("<%dQ" % len(offsets), *offsets))
+            offsets = []
+    out.write(struct.pack("<%dQ" % len(offsets), *offsets))
+    blob_pos = out.tell()
+    keys = []
+    for key, value in items():
+        keys.append(key)
+        if len(keys) == _CHUNK:
+            out.write(b"".join(keys))
+            keys = []
+    out.write(b"".join(keys))
+    values_pos = 0
+    if with_values:
+        align(out)
+        values_pos = out.tell()
+        values = []
+        for key, value in items():
+            values.append(value)
+            if len(values) == _CHUNK:
+                out.write(struct.pack("<%dI" % len(values), *values))
+                values = []
+        out.write(struct.pack("<%dI" % len(values), *values))
+    return (count, offsets_pos, blob_pos, values_pos)
+
+# Saves the feature_ids dictionary, the feature types and the locations (a set
+# of names or a gazetteer.Gazetteer) to a vocabulary file at vocab_file_str
+def save_vocabulary(vocab_file_str, feature_ids, feature_types, locations):
+    items = sorted((key.encode("utf-8"), feature_ids[key]) for key in feature_ids.keys())
+    save_sorted_vocabulary(vocab_file_str, lambda: iter(items), feature_types, locations)
+
+# Like save_vocabulary, with the feature ids given as a function returning a new
+# iterator over (key bytes, id) pairs sorted by key (see write_sorted_table)
+def save_sorted_vocabulary(vocab_file_str, feature_id_items, feature_types, locations):
+    import gazetteer
+    embedded = isinstance(locations, gazetteer.Gazetteer)
+    header_size = _HEADER_SIZE + (_GAZETTEER.size if embedded else 0)
+    vocab_file = open(vocab_file_str, "wb")
+    vocab_file.write(b"\0" * header_size) # header is filled in at the end
+    sections = [write_sorted_table(vocab_file, feature_id_items),
+                write_table(vocab_file, feature_types),
+                write_table(vocab_file, [] if embedded else locations)]
+    if embedded:
+        align(vocab_file)
+        gazetteer_pos = vocab_file.tell()
+        vocab_file.write(locations.to_bytes())
+    vocab_file.seek(0)
+    vocab_file.write(MAGIC_WITH_GAZETTEER if embedded else MAGIC)
+    for section in sections:
+        vocab_file.write(SECTION.pack(*section))
+    if embedded:
+        vocab_file.write(_GAZETTEER.pack(gazetteer_pos, locations.size))
+    vocab_file.close()
+
+# Memory-maps a vocabulary file written by save_vocabulary. Returns
+# (feature_ids, feature_types, locations): feature_ids and locations are
+# MappedStringTables (locations a gazetteer.Gazetteer if one was saved) that
+# stay backed by the file, feature_types is a small set
+def load_vocabulary(vocab_file_str):
+    vocab_file = open(vocab_file_str, "rb")
+    mapping = mmap.mmap(vocab_file.fileno(), 0, access=mmap.ACCESS_READ)
+    vocab_file.close() # the mapping stays valid after the file is closed
+    if mapping[:len(MAGIC)] not in (MAGIC, MAGIC_WITH_GAZETTEER):
+        raise Exception(vocab_file_str + " is not a vocabulary file!")
+
+    view = memoryview(mapping)
+    tables = []
+    for i in range(3):
+        section = SECTION.unpack_from(mapping, len(MAGIC) + i * SECTION.size)
+        tables.append(MappedStringTable(mapping, view, *section))
+    feature_ids, feature_types, locations = tables
+    if mapping[:len(MAGIC)] == MAGIC_WITH_GAZETTEER:
+        import gazetteer
+        gazetteer_pos = _GAZETTEER.unpack_from(mapping, _HEADER_SIZE)[0]
+        locations = gazetteer.Gazetteer(mapping, gazetteer_pos)
+    return feature_ids, set(feature_types), locations